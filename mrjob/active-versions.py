@@ -8,11 +8,6 @@ import mrjob
 from mrjob.job import MRJob
 import tempfile
 
-try:
-    import simplejson as json
-except ImportError:
-    import json
-
 main_channels = (
     'nightly',
     'aurora',
@@ -25,6 +20,7 @@ def last_saturday(d):
     # .weekday in python starts on 0=Monday
     return d - timedelta(days=(d.weekday() + 2) % 7)
 
+@healthreportutils.memoized
 def start_date(dstr):
     """
     Start measuring a few days before the snapshot was taken to give clients
@@ -34,40 +30,26 @@ def start_date(dstr):
     startdate = last_saturday(snapshot) - timedelta(days=28)
     return startdate
 
-def date_back(start, days):
-    """iter backwards from start for N days"""
-    date = start
-    for n in xrange(0, days):
-        yield date - timedelta(days=n)
-
-def active_day(day):
-    if day is None:
-        return False
-    return any(k != "org.mozilla.crashes.crashes" for k in day)
-
 @healthreportutils.FHRMapper()
 def map(job, key, payload):
-    channel = payload.channel.split("-")[0]
+    dims = payload.dimensions
+    channel = dims.channel
     if channel not in main_channels:
         return
 
-    days = payload.get('data', {}).get('days', {})
-    def get_day(d):
-        dstr = d.strftime("%Y-%m-%d")
-        return days.get(dstr, None)
-
-    version = payload.get("geckoAppInfo", {}).get("version", "?")
+    version = dims.version
     sd = start_date(job.options.start_date)
 
-    active = False
+    windows = payload.activity_windows(sd, 30, ("org.mozilla.appInfo.update",))
+
+    active = windows.any_active(0, 30)
     last_update = None
 
-    for d in date_back(sd, 30):
-        day = get_day(d)
-        if active_day(day):
-            active = True
-            if not last_update and "org.mozilla.appInfo.update" in day:
-                last_update = day
+    for n in windows.active_offsets(0, 30):
+        day = windows.day(n)
+        if "org.mozilla.appInfo.update" in day:
+            last_update = day
+            break
 
     if not active:
         return
@@ -78,14 +60,14 @@ def map(job, key, payload):
     update_auto = last_update.get("org.mozilla.appInfo.update", {}).get("autoDownload", "?")
     update_enabled = last_update.get("org.mozilla.appInfo.update", {}).get("enabled", "?")
 
-    osname = payload.last.get("org.mozilla.sysinfo.sysinfo", {}).get("name", "?")
+    osname = dims.os
 
     yield (("active", osname, version, update_auto, update_enabled), 1)
 
 def reduce(job, k, vlist):
     yield (k, sum(vlist))
 
-class AggJob(MRJob):
+class AggJob(healthreportutils.PrefetchInput, MRJob):
     HADOOP_INPUT_FORMAT="org.apache.hadoop.mapred.SequenceFileAsTextInputFormat"
     INPUT_PROTOCOL = mrjob.protocol.RawProtocol
 
@@ -126,7 +108,7 @@ def getresults(fd):
     fd.seek(0)
     for line in fd:
         k, v = line.split("\t")
-        yield json.loads(k), json.loads(v)
+        yield healthreportutils.json_loads(k), healthreportutils.json_loads(v)
 
 def unwrap(l, v):
     """
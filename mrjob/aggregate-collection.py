@@ -3,8 +3,12 @@ Collect all sorts of aggregate data from a single mapreduce run.
 
 Usage stats:
 * user type: active, new (with date), returning (with date), lost (with date)
+* with --history-start, the same user type for every earlier Saturday back
+  to that date, from the same pass over each payload
 * usage days over the past four Sunday->Saturday weeks
 * usage hours (bucketed) over the past four Sunday->Saturday weeks
+* profile age and ping cadence (bucketed) of the users active in the past
+  six weeks
 
 State data:
 * locale/geo breakdown
@@ -18,6 +22,7 @@ channels grouped into the main channels.
 """
 
 import healthreportutils
+import inventory
 from datetime import date, datetime, timedelta
 import os, shutil, csv
 import sys, codecs
@@ -28,14 +33,34 @@ from mrjob.job import MRJob
 import tempfile
 
 try:
-    import simplejson as json
+    import numpy
 except ImportError:
-    import json
+    numpy = None
 
 # How many days must a user be gone to be considered "lost"?
 LOSS_DAYS = 7 * 6 # 42 days/one release cycle
 TOTAL_DAYS = 180
 
+# How many Sunday->Saturday weeks of usage days/hours to report
+WEEKS = 12
+
+# How many records' weekly usage to reduce at once when numpy is available
+BATCH_RECORDS = 1000
+
+# Payloads this large have their days decoded one at a time.
+STREAM_BYTES = 1024 * 1024
+
+# The oldest day we may look at: a user first active LOSS_DAYS ago is
+# checked for activity over the LOSS_DAYS + TOTAL_DAYS before that.
+WINDOW_DAYS = LOSS_DAYS * 2 + 1 + TOTAL_DAYS
+
+# The day providers map() reads from the activity windows
+DAY_FIELDS = (
+    "org.mozilla.experiments.info",
+    "org.mozilla.appInfo.appinfo",
+    "org.mozilla.appInfo.update",
+)
+
 main_channels = (
     'nightly',
     'aurora',
@@ -48,6 +73,7 @@ def last_saturday(d):
     # .weekday in python starts on 0=Monday
     return d - timedelta(days=(d.weekday() + 2) % 7)
 
+@healthreportutils.memoized
 def start_date(dstr):
     """
     Start measuring a few days before the snapshot was taken to give clients
@@ -57,16 +83,140 @@ def start_date(dstr):
     startdate = last_saturday(snapshot) - timedelta(days=7)
     return startdate
 
-def date_back(start, days):
-    """iter backwards from start for N days"""
-    date = start
-    for n in xrange(0, days):
-        yield date - timedelta(days=n)
+def history_days(job, sd):
+    """How many days before sd the --history-start Saturdays reach back."""
+    return _history_days(job.options.history_start, sd)
+
+@healthreportutils.memoized
+def _history_days(history_start, sd):
+    if history_start is None:
+        return 0
+    start = datetime.strptime(history_start, "%Y-%m-%d").date()
+    first = last_saturday(start)
+    if first < start:
+        first += timedelta(days=7)
+    return max((sd - first).days, 0)
+
+def history_offsets(job, sd):
+    """
+    Offsets from sd of every Saturday from --history-start up to, but not
+    including, sd itself, which is covered by the "users" keys.
+    """
+    return xrange(7, history_days(job, sd) + 1, 7)
+
+def user_type(windows, base):
+    """
+    Classify a user relative to the Saturday at offset base.
+
+    Returns ("active", ""), ("return", date), ("new", date), ("lost", date)
+    or None if the user was not seen in the loss period before that either.
+    """
+    first_active = windows.oldest_active(base, LOSS_DAYS)
+
+    if first_active is not None:
+        first_active_str = windows.datestr(first_active)
+        # Discern active/new/returning
+        if windows.any_active(first_active + 1, LOSS_DAYS):
+            return ("active", "")
+        elif windows.any_active(first_active + LOSS_DAYS + 1, TOTAL_DAYS):
+            return ("return", first_active_str)
+        else:
+            return ("new", first_active_str)
+
+    lost = windows.newest_active(base + LOSS_DAYS, LOSS_DAYS)
+    if lost is not None:
+        return ("lost", windows.datestr(lost))
+
+    return None
 
-def active_day(day):
-    if day is None:
-        return False
-    return any(k != "org.mozilla.crashes.crashes" for k in day)
+def tick_hours(ticks):
+    """Bucket active ticks (5 seconds each) by hour."""
+    return int(round(float(ticks) * 5 / 60 / 60, 1))
+
+def week_counts(windows, channel, version):
+    """The ("days", ...) and ("ticks", ...) counts of one record."""
+    for week in healthreportutils.weekly_windows(0, WEEKS):
+        days, ticks = windows.summarize(week)
+        ending = windows.datestr(week.start)
+
+        # bucket ticks by hour
+        hours = tick_hours(ticks)
+        yield (("days", channel, version, ending, days), 1)
+        yield (("ticks", channel, version, ending, hours), 1)
+
+class WeekBatch(object):
+    """
+    Collects the per-day activity and ticks of many records and reduces them
+    to ("days", ...) and ("ticks", ...) counts with numpy, so that the array
+    overhead is paid once per batch rather than once per record.
+    """
+    def __init__(self, size=BATCH_RECORDS):
+        self.size = size
+        self.groups = {} # (channel, version) -> index
+        self.endings = None
+        self.reset()
+
+    def reset(self):
+        self.records = [] # group index per record
+        self.active = []
+        self.ticks = []
+
+    def add(self, windows, channel, version):
+        """
+        Add one record; returns any counts from a full batch. Records with
+        negative or non-integer ticks, which corrupt payloads have, can't be
+        packed into the integer codes flush() counts, and are counted on
+        their own instead.
+        """
+        ticks = windows.daily_ticks(0, WEEKS * 7)
+        for t in ticks:
+            if t.__class__ not in (int, long) or t < 0:
+                return list(week_counts(windows, channel, version))
+
+        if self.endings is None:
+            self.endings = [windows.datestr(7 * n) for n in xrange(WEEKS)]
+        self.records.append(self.groups.setdefault((channel, version),
+                                                   len(self.groups)))
+        self.active.append(windows.daily_active(0, WEEKS * 7))
+        self.ticks.append(ticks)
+        if len(self.records) >= self.size:
+            return self.flush()
+        return ()
+
+    def flush(self):
+        if not self.records:
+            return []
+
+        n = len(self.records)
+        days = numpy.array(self.active, dtype=numpy.int64).reshape(n, WEEKS, 7).sum(axis=2)
+        ticks = numpy.array(self.ticks, dtype=numpy.int64).reshape(n, WEEKS, 7).sum(axis=2)
+
+        x = ticks.astype(numpy.float64) * 5 / 60 / 60
+        hours = numpy.trunc(numpy.round(x, 1)).astype(numpy.int64)
+        # numpy rounds halves to even and python 2 away from zero; redo any
+        # value that is too close to call the python way.
+        tenths = x * 10
+        for r, w in zip(*numpy.nonzero(numpy.abs(tenths - numpy.floor(tenths) - 0.5) < 1e-6)):
+            hours[r, w] = tick_hours(ticks[r, w])
+
+        names = [None] * len(self.groups)
+        for k, g in self.groups.iteritems():
+            names[g] = k
+
+        groups = numpy.array(self.records, dtype=numpy.int64)[:, None] * WEEKS + numpy.arange(WEEKS)
+        out = []
+        for name, values in (("days", days), ("ticks", hours)):
+            width = int(values.max()) + 1
+            codes, counts = numpy.unique((groups * width + values).ravel(),
+                                         return_counts=True)
+            for code, count in zip(codes.tolist(), counts.tolist()):
+                gw, v = divmod(code, width)
+                g, w = divmod(gw, WEEKS)
+                channel, version = names[g]
+                out.append(((name, channel, version, self.endings[w], v), count))
+
+        self.reset()
+        return out
 
 def logexceptions(func):
     def wrapper(job, k, v):
@@ -83,7 +233,7 @@ def logexceptions(func):
     return wrapper
 
 @logexceptions
-@healthreportutils.FHRMapper()
+@healthreportutils.FHRMapper(stream_threshold=STREAM_BYTES)
 def map(job, key, payload):
     errors = payload.get("errors", [])
     notInitialized = payload.get("notInitialized", 0)
@@ -93,104 +243,88 @@ def map(job, key, payload):
 
     yield (("pingdate", payload.get("thisPingDate", "unknown")), 1)
 
-    channel = payload.channel.split("-")[0]
+    dims = payload.dimensions
+    channel = dims.channel
     if channel not in main_channels:
         return
 
-    days = payload.get('data', {}).get('days', {})
-    def get_day(d):
-        dstr = d.strftime("%Y-%m-%d")
-        return days.get(dstr, None)
-
-    version = payload.get("geckoAppInfo", {}).get("version", "?")
-    sd = start_date(job.options.start_date)
-    week_end = sd # sd is always a Saturday
-
-    for d in date_back(week_end, 42):
-        day = get_day(d)
-        if active_day(day):
-            experiment = day.get("org.mozilla.experiments.info", {}).get("lastActive", "-")
-            yield (("experiment", channel, version, d.strftime("%Y-%m-%d"), experiment), 1)
-
-    def write_week(ending):
-        days = 0
-        ticks = 0.0
-        for d in date_back(ending, 7):
-            day = get_day(d)
-            if active_day(day):
-                days += 1
-                sessions = day.get("org.mozilla.appSessions.previous", None)
-                if sessions is None:
-                    continue
-                dticks = sum(sessions.get("cleanActiveTicks", [])) + \
-                    sum(sessions.get("abortedActiveTicks", []))
-                ticks += dticks
+    version = dims.version
+    sd = start_date(job.options.start_date) # sd is always a Saturday
 
-        # bucket ticks by hour
-        hours = int(round(ticks * 5 / 60 / 60, 1))
-        yield (("days", channel, version, ending.strftime("%Y-%m-%d"), days), 1)
-        yield (("ticks", channel, version, ending.strftime("%Y-%m-%d"), hours), 1)
+    windows = payload.activity_windows(sd, WINDOW_DAYS + history_days(job, sd),
+                                       DAY_FIELDS)
+
+    for n in windows.active_offsets(0, 42):
+        day = windows.day(n)
+        experiment = day.get("org.mozilla.experiments.info", {}).get("lastActive", "-")
+        yield (("experiment", channel, version, windows.datestr(n), experiment), 1)
 
-    for n in xrange(0, 12):
-        for r in write_week(week_end - timedelta(days=7 * n)):
+    batch = getattr(job, "week_batch", None)
+    if batch is not None:
+        for r in batch.add(windows, channel, version):
+            yield r
+    else:
+        for r in week_counts(windows, channel, version):
             yield r
 
-    first_active = None
     last_info = None
     last_update = None
 
-    for d in date_back(sd, LOSS_DAYS):
-        day = get_day(d)
-        if active_day(day):
-            first_active = d
-            if not last_info and "org.mozilla.appInfo.appinfo" in day:
-                last_info = day
-            if not last_update and "org.mozilla.appInfo.update" in day:
-                last_update = day
-
-    if first_active:
-        # Discern active/new/returning
-        for d in date_back(first_active - timedelta(days=1), LOSS_DAYS):
-            if active_day(get_day(d)):
-                yield (("users", channel, "active", ""), 1)
-                break
-        else:
-            for d in date_back(first_active - timedelta(LOSS_DAYS + 1), TOTAL_DAYS):
-                if active_day(get_day(d)):
-                    yield (("users", channel, "return", first_active.strftime("%Y-%m-%d")), 1)
-                    break
-            else:
-                yield (("users", channel, "new", first_active.strftime("%Y-%m-%d")), 1)
-    else:
-        for d in date_back(sd - timedelta(days=LOSS_DAYS), LOSS_DAYS):
-            if active_day(get_day(d)):
-                yield (("users", channel, "lost", d.strftime("%Y-%m-%d")), 1)
-                break
+    for n in windows.active_offsets(0, LOSS_DAYS):
+        day = windows.day(n)
+        if not last_info and "org.mozilla.appInfo.appinfo" in day:
+            last_info = day
+        if not last_update and "org.mozilla.appInfo.update" in day:
+            last_update = day
+
+    for n in history_offsets(job, sd):
+        utype = user_type(windows, n)
+        if utype is not None:
+            yield (("history", windows.datestr(n), channel) + utype, 1)
+
+    utype = user_type(windows, 0)
+    if utype is not None:
+        yield (("users", channel) + utype, 1)
+    if utype is None or utype[0] == "lost":
         return # no other stats if user wasn't active
 
-    # Addon and plugin data: require the v2 probes with correct names
-    addons = payload.last.get("org.mozilla.addons.addons", {})
+    age = healthreportutils.bucket(payload.profile_age,
+                                   healthreportutils.PROFILE_AGE_BUCKETS)
+    cadence = healthreportutils.bucket(payload.ping_cadence(sd),
+                                       healthreportutils.CADENCE_BUCKETS)
+    yield (("profile", channel, version, age, cadence), 1)
+
+    # Addon and plugin data: require the v2 probes with correct names.
+    # Emitted dictionary-encoded; output() decodes them.
+    encoder = inventory.encoder
+    channel_code = healthreportutils.dimension_codes.encode("channel", channel)
+
+    addons = payload.last.get(inventory.ADDONS_PROVIDER, {})
     addons_v = addons.get("_v", "?")
     if addons_v == 2:
         for addonid, data in addons.items():
             if addonid == "_v":
                 continue
-            yield (("addons", channel, addonid,
-                    data.get("userDisabled", "?"),
-                    data.get("appDisabled", "?"),
-                    data.get("name", "?")), 1)
-
-    plugins = payload.last.get("org.mozilla.addons.plugins", {})
+            code = encoder.encode(addonid, data.get("name", "?"))
+            state = inventory.encode_state((data.get("userDisabled", "?"),
+                                            data.get("appDisabled", "?")))
+            for r in encoder.flush():
+                yield r
+            yield (("addons", channel_code, code, state), 1)
+
+    plugins = payload.last.get(inventory.PLUGINS_PROVIDER, {})
     plugins_v = plugins.get("_v", "?")
     if plugins_v == 1:
         for pluginid, data in plugins.items():
             if pluginid == "_v":
                 continue
-            yield (("plugins", channel,
-                    data.get("name", "?"),
-                    data.get("blocklisted", "?"),
-                    data.get("disabled", "?"),
-                    data.get("clicktoplay", "?")), 1)
+            code = encoder.encode(data.get("name", "?"))
+            state = inventory.encode_state((data.get("blocklisted", "?"),
+                                            data.get("disabled", "?"),
+                                            data.get("clicktoplay", "?")))
+            for r in encoder.flush():
+                yield r
+            yield (("plugins", channel_code, code, state), 1)
 
     # everything else
     if not last_info:
@@ -198,15 +332,15 @@ def map(job, key, payload):
     if not last_update:
         last_update = {}
 
-    osname = payload.last.get("org.mozilla.sysinfo.sysinfo", {}).get("name", "?")
-    osversion = payload.last.get("org.mozilla.sysinfo.sysinfo", {}).get("version", "?")
+    osname = dims.os
+    osversion = dims.os_version
     wow64 = payload.last.get("org.mozilla.sysinfo.sysinfo", {}).get("isWow64", "?")
-    locale = payload.last.get("org.mozilla.appInfo.appinfo", {}).get("locale", "?")
+    locale = dims.locale
     default_browser = last_info.get("org.mozilla.appInfo.appinfo", {}).get("isDefaultBrowser", "?")
     telemetry = last_info.get("org.mozilla.appInfo.appinfo", {}).get("isTelemetryEnabled", "?")
     update_auto = last_update.get("org.mozilla.appInfo.update", {}).get("autoDownload", "?")
     update_enabled = last_update.get("org.mozilla.appInfo.update", {}).get("enabled", "?")
-    geo = payload.get("geoCountry", "?")
+    geo = dims.geo
 
     yield (("stats", channel, version, locale, default_browser, telemetry,
             update_auto, update_enabled, geo, addons_v, osname, osversion, wow64), 1)
@@ -216,10 +350,13 @@ def reduce(job, k, vlist):
         print >> sys.stderr, "FOUND exception", vlist
         for v in vlist:
             yield (k, v)
+    elif inventory.is_entry(k):
+        for r in inventory.reduce_entry(k, vlist):
+            yield r
     else:
         yield (k, sum(vlist))
 
-class AggJob(MRJob):
+class AggJob(healthreportutils.PrefetchInput, MRJob):
     HADOOP_INPUT_FORMAT="org.apache.hadoop.mapred.SequenceFileAsTextInputFormat"
     INPUT_PROTOCOL = mrjob.protocol.RawProtocol
 
@@ -230,6 +367,8 @@ class AggJob(MRJob):
             raise Exception("--start-date is required")
         # validate the start date here
         start_date(self.options.start_date)
+        if self.options.history_start is not None:
+            datetime.strptime(self.options.history_start, "%Y-%m-%d")
 
         # Do the big work
         super(AggJob, self).run_job()
@@ -247,20 +386,64 @@ class AggJob(MRJob):
                                     default=None)
         self.add_passthrough_option('--start-date', help="Specify start date",
                                     default=None)
+        self.add_passthrough_option('--rss-cap-mb',
+                                    help="Report map tasks whose RSS goes over this many MB",
+                                    default=None)
+        self.add_passthrough_option('--history-start',
+                                    help="Also classify users for every Saturday since this date",
+                                    default=None)
+        self.add_passthrough_option('--intern-strings', action='store_true',
+                                    help="Share repeated payload strings to save memory, at some decoding speed",
+                                    default=False)
+        self.add_passthrough_option('--map-processes', type='int',
+                                    help="Decode and map records in this many processes per map task",
+                                    default=1)
+
+    def mapper_init(self):
+        self.week_batch = None
+        self.pool = None
+        if self.options.map_processes > 1:
+            stats = None
+            if self.options.intern_strings:
+                stats = healthreportutils.string_table.stats
+            self.pool = healthreportutils.PoolMapper(
+                self, map, self.options.map_processes, combine=self.combine,
+                stats=stats)
+        elif numpy is not None:
+            self.week_batch = WeekBatch()
 
     def mapper(self, key, value):
+        if self.pool is not None:
+            return self.pool.add(key, value)
         return map(self, key, value)
 
+    def mapper_final(self):
+        if self.pool is not None:
+            for r in self.pool.close():
+                yield r
+            if self.options.intern_strings:
+                healthreportutils.report_string_table(self, self.pool.stats())
+            return
+
+        if self.options.intern_strings:
+            healthreportutils.report_string_table(self)
+        if self.week_batch is not None:
+            for r in self.week_batch.flush():
+                yield r
+
     def reducer(self, key, vlist):
         return reduce(self, key, vlist)
 
     combiner = reducer
 
+    def combine(self, key, vlist):
+        return reduce(self, key, vlist)
+
 def getresults(fd):
     fd.seek(0)
     for line in fd:
         k, v = line.split("\t")
-        yield json.loads(k), json.loads(v)
+        yield healthreportutils.json_loads(k), healthreportutils.json_loads(v)
 
 def unwrap(l, v):
     """
@@ -276,6 +459,25 @@ def unwrap(l, v):
     else:
         l.append(v)
 
+def addons_row(k, entries):
+    name, channel, code, state = k
+    addonid, addonname = entries[code]
+    user_disabled, app_disabled = inventory.decode_state(state, 2)
+    return [name, healthreportutils.dimension_codes.decode("channel", channel),
+            addonid, user_disabled, app_disabled, addonname]
+
+def plugins_row(k, entries):
+    name, channel, code, state = k
+    pluginname, = entries[code]
+    return ([name, healthreportutils.dimension_codes.decode("channel", channel),
+             pluginname] + list(inventory.decode_state(state, 3)))
+
+# Decoders of the dictionary-encoded keys, back to their CSV columns
+INVENTORY_ROWS = {
+    "addons": addons_row,
+    "plugins": plugins_row,
+}
+
 def output(fd, path):
     try:
         shutil.rmtree(path)
@@ -283,6 +485,8 @@ def output(fd, path):
         pass
     os.mkdir(path)
 
+    entries = inventory.load_entries(getresults(fd))
+
     writers = {}
     errs = codecs.getwriter("utf-8")(open(os.path.join(path, "exceptions.txt"), "w"))
     for k, v in getresults(fd):
@@ -290,6 +494,10 @@ def output(fd, path):
             print >>errs, "==ERR=="
             print >>errs, v
             continue
+        if inventory.is_entry(k):
+            continue
+        if k[0] in INVENTORY_ROWS:
+            k = INVENTORY_ROWS[k[0]](k, entries)
         l = []
         unwrap(l, k)
         unwrap(l, v)
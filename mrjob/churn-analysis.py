@@ -1,8 +1,15 @@
 """
 Analyze a historical week to understand Firefox churn.
+
+With --extract-dir, each map task writes its per-profile rows straight to a
+binary partition in that directory (see churnextract) instead of sending
+them through the job output. The map tasks write to their local filesystem,
+so this only works with the inline and local runners: it is meant for
+single-machine runs over a copy of the snapshot, not for cluster runs.
 """
 
 import healthreportutils
+import churnextract
 from datetime import date, datetime, timedelta
 import os, shutil, csv
 import sys, codecs
@@ -12,11 +19,6 @@ import mrjob
 from mrjob.job import MRJob
 import tempfile
 
-try:
-    import simplejson as json
-except ImportError:
-    import json
-
 # How many days must a user be gone to be considered "lost"?
 LAG_DAYS = 49
 CRITICAL_WEEKS = 9
@@ -34,6 +36,7 @@ def last_saturday(d):
     # .weekday in python starts on 0=Monday
     return d - timedelta(days=(d.weekday() + 2) % 7)
 
+@healthreportutils.memoized
 def start_date(dstr):
     """
     Measure Sunday-Saturday, for no particularly good reason.
@@ -42,17 +45,6 @@ def start_date(dstr):
     startdate = last_saturday(snapshot)
     return startdate
 
-def date_back(start, days):
-    """iter backwards from start for N days"""
-    date = start
-    for n in xrange(0, days):
-        yield date - timedelta(days=n)
-
-def active_day(day):
-    if day is None:
-        return False
-    return any(k != "org.mozilla.crashes.crashes" for k in day)
-
 def logexceptions(func):
     def wrapper(job, k, v):
         try:
@@ -68,63 +60,49 @@ def logexceptions(func):
 @healthreportutils.FHRMapper()
 def map(job, key, payload):
     pingDate = payload.get("thisPingDate", "unknown")
-    channel = payload.channel.split("-")[0]
+    dims = payload.dimensions
+    channel = dims.channel
     if channel not in main_channels:
         return
 
-    days = payload.get('data', {}).get('days', {})
-    def get_day(d):
-        dstr = d.strftime("%Y-%m-%d")
-        return days.get(dstr, None)
-
-    version = payload.get("geckoAppInfo", {}).get("version", "?")
+    version = dims.version
     sd = start_date(job.options.start_date)
 
+    windows = payload.activity_windows(sd, TOTAL_DAYS,
+                                       ("org.mozilla.appInfo.appinfo",))
+
     # Was the user active at all in the 49 days prior to the snapshot
-    recent_usage = 0
-    for d in date_back(sd, LAG_DAYS):
-        day = get_day(d)
-        if active_day(day):
-            recent_usage = 1
-            break
+    recent_usage = 1 if windows.any_active(0, LAG_DAYS) else 0
 
     # For each of the "critical" 9 weeks, record both usage days and default
     # status.
     week_actives = []
-    for weekno in xrange(0, CRITICAL_WEEKS):
-        week_end = sd - timedelta(days=LAG_DAYS + 7 * weekno)
-
-        active_days = 0
+    for week in healthreportutils.weekly_windows(LAG_DAYS, CRITICAL_WEEKS):
         default_browser = None
 
-        for d in date_back(week_end, 7):
-            day = get_day(d)
-            if active_day(day):
-                active_days += 1
-                if default_browser is None:
-                    default_browser = day.get("org.mozilla.appInfo.appinfo", {}).get("isDefaultBrowser", None)
+        for n in windows.active_offsets(*week):
+            default_browser = windows.day(n).get("org.mozilla.appInfo.appinfo", {}).get("isDefaultBrowser", None)
+            if default_browser is not None:
+                break
 
         if default_browser is None:
             default_browser = "?"
 
-        week_actives.append(active_days)
+        week_actives.append(windows.active_days(*week))
         week_actives.append(default_browser)
 
+    prior_start = LAG_DAYS + 7 * CRITICAL_WEEKS
     prior_usage = 0
-    for d in date_back(sd - timedelta(days=LAG_DAYS + 7 * CRITICAL_WEEKS),
-                       180 - (LAG_DAYS + 7 * CRITICAL_WEEKS)):
-        day = get_day(d)
-        if active_day(day):
-            prior_usage = True
-            break
+    if windows.any_active(prior_start, TOTAL_DAYS - prior_start):
+        prior_usage = True
 
-    osname = payload.last.get("org.mozilla.sysinfo.sysinfo", {}).get("name", "?")
-    locale = payload.last.get("org.mozilla.appInfo.appinfo", {}).get("locale", "?")
-    geo = payload.get("geoCountry", "?")
+    osname = dims.os
+    locale = dims.locale
+    geo = dims.geo
 
     yield ("result", [channel, osname, locale, geo, pingDate, recent_usage] + week_actives + [prior_usage])
 
-class AggJob(MRJob):
+class AggJob(healthreportutils.PrefetchInput, MRJob):
     HADOOP_INPUT_FORMAT="org.apache.hadoop.mapred.SequenceFileAsTextInputFormat"
     INPUT_PROTOCOL = mrjob.protocol.RawProtocol
 
@@ -136,9 +114,22 @@ class AggJob(MRJob):
         # validate the start date here
         start_date(self.options.start_date)
 
+        extract_dir = self.options.extract_dir
+        if extract_dir is not None:
+            # Map tasks on a cluster would write the partitions to their own
+            # node's disk, where the driver never sees them.
+            if self.options.runner not in ("inline", "local"):
+                raise Exception("--extract-dir only works with -r inline or -r local")
+            extract_dir = self.options.extract_dir = os.path.abspath(extract_dir)
+            if not os.path.isdir(extract_dir):
+                os.makedirs(extract_dir)
+
         # Do the big work
         super(AggJob, self).run_job()
 
+        if extract_dir is not None:
+            return
+
         # Produce the separated output files
         outpath = self.options.output_path
         if outpath is None:
@@ -152,15 +143,41 @@ class AggJob(MRJob):
                                     default=None)
         self.add_passthrough_option('--start-date', help="Specify start date",
                                     default=None)
+        self.add_passthrough_option('--extract-dir',
+                                    help="Write binary per-profile partitions to this local directory; inline and local runners only, not for cluster runs",
+                                    default=None)
+
+    def generate_passthrough_arguments(self):
+        args = super(AggJob, self).generate_passthrough_arguments()
+        if self.options.extract_dir is not None:
+            # Local map tasks run in their own working directory, so pass
+            # them the absolute path; the last --extract-dir given wins.
+            args = args + ['--extract-dir',
+                           os.path.abspath(self.options.extract_dir)]
+        return args
+
+    def mapper_init(self):
+        self.extract = None
+        if self.options.extract_dir is not None:
+            self.extract = churnextract.PartitionWriter(self.options.extract_dir,
+                                                        CRITICAL_WEEKS)
 
     def mapper(self, key, value):
-        return map(self, key, value)
+        for k, row in map(self, key, value):
+            if self.extract is None:
+                yield k, row
+            else:
+                self.extract.write(row)
+
+    def mapper_final(self):
+        if self.extract is not None:
+            self.extract.close()
 
 def getresults(fd):
     fd.seek(0)
     for line in fd:
         k, v = line.split("\t")
-        yield json.loads(k), json.loads(v)
+        yield healthreportutils.json_loads(k), healthreportutils.json_loads(v)
 
 def unwrap(l, v):
     """
@@ -1,5 +1,10 @@
 """
 Analyze a range of dates for new and lost Firefox profiles.
+
+By default only the release channel is measured with a LAG_WEEKS lag. Pass
+--sweep-lag-weeks and/or --sweep-channels to evaluate a grid of churn
+definitions in one pass; gain/loss keys are then tagged with the channel
+and lag they were computed for.
 """
 
 import healthreportutils
@@ -12,11 +17,6 @@ import mrjob
 from mrjob.job import MRJob
 import tempfile
 
-try:
-    import simplejson as json
-except ImportError:
-    import json
-
 DAYS_PER_WEEK = 7
 TOTAL_DAYS = 168
 
@@ -25,6 +25,9 @@ LAG_WEEKS = 4
 
 TOTAL_WEEKS = TOTAL_DAYS / DAYS_PER_WEEK
 
+# The trailing dimensions of every key, emitted as dimension codes
+KEY_DIMENSIONS = ("os", "locale", "geo")
+
 main_channels = (
     'nightly',
     'aurora',
@@ -37,6 +40,7 @@ def last_saturday(d):
     # .weekday in python starts on 0=Monday
     return d - timedelta(days=(d.weekday() + 2) % 7)
 
+@healthreportutils.memoized
 def start_date(dstr):
     """
     Measure Sunday-Saturday, for no particularly good reason.
@@ -45,59 +49,68 @@ def start_date(dstr):
     startdate = last_saturday(snapshot)
     return startdate
 
-def date_back(start, days, skip=1):
-    """iter backwards from start for N days"""
-    date = start
-    for n in xrange(0, days, skip):
-        yield date - timedelta(days=n)
+def sweep_params(options):
+    """
+    Return (lag_weeks, channels) to evaluate. If neither sweep option was
+    given this is the single historical definition, and keys are emitted
+    untagged.
+    """
+    lags = [LAG_WEEKS]
+    if options.sweep_lag_weeks:
+        lags = [int(l) for l in options.sweep_lag_weeks.split(",")]
+        for lag in lags:
+            if lag < 1 or lag * 2 >= TOTAL_WEEKS:
+                raise ValueError("lag of %i weeks is out of range" % (lag,))
+
+    channels = ["release"]
+    if options.sweep_channels:
+        channels = options.sweep_channels.split(",")
 
-def active_day(day):
-    if day is None:
-        return False
-    return any(k != "org.mozilla.crashes.crashes" for k in day)
+    return lags, channels
+
+def is_sweep(options):
+    return bool(options.sweep_lag_weeks or options.sweep_channels)
 
 @healthreportutils.FHRMapper()
 def map(job, key, payload):
     pingDate = payload.get("thisPingDate", "unknown")
-    channel = payload.channel.split("-")[0]
-    if channel != "release":
+    dims = payload.dimensions
+    channel = dims.channel
+    if channel not in job.channels:
         return
 
-    days = payload.get('data', {}).get('days', {})
-    def get_day(d):
-        dstr = d.strftime("%Y-%m-%d")
-        return days.get(dstr, None)
-
     sd = start_date(job.options.start_date)
 
-    weeks = [] # newest to oldest
-
-    for weekno in range(0, TOTAL_WEEKS):
-        active = False
-        week_end = sd - timedelta(days=DAYS_PER_WEEK * weekno)
-        for d in date_back(week_end, 7):
-            day = get_day(d)
-            if active_day(day):
-                active = True
-        weeks.append(active)
-
-    osname = payload.last.get("org.mozilla.sysinfo.sysinfo", {}).get("name", "?")
-    locale = payload.last.get("org.mozilla.appInfo.appinfo", {}).get("locale", "?")
-    geo = payload.get("geoCountry", "?")
-
-    # Figure out when this user appeared/disappeared
-    for weekno in range(LAG_WEEKS, TOTAL_WEEKS - LAG_WEEKS):
-        if weeks[weekno]:
-            week_end = sd - timedelta(days=DAYS_PER_WEEK * weekno)
-            if not any(weeks[weekno+1:weekno+LAG_WEEKS+1]):
-                yield (("gain", week_end.strftime("%Y-%m-%d"), osname, locale, geo), 1)
-            if not any(weeks[weekno-LAG_WEEKS:weekno]):
-                yield (("loss", week_end.strftime("%Y-%m-%d"), osname, locale, geo), 1)
+    windows = payload.activity_windows(sd, TOTAL_DAYS)
+
+    # newest to oldest
+    weeks = [windows.any_active(*week) for week in
+             healthreportutils.weekly_windows(0, TOTAL_WEEKS, DAYS_PER_WEEK)]
+
+    # Emitted as dimension codes; output() decodes them
+    osname, locale, geo = healthreportutils.dimension_codes.encode_all(
+        KEY_DIMENSIONS, (dims.os, dims.locale, dims.geo))
+
+    # In sweep mode keys carry the parameter set they were computed with
+    if job.sweep:
+        tag = lambda lag: (channel, lag)
+    else:
+        tag = lambda lag: ()
+
+    # Figure out when this user appeared/disappeared, once per lag length
+    for lag in job.lags:
+        for weekno in range(lag, TOTAL_WEEKS - lag):
+            if weeks[weekno]:
+                week_end = windows.datestr(DAYS_PER_WEEK * weekno)
+                if not any(weeks[weekno+1:weekno+lag+1]):
+                    yield (("gain",) + tag(lag) + (week_end, osname, locale, geo), 1)
+                if not any(weeks[weekno-lag:weekno]):
+                    yield (("loss",) + tag(lag) + (week_end, osname, locale, geo), 1)
 
 def reduce(job, k, vlist):
     yield (k, sum(vlist))
 
-class AggJob(MRJob):
+class AggJob(healthreportutils.PrefetchInput, MRJob):
     HADOOP_INPUT_FORMAT="org.apache.hadoop.mapred.SequenceFileAsTextInputFormat"
     INPUT_PROTOCOL = mrjob.protocol.RawProtocol
 
@@ -106,8 +119,9 @@ class AggJob(MRJob):
 
         if self.options.start_date is None:
             raise Exception("--start-date is required")
-        # validate the start date here
+        # validate the start date and sweep parameters here
         start_date(self.options.start_date)
+        sweep_params(self.options)
 
         # Do the big work
         super(AggJob, self).run_job()
@@ -125,6 +139,16 @@ class AggJob(MRJob):
                                     default=None)
         self.add_passthrough_option('--start-date', help="Specify start date",
                                     default=None)
+        self.add_passthrough_option('--sweep-lag-weeks',
+                                    help="Comma-separated lag lengths in weeks to evaluate in one pass",
+                                    default=None)
+        self.add_passthrough_option('--sweep-channels',
+                                    help="Comma-separated channels to evaluate in one pass",
+                                    default=None)
+
+    def mapper_init(self):
+        self.lags, self.channels = sweep_params(self.options)
+        self.sweep = is_sweep(self.options)
 
     def mapper(self, key, value):
         return map(self, key, value)
@@ -138,7 +162,7 @@ def getresults(fd):
     fd.seek(0)
     for line in fd:
         k, v = line.split("\t")
-        yield json.loads(k), json.loads(v)
+        yield healthreportutils.json_loads(k), healthreportutils.json_loads(v)
 
 def unwrap(l, v):
     """
@@ -163,7 +187,10 @@ def output(fd, path):
 
     writers = {}
     errs = codecs.getwriter("utf-8")(open(os.path.join(path, "exceptions.txt"), "w"))
+    codes = healthreportutils.dimension_codes
+    n = len(KEY_DIMENSIONS)
     for k, v in getresults(fd):
+        k = k[:-n] + list(codes.decode_all(KEY_DIMENSIONS, k[-n:]))
         l = []
         unwrap(l, k)
         unwrap(l, v)
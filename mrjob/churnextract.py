@@ -0,0 +1,180 @@
+"""
+Binary per-profile extracts written by churn-analysis.
+
+Each map task writes one partition file holding one fixed-size record per
+profile:
+
+  [channel, osname, locale, geo, pingDate, recent_usage]
+  + [active_days, default_browser] * weeks
+  + [prior_usage]
+
+The five string fields are stored as codes into a per-partition string
+table, which is appended to the file when the partition is closed.
+default_browser is stored as -1 when unknown ("?").
+
+Reading is done with scan()/aggregate(), which process the partitions of an
+extract directory in parallel. Functions passed to them must be defined at
+module level so that they can be sent to the worker processes.
+"""
+
+import os, struct
+import multiprocessing
+from collections import Counter
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+MAGIC = "FHRX"
+FORMAT_VERSION = 1
+PARTITION_SUFFIX = ".extract"
+
+_header = struct.Struct("<4sBB")
+_trailer = struct.Struct("<Q")
+
+STRING_FIELDS = 5
+
+def record_struct(weeks):
+    return struct.Struct("<" + "I" * STRING_FIELDS + "B" + "Bb" * weeks + "B")
+
+_ATTEMPT_VARS = ("mapreduce_task_attempt_id", "mapred_task_id")
+
+def attempt_name():
+    """A name unique to this map task attempt."""
+    for var in _ATTEMPT_VARS:
+        if var in os.environ:
+            return os.environ[var]
+    return "local-%i" % (os.getpid(),)
+
+def task_name():
+    """
+    A partition name unique to this map task, and the same for all of its
+    attempts (retries and speculative twins).
+    """
+    for var in ("mapreduce_task_id", "mapred_tip_id"):
+        if var in os.environ:
+            return os.environ[var]
+    for var in _ATTEMPT_VARS:
+        if var in os.environ:
+            # attempt_<job>_m_<task>_<n> -> task_<job>_m_<task>
+            task = os.environ[var].rsplit("_", 1)[0]
+            if task.startswith("attempt_"):
+                task = "task_" + task[len("attempt_"):]
+            return task
+    return "local-%i" % (os.getpid(),)
+
+class PartitionWriter(object):
+    def __init__(self, dirpath, weeks, name=None):
+        if name is None:
+            name = task_name()
+        self.path = os.path.join(dirpath, name + PARTITION_SUFFIX)
+        # Write under a temporary name per attempt so that readers never see
+        # a partial partition. Every attempt of a task renames its file to
+        # the same partition name, so the last attempt to finish replaces
+        # the others' partition instead of adding a second one.
+        self.tmppath = "%s.%s.tmp" % (self.path, attempt_name())
+        self.fd = open(self.tmppath, "wb")
+        self.fd.write(_header.pack(MAGIC, FORMAT_VERSION, weeks))
+        self.record = record_struct(weeks)
+        self.weeks = weeks
+        self.strings = []
+        self.codes = {}
+
+    def _code(self, s):
+        try:
+            return self.codes[s]
+        except KeyError:
+            c = self.codes[s] = len(self.strings)
+            self.strings.append(s)
+            return c
+
+    def write(self, row):
+        fields = [self._code(s) for s in row[:STRING_FIELDS]]
+        fields.append(row[STRING_FIELDS])
+        for i in xrange(self.weeks):
+            active_days, default_browser = row[STRING_FIELDS + 1 + i * 2:STRING_FIELDS + 3 + i * 2]
+            if default_browser == "?" or default_browser is None:
+                default_browser = -1
+            fields.append(active_days)
+            fields.append(int(default_browser))
+        fields.append(int(row[-1]))
+        self.fd.write(self.record.pack(*fields))
+
+    def close(self):
+        offset = self.fd.tell()
+        self.fd.write(json.dumps(self.strings))
+        self.fd.write(_trailer.pack(offset))
+        self.fd.close()
+        os.rename(self.tmppath, self.path)
+
+def partitions(dirpath):
+    return sorted(os.path.join(dirpath, f) for f in os.listdir(dirpath)
+                  if f.endswith(PARTITION_SUFFIX))
+
+def read_partition(path):
+    """Iterate over the rows of one partition, decoded to their CSV form."""
+    fd = open(path, "rb")
+    data = fd.read()
+    fd.close()
+
+    magic, version, weeks = _header.unpack_from(data, 0)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError("%s is not a churn extract partition" % (path,))
+
+    offset, = _trailer.unpack_from(data, len(data) - _trailer.size)
+    strings = json.loads(data[offset:len(data) - _trailer.size])
+
+    record = record_struct(weeks)
+    for pos in xrange(_header.size, offset, record.size):
+        fields = record.unpack_from(data, pos)
+        row = [strings[c] for c in fields[:STRING_FIELDS]]
+        row.append(fields[STRING_FIELDS])
+        for i in xrange(weeks):
+            active_days, default_browser = fields[STRING_FIELDS + 1 + i * 2:STRING_FIELDS + 3 + i * 2]
+            row.append(active_days)
+            row.append("?" if default_browser == -1 else default_browser)
+        row.append(fields[-1])
+        yield row
+
+def _scan_partition(args):
+    path, func = args
+    return func(read_partition(path))
+
+def scan(dirpath, func, processes=None):
+    """
+    Call func(rows) on every partition in parallel and return the list of
+    results, one per partition.
+    """
+    paths = partitions(dirpath)
+    if processes == 1 or len(paths) < 2:
+        return [func(read_partition(p)) for p in paths]
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        return pool.map(_scan_partition, [(p, func) for p in paths])
+    finally:
+        pool.close()
+        pool.join()
+
+class _Aggregator(object):
+    def __init__(self, key, predicate):
+        self.key = key
+        self.predicate = predicate
+
+    def __call__(self, rows):
+        c = Counter()
+        for row in rows:
+            if self.predicate is None or self.predicate(row):
+                c[self.key(row)] += 1
+        return c
+
+def aggregate(dirpath, key, predicate=None, processes=None):
+    """
+    Count profiles by key(row), optionally only those where predicate(row)
+    is true. Returns a Counter.
+    """
+    total = Counter()
+    for c in scan(dirpath, _Aggregator(key, predicate), processes):
+        total.update(c)
+    return total
@@ -1,5 +1,9 @@
 """
 Collect crash stats.
+
+version.csv breaks crashes (by type), active days, session seconds and
+active ticks down by the application version in use on each day, from the
+version changes recorded in the payload.
 """
 
 import healthreportutils
@@ -14,11 +18,6 @@ import tempfile
 
 from collections import defaultdict
 
-try:
-    import simplejson as json
-except ImportError:
-    import json
-
 def intorstr(v):
     try:
         return int(v)
@@ -42,6 +41,7 @@ def last_saturday(d):
     # .weekday in python starts on 0=Monday
     return d - timedelta(days=(d.weekday() + 2) % 7)
 
+@healthreportutils.memoized
 def start_date(dstr):
     """
     Start measuring a few days before the snapshot was taken to give clients
@@ -51,12 +51,6 @@ def start_date(dstr):
     startdate = last_saturday(snapshot) - timedelta(days=7)
     return startdate
 
-def date_back(start, days):
-    """iter backwards from start for N days"""
-    date = start
-    for n in xrange(0, days):
-        yield date - timedelta(days=n)
-
 def active_day(day):
     if day is None:
         return False
@@ -74,16 +68,19 @@ def logexceptions(func):
     return wrapper
 
 def day_sessions(day):
-    """returns (seconds, ticks) for a day"""
+    """returns (seconds, ticks, session count) for a day"""
     seconds = 0
     ticks = 0
+    count = 0
     sessions = day.get("org.mozilla.appSessions.previous", None)
     if sessions:
-        seconds += sum(sessions.get("cleanTotalTime", []))
-        seconds += sum(sessions.get("abortedTotalTime", []))
+        clean = sessions.get("cleanTotalTime", [])
+        aborted = sessions.get("abortedTotalTime", [])
+        seconds += sum(clean) + sum(aborted)
+        count += len(clean) + len(aborted)
         ticks += sum(sessions.get("cleanActiveTicks", []))
         ticks += sum(sessions.get("abortedActiveTicks", []))
-    return seconds, ticks
+    return seconds, ticks, count
 
 class CrashType(object):
     __slots__ = ('crashes', 'submitSuccess', 'submitFailure')
@@ -95,38 +92,69 @@ class CrashType(object):
 
 crashtypes = ("main-crash", "plugin-crash", "plugin-hang", "gmplugin-crash", "content-crash")
 
+# Per-user crash counts are bucketed 0..USER_CRASHES_CAP; the last bucket
+# holds everyone with USER_CRASHES_CAP crashes or more.
+USER_CRASHES_CAP = 8
+
+# Active ticks are 5 seconds each
+TICKS_PER_HOUR = 12 * 60
+
+def crash_rates(main, plugin, ticks, sessions):
+    """
+    Per-user crash rates to sketch, as (metric, rate) pairs. A rate is left
+    out when the user had no active time or no sessions to divide by.
+    """
+    if ticks:
+        hours = float(ticks) / TICKS_PER_HOUR
+        yield ("main-per-active-hour", main / hours)
+        yield ("plugin-per-active-hour", plugin / hours)
+    if sessions:
+        yield ("main-per-session", float(main) / sessions)
+        yield ("plugin-per-session", float(plugin) / sessions)
+
 @logexceptions
 @healthreportutils.FHRMapper()
 def mapjob(job, key, payload):
-    channel = payload.channel.split("-")[0]
+    dims = payload.dimensions
+    channel = dims.channel
     if channel not in main_channels:
         return
 
     os = payload.last.get("org.mozilla.appInfo.appinfo", {}).get("os", "?")
 
     days = payload.get('data', {}).get('days', {})
-    def get_day(d):
-        dstr = d.strftime("%Y-%m-%d")
-        return days.get(dstr, None)
 
     sd = start_date(job.options.start_date)
 
     crashes = defaultdict(CrashType)
     seconds = 0
     ticks = 0
+    sessions = 0
     daycount = 0
 
-    for d in date_back(sd, 7):
-        dstr = d.strftime("%Y-%m-%d")
-        day = get_day(d)
-        if active_day(day):
+    # (version, measure) -> total, attributing each day to the version in
+    # use that day
+    timeline = payload.version_timeline
+    byversion = defaultdict(int)
+
+    for d, dstr in healthreportutils.probe_dates(sd, 7):
+        day = days.get(dstr, None)
+        active = active_day(day)
+        if active:
             yield (("daily-active", dstr, channel, os), 1)
             daycount += 1
 
         if not day:
             continue
 
-        s, t = day_sessions(day)
+        version = timeline.version_on(dstr)
+        if active:
+            byversion[version, "active-days"] += 1
+
+        s, t, n = day_sessions(day)
+        sessions += n
+        byversion[version, "seconds"] += s
+        byversion[version, "ticks"] += t
 
         yield (("daily-seconds", dstr, channel, os), s)
         seconds += s
@@ -143,6 +171,7 @@ def mapjob(job, key, payload):
             c = cdata.get(type, 0)
             yield (("daily", dstr, type, channel, os), c)
             crashes[type].crashes += c
+            byversion[version, type] += c
 
             c = cdata.get(type + "-submission-succeeded", 0)
             yield (("daily-submission-succeeded", dstr, type, channel, os), c)
@@ -152,11 +181,20 @@ def mapjob(job, key, payload):
             yield (("daily-submission-failed", dstr, type, channel, os), c)
             crashes[type].submitFailure += c
 
+    for (version, measure), n in byversion.iteritems():
+        yield (("version", channel, os, version, measure), n)
+
     if not daycount:
         return
 
-    totals = tuple(crashes[type].crashes for type in crashtypes)
-    yield (("totals", channel, os) + totals, 1)
+    main = crashes["main-crash"].crashes
+    plugin = crashes["plugin-crash"].crashes + crashes["plugin-hang"].crashes
+    yield (("user-crashes", channel, os, "main", min(main, USER_CRASHES_CAP)), 1)
+    yield (("user-crashes", channel, os, "plugin", min(plugin, USER_CRASHES_CAP)), 1)
+
+    for metric, rate in crash_rates(main, plugin, ticks, sessions):
+        yield (("sketch", channel, os, dims.version, metric),
+               healthreportutils.QuantileSketch.of(rate).to_list())
 
     yield (("daycount", channel, os), daycount)
     yield (("seconds", channel, os), seconds)
@@ -172,10 +210,15 @@ def reduce(job, k, vlist):
         print >> sys.stderr, "FOUND exception", vlist
         for v in vlist:
             yield (k, v)
+    elif k[0] == "sketch":
+        sketch = healthreportutils.QuantileSketch()
+        for v in vlist:
+            sketch.merge(healthreportutils.QuantileSketch.from_list(v))
+        yield (k, sketch.to_list())
     else:
         yield (k, sum(vlist))
 
-class AggJob(MRJob):
+class AggJob(healthreportutils.PrefetchInput, MRJob):
     HADOOP_INPUT_FORMAT="org.apache.hadoop.mapred.SequenceFileAsTextInputFormat"
     INPUT_PROTOCOL = mrjob.protocol.RawProtocol
 
@@ -216,7 +259,7 @@ def getresults(fd):
     fd.seek(0)
     for line in fd:
         k, v = line.split("\t")
-        yield json.loads(k), json.loads(v)
+        yield healthreportutils.json_loads(k), healthreportutils.json_loads(v)
 
 def unwrap(l, v):
     """
@@ -248,7 +291,11 @@ def output(fd, path):
             continue
         l = []
         unwrap(l, k)
-        unwrap(l, v)
+        if k[0] == "sketch":
+            # keep the sketch in one column
+            l.append(healthreportutils.json.dumps(v))
+        else:
+            unwrap(l, v)
         fname = l.pop(0)
         if fname in writers:
             w = writers[fname]
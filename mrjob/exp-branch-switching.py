@@ -1,3 +1,18 @@
+"""
+Experiment cohorts: for every experiment recorded in
+org.mozilla.experiments.info over the EXPERIMENT_DAYS before --start-date,
+collect in one pass
+
+* branches: the branch sequences profiles went through, newest first
+* enrolled: the first day each profile was seen in the experiment
+* cohort, days, active-days, crashes: per branch, the profiles, the days
+  the experiment was recorded, the active days of those and their browser
+  crashes
+
+profiles.csv holds the number of profiles scanned. Pass --experiment to
+report only one experiment id.
+"""
+
 import healthreportutils
 from datetime import date, datetime, timedelta
 import os, shutil, csv
@@ -8,8 +23,9 @@ import mrjob
 from mrjob.job import MRJob
 import tempfile
 
-import simplejson as json
+EXPERIMENT_DAYS = 42
 
+@healthreportutils.memoized
 def start_date(dstr):
     """
     Start measuring a few days before the snapshot was taken to give clients
@@ -18,12 +34,6 @@ def start_date(dstr):
     snapshot = datetime.strptime(dstr, "%Y-%m-%d").date()
     return snapshot
 
-def date_back(start, days):
-    """iter backwards from start for N days"""
-    date = start
-    for n in xrange(0, days):
-        yield date - timedelta(days=n)
-
 def logexceptions(func):
     def wrapper(job, k, v):
         try:
@@ -38,26 +48,24 @@ def logexceptions(func):
 @logexceptions
 @healthreportutils.FHRMapper()
 def map(job, key, payload):
-    days = payload.get('data', {}).get('days', {})
-    def get_day(d):
-        dstr = d.strftime("%Y-%m-%d")
-        return days.get(dstr, None)
-
-    branches = []
+    yield (("profiles",), 1)
 
     sd = start_date(job.options.start_date)
-    for d in date_back(sd, 42):
-        day = get_day(d)
-        if day is None:
-            continue
-        experiment = day.get("org.mozilla.experiments.info", {}).get("lastActive", "-")
-        if experiment != "experiment-branch-test-nightly@experiments.mozilla.org":
+    cohorts = payload.experiments(sd, EXPERIMENT_DAYS)
+
+    for experiment, cohort in cohorts.iteritems():
+        if job.options.experiment and experiment != job.options.experiment:
             continue
-        branch = day.get("org.mozilla.experiments.info", {}).get("lastActiveBranch")
-        if len(branches) == 0 or branches[-1] != branch:
-            branches.append(branch)
 
-    yield (("branches", tuple(branches)), 1)
+        yield (("branches", experiment, tuple(cohort.branches)), 1)
+        yield (("enrolled", experiment, cohort.enrolled), 1)
+        for branch, n in cohort.days.iteritems():
+            yield (("cohort", experiment, branch), 1)
+            yield (("days", experiment, branch), n)
+            yield (("active-days", experiment, branch),
+                   cohort.active_days.get(branch, 0))
+            yield (("crashes", experiment, branch),
+                   cohort.crashes.get(branch, 0))
 
 def reduce(job, k, vlist):
     if k == "exception":
@@ -67,7 +75,7 @@ def reduce(job, k, vlist):
     else:
         yield (k, sum(vlist))
 
-class AggJob(MRJob):
+class AggJob(healthreportutils.PrefetchInput, MRJob):
     HADOOP_INPUT_FORMAT="org.apache.hadoop.mapred.SequenceFileAsTextInputFormat"
     INPUT_PROTOCOL = mrjob.protocol.RawProtocol
 
@@ -95,6 +103,9 @@ class AggJob(MRJob):
                                     default=None)
         self.add_passthrough_option('--start-date', help="Specify start date",
                                     default=None)
+        self.add_passthrough_option('--experiment',
+                                    help="Only report this experiment id (default: all)",
+                                    default=None)
 
     def mapper(self, key, value):
         return map(self, key, value)
@@ -108,7 +119,7 @@ def getresults(fd):
     fd.seek(0)
     for line in fd:
         k, v = line.split("\t")
-        yield json.loads(k), json.loads(v)
+        yield healthreportutils.json_loads(k), healthreportutils.json_loads(v)
 
 def unwrap(l, v):
     """
@@ -14,7 +14,19 @@
 
 """Utilities for querying Firefox Health Report data using jydoop."""
 
+import bisect
 import datetime
+import gc
+import math
+import mmap
+import multiprocessing
+import os
+import Queue
+import re
+import resource
+import tempfile
+import threading
+import time
 from collections import namedtuple
 
 try:
@@ -31,6 +43,16 @@ SessionStartTimes = namedtuple('SessionStartTimes', ('main', 'first_pain',
     'session_restored'))
 
 
+Window = namedtuple('Window', ('start', 'length'))
+
+
+WindowSummary = namedtuple('WindowSummary', ('active_days', 'ticks'))
+
+
+Dimensions = namedtuple('Dimensions', ('channel', 'os', 'os_version',
+    'locale', 'geo', 'version'))
+
+
 class HealthReportError(Exception):
     """Base exception for all FHR exceptions."""
 
@@ -58,6 +80,267 @@ class CachedProperty(object):
         return value
 
 
+def _sample_payload():
+    """A synthetic payload shaped like FHR data, for comparing decoders."""
+    start = datetime.date(2014, 1, 1)
+    days = {}
+    for n in xrange(120):
+        d = (start + datetime.timedelta(days=n)).strftime('%Y-%m-%d')
+        days[d] = {
+            'org.mozilla.appSessions.previous': {
+                '_v': 3,
+                'cleanActiveTicks': [n * 7, 12, 400],
+                'cleanTotalTime': [n * 60, 3600, 19000],
+                'main': [1203, 998], 'firstPaint': [2011, 1730],
+                'sessionRestored': [2340, 1980],
+            },
+            'org.mozilla.searches.counts': {
+                '_v': 2, 'google.urlbar': n % 5, 'yahoo.searchbar': 1,
+            },
+            'org.mozilla.appInfo.appinfo': {
+                '_v': 1, 'isDefaultBrowser': n % 2, 'isTelemetryEnabled': 0,
+            },
+            'org.mozilla.crashes.crashes': {'_v': 4, 'main-crash': n % 3},
+        }
+    return json.dumps({
+        'version': 2,
+        'thisPingDate': '2014-05-01',
+        'geoCountry': 'US',
+        'geckoAppInfo': {'updateChannel': 'release', 'version': '29.0',
+            'vendor': 'Mozilla', 'platformBuildID': '20140421221237'},
+        'data': {
+            'last': {
+                'org.mozilla.addons.addons': {'_v': 2,
+                    '{d10d0bf8-f5b5-c8b4-a8b2-2b9879e08c5d}': {
+                        'name': u'Adblock Plus \u00e9', 'userDisabled': False,
+                        'appDisabled': False, 'scope': 1.5}},
+                'org.mozilla.sysinfo.sysinfo': {'name': 'WINNT',
+                    'version': '6.1', 'memoryMB': 4095, 'isWow64': True},
+            },
+            'days': days,
+        },
+    })
+
+
+def _candidate_json_backends():
+    """Yield (name, loads) for every JSON decoder that can be imported."""
+    import json as stdlib_json
+    yield 'json', stdlib_json.loads
+
+    try:
+        import simplejson
+        yield 'simplejson', simplejson.loads
+    except ImportError:
+        pass
+
+    try:
+        import ujson
+        yield 'ujson', lambda s: ujson.loads(s, precise_float=True)
+    except ImportError:
+        pass
+
+
+# Inputs every backend must decode exactly as the standard library does.
+# Some decoders get escapes such as "\/" or surrogate pairs wrong, which a
+# payload-shaped sample alone would not show.
+_JSON_CHECKS = (
+    r'"\/"',
+    r'"a\\b\"c\n\t\r\b\f"',
+    r'"\u00e9\u4e2d\u0000"',
+    r'"\ud83d\ude00"',
+    '"\xc3\xa9\xe4\xb8\xad"',
+    '[0.1, 1e-07, 2.5E+10, -0.0, 123456789.123456789]',
+    '[9223372036854775807, 18446744073709551616, -1, 0]',
+    '{"a": {"": [], "b": null, "c": true, "d": false}, "\\u00e9": "x"}',
+)
+
+
+def _json_backend_ok(loads):
+    """Whether loads decodes every _JSON_CHECKS input like the stdlib."""
+    import json as stdlib_json
+    for case in _JSON_CHECKS:
+        try:
+            if loads(case) != stdlib_json.loads(case):
+                return False
+        except Exception:
+            return False
+    return True
+
+
+def benchmark_json_backends(sample=None, rounds=5):
+    """Time every available JSON decoder on sample.
+
+    Returns a list of (seconds, name, loads) sorted fastest first. Decoders
+    that fail _JSON_CHECKS or the sample, or decode the sample differently
+    from the standard library, are left out, so any backend returned gives
+    identical results.
+    """
+    if sample is None:
+        sample = _sample_payload()
+
+    expected = None
+    results = []
+    for name, loads in _candidate_json_backends():
+        if not _json_backend_ok(loads):
+            continue
+        try:
+            decoded = loads(sample)
+        except Exception:
+            continue
+
+        if expected is None:
+            expected = decoded
+        elif decoded != expected:
+            continue
+
+        best = None
+        for i in xrange(rounds):
+            t = time.time()
+            loads(sample)
+            t = time.time() - t
+            if best is None or t < best:
+                best = t
+
+        results.append((best, name, loads))
+
+    results.sort(key=lambda r: r[0])
+    return results
+
+
+json_backend = None
+json_loads = None
+
+
+def _json_backend_cache():
+    """Path of the file caching the fastest backend for this interpreter."""
+    return os.environ.get('FHR_JSON_BACKEND_CACHE', os.path.join(
+        tempfile.gettempdir(), 'fhr-json-backend-%i' % os.getuid()))
+
+
+def _json_backend_cache_key(names):
+    versions = ['%s-%s' % (n, getattr(sys.modules.get(n), '__version__', '?'))
+        for n in names]
+    return '%s %s %s' % (sys.executable, sys.version.split()[0],
+        ','.join(versions))
+
+
+def select_json_backend(name=None, sample=None):
+    """Route payload and job output decoding through a JSON backend.
+
+    A named backend is used if it is available and passes _JSON_CHECKS.
+    Otherwise the fastest backend is used: it is benchmarked once and the
+    choice is cached in a file (FHR_JSON_BACKEND_CACHE, by default in the
+    temporary directory), so that later tasks on the same machine skip the
+    benchmark. The FHR_JSON_BACKEND environment variable forces a backend at
+    import. Returns the name of the selected backend.
+    """
+    global json_backend, json_loads
+
+    candidates = dict(_candidate_json_backends())
+    if name is not None:
+        if name not in candidates or not _json_backend_ok(candidates[name]):
+            raise HealthReportError('JSON backend %s is not available' % name)
+        json_backend, json_loads = name, candidates[name]
+        return json_backend
+
+    path = _json_backend_cache()
+    key = _json_backend_cache_key(sorted(candidates))
+    if sample is None:
+        try:
+            with open(path) as fd:
+                cached_key, cached = fd.read().rstrip('\n').split('\t')
+            if cached_key == key and cached in candidates and \
+                    _json_backend_ok(candidates[cached]):
+                json_backend, json_loads = cached, candidates[cached]
+                return json_backend
+        except (IOError, ValueError):
+            pass
+
+    t, json_backend, json_loads = benchmark_json_backends(sample)[0]
+
+    if sample is None:
+        try:
+            tmppath = '%s.%i' % (path, os.getpid())
+            with open(tmppath, 'w') as fd:
+                fd.write('%s\t%s\n' % (key, json_backend))
+            os.rename(tmppath, path)
+        except (IOError, OSError):
+            pass
+
+    return json_backend
+
+
+select_json_backend(os.environ.get('FHR_JSON_BACKEND', None))
+
+
+class StringTable(object):
+    """Bounded per-process table of canonical string objects.
+
+    Payloads repeat the same provider names, date keys, channels, locales
+    and addon IDs millions of times over. Routing decoded strings through
+    this table makes them share one object each, which saves allocations
+    and lets equality checks and hashing short-circuit on identity. Once
+    the table holds max_size strings (checked once per decoded object), new
+    strings are passed through untouched.
+    """
+
+    def __init__(self, max_size=100000):
+        self.max_size = max_size
+        self._table = {}
+        self.lookups = 0
+
+    def intern(self, s):
+        self.lookups += 1
+        if len(self._table) < self.max_size:
+            return self._table.setdefault(s, s)
+        return self._table.get(s, s)
+
+    def intern_pairs(self, pairs, _unicode=unicode, _str=str):
+        """JSON object_pairs_hook interning keys and string values."""
+        table = self._table
+        if len(table) < self.max_size:
+            canonical = table.setdefault
+        else:
+            canonical = table.get
+
+        d = {}
+        for k, v in pairs:
+            c = v.__class__
+            if c is _unicode or c is _str:
+                v = canonical(v, v)
+            d[canonical(k, k)] = v
+
+        self.lookups += len(pairs)
+        return d
+
+    def stats(self):
+        """Table size, number of keys looked up, and whether it is full."""
+        return {
+            'size': len(self._table),
+            'lookups': self.lookups,
+            'full': int(len(self._table) >= self.max_size),
+        }
+
+
+string_table = StringTable()
+
+
+_interning_decoder = json.JSONDecoder(
+    object_pairs_hook=string_table.intern_pairs)
+
+
+def report_string_table(job, stats=None, group='string_table'):
+    """Publish string table stats as job counters.
+
+    stats defaults to those of this process's string_table; a PoolMapper
+    passes the sum over its workers instead.
+    """
+    if stats is None:
+        stats = string_table.stats()
+    for k, v in stats.iteritems():
+        job.increment_counter(group, k, v)
+
+
 class FHRPayload(object):
     """Represents a Firefox Health Report payload.
 
@@ -65,10 +348,17 @@ class FHRPayload(object):
     parsed JSON object) or through various helper properties and methods.
     """
 
-    def __init__(self, raw):
-        """Initialize from raw, unparsed JSON data."""
+    def __init__(self, raw, intern_strings=False):
+        """Initialize from raw, unparsed JSON data.
 
-        self._o = json.loads(raw)
+        If intern_strings is True, keys and string values are shared
+        through string_table.
+        """
+
+        if intern_strings:
+            self._o = _interning_decoder.decode(raw)
+        else:
+            self._o = json_loads(raw)
         self.raw = raw
         self.raw_size = len(raw)
 
@@ -142,6 +432,24 @@ class FHRPayload(object):
     def last(self):
         return self._o.get('data', {}).get('last', {})
 
+    @CachedProperty
+    def dimensions(self):
+        """The Dimensions most breakdowns are keyed on.
+
+        channel is the channel family (e.g. "beta" for "beta-cck-foo").
+        Missing values are "?".
+        """
+        sysinfo = self.last.get('org.mozilla.sysinfo.sysinfo', {})
+        appinfo = self.last.get('org.mozilla.appInfo.appinfo', {})
+
+        return Dimensions(
+            channel=self.channel.split('-')[0],
+            os=sysinfo.get('name', '?'),
+            os_version=sysinfo.get('version', '?'),
+            locale=appinfo.get('locale', '?'),
+            geo=self._o.get('geoCountry', '?'),
+            version=self._o.get('geckoAppInfo', {}).get('version', '?'))
+
     @CachedProperty
     def days(self):
         """Days in this payload.
@@ -150,6 +458,77 @@ class FHRPayload(object):
         """
         return sorted(self._o.get('data', {}).get('days', {}).keys())
 
+    @CachedProperty
+    def ping_ordinals(self):
+        """Ordinals of the days in this payload, sorted.
+
+        Keys which aren't dates are left out. The days are not decoded.
+        """
+        ordinals = [o for o in map(day_ordinal, self.days) if o is not None]
+        ordinals.sort()
+        return ordinals
+
+    def ping_intervals(self, end, recent=7):
+        """Days between pings up to end, as the Pig UsageFrequency UDF has them.
+
+        These are the gaps between the last recent + 1 days on or before
+        end, oldest first, followed by the days from the last of them to
+        end unless that is 0.
+        """
+        o = self.ping_ordinals
+        end = end.toordinal()
+        count = bisect.bisect_right(o, end)
+        last = o[max(count - recent - 1, 0):count]
+
+        intervals = [b - a for a, b in zip(last, last[1:])]
+        if last and last[-1] != end:
+            intervals.append(end - last[-1])
+        return intervals
+
+    def ping_cadence(self, end, recent=7):
+        """The median of ping_intervals(end, recent), or None.
+
+        fhr_usage_frequency.pig emits every interval UsageFrequency returns
+        and takes the median over all profiles of a group. This is the
+        median of one profile's intervals instead, so that it can be used
+        as a key dimension. The middle two are averaged for an even count.
+        """
+        intervals = sorted(self.ping_intervals(end, recent))
+        if not intervals:
+            return None
+        mid = len(intervals) // 2
+        if len(intervals) % 2:
+            return intervals[mid]
+        return (intervals[mid - 1] + intervals[mid]) / 2.0
+
+    @CachedProperty
+    def profile_creation_date(self):
+        """The date the profile was created, or None if unknown."""
+        age = self.last.get('org.mozilla.profile.age', {})
+        try:
+            days = int(age['profileCreation'])
+        except (KeyError, TypeError, ValueError):
+            return None
+        if days <= 0:
+            return None
+
+        try:
+            return _EPOCH + datetime.timedelta(days=days)
+        except OverflowError:
+            return None
+
+    @CachedProperty
+    def profile_age(self):
+        """Days from profile creation to thisPingDate, or None if unknown."""
+        created = self.profile_creation_date
+        if created is None or 'thisPingDate' not in self._o:
+            return None
+
+        try:
+            return (self.this_ping_date - created).days
+        except ValueError:
+            return None
+
     @property
     def system_info(self):
         return self.last.get('org.mozilla.sysinfo.sysinfo', None)
@@ -224,7 +603,7 @@ class FHRPayload(object):
 
         days = self.days
         if reverse:
-            days.reverse()
+            days = days[::-1]
 
         for day in days:
             yield day, data[day]
@@ -281,18 +660,830 @@ class FHRPayload(object):
                 yield day, SessionInfo(total=total, clean=False,
                     active_ticks=ticks)
 
+    @CachedProperty
+    def search_counts(self):
+        """The payload's search counters, as a SearchCounts."""
+        return SearchCounts(self._o.get('data', {}).get('days', {}))
+
     def daily_search_counts(self):
-        for day, counts in self.daily_provider_data('org.mozilla.searches.counts'):
-            if counts['_v'] != 2:
-                continue
+        """Iterate over (day, engine, where, count) for v2 search counters."""
+        return iter(self.search_counts)
+
+    @CachedProperty
+    def version_timeline(self):
+        """The VersionTimeline of this payload."""
+        return VersionTimeline(self._o.get('data', {}).get('days', {}),
+            self._o.get('geckoAppInfo', {}).get('version', '?'))
+
+    def experiments(self, end, span):
+        """Obtain the ExperimentCohorts of the span days ending at end."""
+        return ExperimentCohorts(self._o.get('data', {}).get('days', {}), end,
+            span)
+
+    def activity_windows(self, end, span, fields=()):
+        """Obtain an ActivityWindows over the span days ending at end.
 
+        fields names the day providers the caller reads through day().
+        """
+        return ActivityWindows(self._o.get('data', {}).get('days', {}), end,
+            span, fields)
+
+    def release(self):
+        """Drop the raw and decoded data along with any cached properties.
+
+        The payload must not be used afterwards, apart from raw_size. This
+        lets the object graph be freed as soon as a mapper is done with a
+        record, even if something still holds on to the payload itself.
+        """
+        raw_size = self.raw_size
+        self.__dict__.clear()
+        self.raw_size = raw_size
+
+
+class DimensionDictionary(object):
+    """Fixed small-integer codes for common dimension values.
+
+    encode() replaces a known value with its code and passes anything else
+    through unchanged, so a key built from encoded dimensions is smaller to
+    emit and sort, and decode() restores it at output time. Integers are the
+    only thing decode() treats as codes, so an integer value that isn't in
+    the table is passed through as a string instead. The codes are
+    list positions in a table shipped with this module, which makes them the
+    same in every task. Only ever append to the tables.
+    """
+
+    def __init__(self, tables):
+        self.tables = tables
+        self.codes = dict((field, dict((v, i) for i, v in enumerate(values)))
+            for field, values in tables.iteritems())
+
+    def encode(self, field, value):
+        try:
+            return self.codes[field][value]
+        except KeyError:
+            pass
+        except TypeError:
+            return value
+
+        if isinstance(value, (int, long)) and not isinstance(value, bool):
+            return unicode(value)
+        return value
+
+    def decode(self, field, value):
+        if isinstance(value, (int, long)) and not isinstance(value, bool):
+            return self.tables[field][value]
+        return value
+
+    def encode_all(self, fields, values):
+        return tuple(self.encode(f, v) for f, v in zip(fields, values))
+
+    def decode_all(self, fields, values):
+        return tuple(self.decode(f, v) for f, v in zip(fields, values))
+
+
+dimension_codes = DimensionDictionary({
+    'channel': ['?', 'release', 'beta', 'aurora', 'nightly', 'esr', 'default',
+        'unknown'],
+    'os': ['?', 'WINNT', 'Darwin', 'Linux', 'Android', 'FreeBSD', 'OpenBSD',
+        'SunOS', 'NetBSD'],
+    'os_version': ['?', '5.0', '5.1', '5.2', '6.0', '6.1', '6.2', '6.3',
+        '6.4', '10.0'] + ['%i.%i.0' % (major, minor)
+        for major in xrange(9, 15) for minor in xrange(10)],
+    'locale': ['?'] + (
+        'ach af an ar as ast be bg bn-BD bn-IN br bs ca cs csb cy da de dsb '
+        'el en-GB en-US en-ZA eo es-AR es-CL es-ES es-MX et eu fa ff fi fr '
+        'fy-NL ga-IE gd gl gu-IN he hi-IN hr hsb hu hy-AM id is it ja ja-JP-mac '
+        'kk km kn ko ku lij lt lv mai mk ml mr ms my nb-NO nl nn-NO or pa-IN '
+        'pl pt-BR pt-PT rm ro ru si sk sl son sq sr sv-SE sw ta te th tr uk '
+        'ur uz vi xh zh-CN zh-TW zu').split(),
+    'geo': ['?', '??'] + (
+        'AD AE AF AG AI AL AM AO AQ AR AS AT AU AW AX AZ BA BB BD BE BF BG BH '
+        'BI BJ BL BM BN BO BQ BR BS BT BV BW BY BZ CA CC CD CF CG CH CI CK CL '
+        'CM CN CO CR CU CV CW CX CY CZ DE DJ DK DM DO DZ EC EE EG EH ER ES ET '
+        'FI FJ FK FM FO FR GA GB GD GE GF GG GH GI GL GM GN GP GQ GR GS GT GU '
+        'GW GY HK HM HN HR HT HU ID IE IL IM IN IO IQ IR IS IT JE JM JO JP KE '
+        'KG KH KI KM KN KP KR KW KY KZ LA LB LC LI LK LR LS LT LU LV LY MA MC '
+        'MD ME MF MG MH MK ML MM MN MO MP MQ MR MS MT MU MV MW MX MY MZ NA NC '
+        'NE NF NG NI NL NO NP NR NU NZ OM PA PE PF PG PH PK PL PM PN PR PS PT '
+        'PW PY QA RE RO RS RU RW SA SB SC SD SE SG SH SI SJ SK SL SM SN SO SR '
+        'SS ST SV SX SY SZ TC TD TF TG TH TJ TK TL TM TN TO TR TT TV TW TZ UA '
+        'UG UM US UY UZ VA VC VE VG VI VN VU WF WS YE YT ZA ZM ZW A1 A2 AP EU '
+        'O1').split(),
+    'version': ['?'],
+})
+
+
+_SEARCHES_PROVIDER = u'org.mozilla.searches.counts'
+
+# Counter key -> (engine, where). Payloads repeat a small set of engines
+# and search sources, so each key is only split once per task.
+_search_keys = {}
+
+
+def split_search_key(k):
+    """Split a search counter key such as "google.searchbar"."""
+    try:
+        return _search_keys[k]
+    except KeyError:
+        if '.' in k:
+            r = tuple(k.rsplit('.', 1))
+        else:
+            r = (k, '?')
+        if len(_search_keys) < 10000:
+            _search_keys[k] = r
+        return r
+
+
+class SearchCounts(object):
+    """The search counters of a payload, parsed once.
+
+    For each day with counters, holds the counter version and a list of
+    (engine, where, count) entries in the order the payload lists them.
+    Iterating gives (day, engine, where, count) for version 2 counters,
+    oldest day first, like FHRPayload.daily_search_counts always has.
+    """
+
+    def __init__(self, days):
+        self.by_day = {}
+        for dstr, day in days.iteritems():
+            counts = day.get(_SEARCHES_PROVIDER, None)
+            if not counts:
+                continue
+            entries = []
             for k, v in counts.iteritems():
                 if k == '_v':
                     continue
+                engine, where = split_search_key(k)
+                entries.append((engine, where, v))
+            self.by_day[dstr] = (counts.get('_v', None), entries)
+
+    def __iter__(self):
+        for dstr in sorted(self.by_day):
+            version, entries = self.by_day[dstr]
+            if version != 2:
+                continue
+            for engine, where, count in entries:
+                yield dstr, engine, where, count
+
+    def first_engine(self, dstr):
+        """The engine of the first counter listed on a day, or None."""
+        version, entries = self.by_day.get(dstr, (None, ()))
+        if not entries:
+            return None
+        return entries[0][0]
+
+    def daily_engine_totals(self):
+        """{(day, engine): count}, including (day, "total") for every day."""
+        totals = {}
+        for dstr, engine, where, count in self:
+            totals[dstr, engine] = totals.get((dstr, engine), 0) + count
+            totals[dstr, 'total'] = totals.get((dstr, 'total'), 0) + count
+        return totals
+
+    def where_totals(self):
+        """{where: count} over all days, including "total"."""
+        totals = {}
+        for dstr, engine, where, count in self:
+            totals[where] = totals.get(where, 0) + count
+            totals['total'] = totals.get('total', 0) + count
+        return totals
+
+
+# Decoded keys are unicode; comparing against a unicode constant avoids
+# coercing a str on every comparison.
+_CRASHES_PROVIDER = u'org.mozilla.crashes.crashes'
+
+
+def active_day(day):
+    """Whether a day entry records any activity other than crashes."""
+    if day is None:
+        return False
+    return any(k != _CRASHES_PROVIDER for k in day)
+
+
+_EPOCH = datetime.date(1970, 1, 1)
+
+
+# Upper bounds of the profile age buckets, in days, as in fhr_uniques.pig
+PROFILE_AGE_BUCKETS = (1, 7, 30, 180, 365, 366)
+
+
+# Upper bounds of the ping cadence buckets, in days between pings
+CADENCE_BUCKETS = (1, 2, 7, 14, 30, 31)
+
+
+def bucket(value, bounds):
+    """The smallest of the sorted bounds that is >= value.
+
+    Values past the last bound fall into it, and None is "?".
+    """
+    if value is None:
+        return '?'
+    i = bisect.bisect_left(bounds, value)
+    return bounds[min(i, len(bounds) - 1)]
+
+
+def parse_day(dstr):
+    """Convert a YYYY-MM-DD string to a datetime.date."""
+    return datetime.date(int(dstr[0:4]), int(dstr[5:7]), int(dstr[8:10]))
+
+
+DAY_CACHE_LIMIT = 1 << 16
 
-                engine, where = k.rsplit('.', 1)
+_day_ordinals = {}
 
-                yield day, engine, where, v
+
+def day_ordinal(dstr):
+    """The ordinal of a YYYY-MM-DD string, or None if it isn't a date.
+
+    Every record of a task holds mostly the same days, so the results are
+    kept for the whole task rather than parsed again for each payload.
+    """
+    try:
+        return _day_ordinals[dstr]
+    except KeyError:
+        pass
+
+    try:
+        o = parse_day(dstr).toordinal()
+    except (TypeError, ValueError):
+        o = None
+
+    if len(_day_ordinals) >= DAY_CACHE_LIMIT:
+        _day_ordinals.clear()
+    _day_ordinals[dstr] = o
+    return o
+
+
+def memoized(func):
+    """Cache func's result for each set of (hashable) arguments.
+
+    Meant for the date arithmetic that every record of a task repeats with
+    the same job options, such as each job's start_date().
+    """
+    cache = {}
+
+    def wrapper(*args):
+        try:
+            return cache[args]
+        except KeyError:
+            r = cache[args] = func(*args)
+            return r
+    wrapper.__name__ = func.__name__
+    wrapper.__doc__ = func.__doc__
+    return wrapper
+
+
+class ProbeDates(object):
+    """The dates of offsets [0, span) back from end, in date_back() order.
+
+    Holds each date along with its YYYY-MM-DD string and ordinal, and maps
+    the strings back to offsets. Iterating gives (date, string) pairs. Use
+    probe_dates() to share one instance per (end, span) within a task.
+    """
+
+    def __init__(self, end, span):
+        self.end = end
+        self.span = span
+        self.dates = [end - datetime.timedelta(days=n) for n in xrange(span)]
+        self.strings = [d.strftime("%Y-%m-%d") for d in self.dates]
+        self.ordinals = [d.toordinal() for d in self.dates]
+        self.offsets = dict((dstr, n) for n, dstr in enumerate(self.strings))
+        self.pairs = zip(self.dates, self.strings)
+
+    def __len__(self):
+        return self.span
+
+    def __iter__(self):
+        return iter(self.pairs)
+
+
+probe_dates = memoized(ProbeDates)
+
+
+def weekly_windows(start, count, length=7):
+    """Windows for count consecutive weeks, newest first, from offset start."""
+    return [Window(start + length * n, length) for n in xrange(count)]
+
+
+SKETCH_ACCURACY = 0.02
+
+_INF = float('inf')
+
+
+class QuantileSketch(object):
+    """Mergeable sketch of a distribution of non-negative values.
+
+    Values are counted in logarithmic buckets, so a quantile is estimated
+    to within SKETCH_ACCURACY relative error however many values were
+    added. Merging two sketches adds their bucket counts, which keeps
+    combiners and reducers cheap. to_list() and from_list() convert to and
+    from a compact JSON-friendly form:
+
+        [zeros, bucket, count, bucket, count, ...]
+    """
+
+    def __init__(self):
+        self.gamma = (1 + SKETCH_ACCURACY) / (1 - SKETCH_ACCURACY)
+        self.log_gamma = math.log(self.gamma)
+        self.zeros = 0
+        self.buckets = {}
+        self.count = 0
+
+    @classmethod
+    def of(cls, value):
+        """A sketch of the single value."""
+        sketch = cls()
+        sketch.add(value)
+        return sketch
+
+    def add(self, value, count=1):
+        """Count value count times.
+
+        Negative values, which corrupt payloads produce, count as 0. NaN and
+        infinite values are skipped.
+        """
+        if value != value or value in (_INF, -_INF):
+            return
+        if value <= 0:
+            self.zeros += count
+        else:
+            i = int(math.ceil(math.log(value) / self.log_gamma))
+            self.buckets[i] = self.buckets.get(i, 0) + count
+        self.count += count
+
+    def merge(self, other):
+        self.zeros += other.zeros
+        for i, count in other.buckets.iteritems():
+            self.buckets[i] = self.buckets.get(i, 0) + count
+        self.count += other.count
+        return self
+
+    def quantile(self, q):
+        """The estimated q-quantile (0 <= q <= 1), or None if empty."""
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if seen > rank:
+            return 0.0
+        for i in sorted(self.buckets):
+            seen += self.buckets[i]
+            if seen > rank:
+                # The middle of the bucket (gamma**(i-1), gamma**i]
+                return 2 * self.gamma ** i / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+    def to_list(self):
+        l = [self.zeros]
+        for i in sorted(self.buckets):
+            l.append(i)
+            l.append(self.buckets[i])
+        return l
+
+    @classmethod
+    def from_list(cls, l):
+        sketch = cls()
+        sketch.zeros = l[0]
+        sketch.count = l[0]
+        for n in xrange(1, len(l) - 1, 2):
+            sketch.buckets[l[n]] = l[n + 1]
+            sketch.count += l[n + 1]
+        return sketch
+
+
+_VERSIONS_PROVIDER = u'org.mozilla.appInfo.versions'
+
+
+class VersionTimeline(object):
+    """Which application version was in use on each day.
+
+    FHR records org.mozilla.appInfo.versions on the days the version
+    changed, which is what the VersionOnDate Pig UDF reads too. Those days
+    are collected once into a sorted changepoint list; version_on() then
+    finds the change in effect for a day by bisection. When a day lists
+    several versions the last one is taken, as it is the one the day ended
+    on. Days before the first change are "?", and a payload that recorded
+    no change at all is taken to have run current_version throughout.
+    """
+
+    def __init__(self, days, current_version='?'):
+        changes = []
+        for dstr, day in days.iteritems():
+            versions = day.get(_VERSIONS_PROVIDER, None)
+            if not versions:
+                continue
+            v = versions.get('appVersion', None) or versions.get('version', None)
+            if v:
+                changes.append((dstr, v[-1]))
+        changes.sort()
+
+        self.current_version = current_version
+        self.dates = [c[0] for c in changes]
+        self.versions = [c[1] for c in changes]
+
+    def __len__(self):
+        return len(self.dates)
+
+    def version_on(self, dstr):
+        """The version in use on the YYYY-MM-DD day dstr."""
+        if not self.dates:
+            return self.current_version
+        i = bisect.bisect_right(self.dates, dstr)
+        if i == 0:
+            return '?'
+        return self.versions[i - 1]
+
+
+_EXPERIMENTS_PROVIDER = u'org.mozilla.experiments.info'
+
+
+def day_crash_count(day):
+    """Browser crashes recorded on a day, for any crashes provider version."""
+    cdata = day.get(_CRASHES_PROVIDER, None)
+    if not cdata:
+        return 0
+    if cdata.get('_v', 0) >= 4:
+        return cdata.get('main-crash', 0)
+    return cdata.get('pending', 0) + cdata.get('submitted', 0)
+
+
+class ExperimentCohort(object):
+    """What one payload recorded about one experiment.
+
+    branches is the sequence of branches the profile was seen on, newest
+    first, with consecutive repeats collapsed. enrolled and last_seen are
+    the oldest and newest YYYY-MM-DD days the experiment was active. days,
+    active_days and crashes count, per branch, the days the experiment was
+    recorded, the days of those with activity, and their browser crashes.
+    """
+
+    __slots__ = ('branches', 'enrolled', 'last_seen', 'days', 'active_days',
+        'crashes')
+
+    def __init__(self):
+        self.branches = []
+        self.enrolled = None
+        self.last_seen = None
+        self.days = {}
+        self.active_days = {}
+        self.crashes = {}
+
+    def add_day(self, dstr, branch, day):
+        if not self.branches or self.branches[-1] != branch:
+            self.branches.append(branch)
+        if self.last_seen is None:
+            self.last_seen = dstr
+        self.enrolled = dstr
+
+        self.days[branch] = self.days.get(branch, 0) + 1
+        if active_day(day):
+            self.active_days[branch] = self.active_days.get(branch, 0) + 1
+        crashes = day_crash_count(day)
+        if crashes:
+            self.crashes[branch] = self.crashes.get(branch, 0) + crashes
+
+
+class ExperimentCohorts(object):
+    """The experiments a payload took part in over a range of days.
+
+    The days are scanned once, newest first, and every experiment named as
+    lastActive in org.mozilla.experiments.info gets an ExperimentCohort.
+    Behaves as a dict of experiment id to ExperimentCohort.
+    """
+
+    def __init__(self, days, end, span):
+        self.cohorts = {}
+        for d, dstr in probe_dates(end, span):
+            day = days.get(dstr, None)
+            if not day:
+                continue
+            info = day.get(_EXPERIMENTS_PROVIDER, None)
+            if not info:
+                continue
+            experiment = info.get('lastActive', None)
+            if experiment is None:
+                continue
+            cohort = self.cohorts.get(experiment)
+            if cohort is None:
+                cohort = self.cohorts[experiment] = ExperimentCohort()
+            cohort.add_day(dstr, info.get('lastActiveBranch', None), day)
+
+    def __len__(self):
+        return len(self.cohorts)
+
+    def __iter__(self):
+        return iter(self.cohorts)
+
+    def __contains__(self, experiment):
+        return experiment in self.cohorts
+
+    def __getitem__(self, experiment):
+        return self.cohorts[experiment]
+
+    def get(self, experiment, default=None):
+        return self.cohorts.get(experiment, default)
+
+    def iteritems(self):
+        return self.cohorts.iteritems()
+
+
+class ActivityWindows(object):
+    """Activity and active ticks for a range of days, indexed backwards.
+
+    Offset 0 is the end date itself and offset n is n days before it, which
+    is the order date_back() walks in. The payload days are scanned once to
+    build prefix sums, after which any window of offsets can be summarized
+    in constant time. Days outside of the span are treated as inactive.
+
+    The days themselves are not kept, only the flags and sums, so memory
+    does not grow with the payload. Mappers which need more of a day list
+    the providers they read in fields, and day() returns just those.
+    """
+
+    def __init__(self, days, end, span, fields=()):
+        self.end = end
+        self.span = span
+
+        self._fields = {}
+        self._active = active = [0] * span
+        self._ticks = ticks = [0] * span
+
+        self.probes = probes = probe_dates(end, span)
+        offsets = probes.offsets
+        for dstr, day in days.iteritems():
+            n = offsets.get(dstr)
+            if n is None:
+                continue
+
+            kept = dict((f, day[f]) for f in fields if f in day)
+            if kept:
+                self._fields[n] = kept
+            if not active_day(day):
+                continue
+            active[n] = 1
+
+            sessions = day.get('org.mozilla.appSessions.previous', None)
+            if sessions:
+                ticks[n] = sum(sessions.get('cleanActiveTicks', [])) + \
+                    sum(sessions.get('abortedActiveTicks', []))
+
+        # _active_sum[n] and _ticks_sum[n] cover offsets [0, n).
+        self._active_sum = [0] * (span + 1)
+        self._ticks_sum = [0] * (span + 1)
+        # _newer[n] is the smallest active offset >= n, _older[n] the largest
+        # active offset < n; None when there is no such day.
+        self._newer = [None] * (span + 1)
+        self._older = [None] * (span + 1)
+
+        for n in xrange(span):
+            self._active_sum[n + 1] = self._active_sum[n] + active[n]
+            self._ticks_sum[n + 1] = self._ticks_sum[n] + ticks[n]
+            self._older[n + 1] = n if active[n] else self._older[n]
+
+        for n in xrange(span - 1, -1, -1):
+            self._newer[n] = n if active[n] else self._newer[n + 1]
+
+    def _clamp(self, start, length):
+        lo = min(max(start, 0), self.span)
+        hi = min(max(start + length, lo), self.span)
+        return lo, hi
+
+    def date(self, n):
+        """The date at offset n."""
+        if 0 <= n < self.span:
+            return self.probes.dates[n]
+        return self.end - datetime.timedelta(days=n)
+
+    def datestr(self, n):
+        """The date at offset n, as YYYY-MM-DD."""
+        if 0 <= n < self.span:
+            return self.probes.strings[n]
+        return self.date(n).strftime("%Y-%m-%d")
+
+    def day(self, n):
+        """The providers listed in fields of the day at offset n.
+
+        An empty dict if the day has none of them, None outside the span.
+        """
+        if n < 0 or n >= self.span:
+            return None
+        return self._fields.get(n, {})
+
+    def active(self, n):
+        return self.active_days(n, 1) == 1
+
+    def daily_active(self, start, length):
+        """List of 0/1 activity flags for offsets [start, start + length)."""
+        lo, hi = self._clamp(start, length)
+        return self._active[lo:hi] + [0] * (length - (hi - lo))
+
+    def daily_ticks(self, start, length):
+        """List of per-day active ticks for offsets [start, start + length)."""
+        lo, hi = self._clamp(start, length)
+        return self._ticks[lo:hi] + [0] * (length - (hi - lo))
+
+    def active_days(self, start, length):
+        """Number of active days in offsets [start, start + length)."""
+        lo, hi = self._clamp(start, length)
+        return self._active_sum[hi] - self._active_sum[lo]
+
+    def any_active(self, start, length):
+        return self.active_days(start, length) > 0
+
+    def ticks(self, start, length):
+        """Active ticks recorded in offsets [start, start + length)."""
+        lo, hi = self._clamp(start, length)
+        return self._ticks_sum[hi] - self._ticks_sum[lo]
+
+    def newest_active(self, start, length):
+        """The smallest active offset in the window, or None."""
+        lo, hi = self._clamp(start, length)
+        n = self._newer[lo]
+        if n is None or n >= hi:
+            return None
+        return n
+
+    def oldest_active(self, start, length):
+        """The largest active offset in the window, or None."""
+        lo, hi = self._clamp(start, length)
+        n = self._older[hi]
+        if n is None or n < lo:
+            return None
+        return n
+
+    def active_offsets(self, start, length):
+        """Iterate over the active offsets in the window, newest first."""
+        lo, hi = self._clamp(start, length)
+        n = self._newer[lo]
+        while n is not None and n < hi:
+            yield n
+            n = self._newer[n + 1]
+
+    def summarize(self, window):
+        return WindowSummary(self.active_days(*window), self.ticks(*window))
+
+    def query(self, windows):
+        """Summarize many windows at once.
+
+        windows is a dict of name -> Window; returns a dict of
+        name -> WindowSummary.
+        """
+        return dict((name, self.summarize(w)) for name, w in windows.iteritems())
+
+
+_decoder = json.JSONDecoder()
+_whitespace = re.compile(r'[ \t\n\r]*')
+_structure = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"|[{}\[\]]')
+
+
+def _skip_ws(s, i):
+    return _whitespace.match(s, i).end()
+
+
+def _skip_value(s, i):
+    """Return the index just past the JSON value starting at s[i].
+
+    Containers are skipped by matching brackets outside of strings, without
+    building any objects.
+    """
+    if s[i] not in '{[':
+        return _decoder.raw_decode(s, i)[1]
+
+    depth = 0
+    for m in _structure.finditer(s, i):
+        c = m.group()[0]
+        if c == '{' or c == '[':
+            depth += 1
+        elif c == '}' or c == ']':
+            depth -= 1
+            if depth == 0:
+                return m.end()
+
+    raise ValueError('Unterminated JSON container at %d' % i)
+
+
+def _scan_object(s, i):
+    """Scan the JSON object at s[i] without decoding its values.
+
+    Returns a list of (key, value_start, value_end) and the index just past
+    the object.
+    """
+    try:
+        i = _skip_ws(s, i)
+        if s[i] != '{':
+            raise ValueError('Expected object at %d' % i)
+
+        entries = []
+        i = _skip_ws(s, i + 1)
+        if s[i] == '}':
+            return entries, i + 1
+
+        while True:
+            key, i = _decoder.raw_decode(s, i)
+            i = _skip_ws(s, i)
+            if s[i] != ':':
+                raise ValueError('Expected : at %d' % i)
+            start = _skip_ws(s, i + 1)
+            end = _skip_value(s, start)
+            entries.append((key, start, end))
+
+            i = _skip_ws(s, end)
+            if s[i] == ',':
+                i = _skip_ws(s, i + 1)
+            elif s[i] == '}':
+                return entries, i + 1
+            else:
+                raise ValueError('Expected , or } at %d' % i)
+    except IndexError:
+        raise ValueError('Truncated JSON object')
+
+
+class LazyDays(object):
+    """Read-only mapping of day -> day data that decodes days on access.
+
+    Only the offset of each day in the raw payload is kept. Every access
+    decodes that day afresh and nothing is cached, so iterating over the
+    days holds one decoded day in memory at a time.
+    """
+
+    def __init__(self, raw, entries, decoder=None):
+        self._raw = raw
+        self._offsets = dict((k, start) for k, start, end in entries)
+        self._decoder = decoder or _decoder
+
+    def _decode(self, k):
+        return self._decoder.raw_decode(self._raw, self._offsets[k])[0]
+
+    def get(self, k, d=None):
+        if k not in self._offsets:
+            return d
+        return self._decode(k)
+
+    def __getitem__(self, k):
+        return self._decode(k)
+
+    def __contains__(self, k):
+        return k in self._offsets
+
+    def __iter__(self):
+        return iter(self._offsets)
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def keys(self):
+        return self._offsets.keys()
+
+    def iterkeys(self):
+        return iter(self._offsets)
+
+    def iteritems(self):
+        for k in self._offsets:
+            yield k, self._decode(k)
+
+    def items(self):
+        return list(self.iteritems())
+
+
+class StreamingFHRPayload(FHRPayload):
+    """A FHRPayload that never decodes data.days as a whole.
+
+    Everything except data.days is decoded up front as usual. data.days is
+    a LazyDays, so daily_data() and friends stream one decoded day at a time
+    and memory use stays flat however many days the payload holds.
+    """
+
+    def __init__(self, raw, intern_strings=False):
+        self.raw = raw
+        self.raw_size = len(raw)
+
+        decoder = _interning_decoder if intern_strings else _decoder
+
+        self._o = {}
+        entries, end = _scan_object(raw, 0)
+        if _skip_ws(raw, end) != len(raw):
+            raise ValueError('Extra data after JSON object at %d' % end)
+        for key, start, end in entries:
+            if key == 'data' and raw[start] == '{':
+                self._o[key] = self._decode_data(raw, start, decoder)
+            else:
+                self._o[key] = decoder.raw_decode(raw, start)[0]
+
+        v = self._o.get('version', None)
+        if v != 2:
+            raise UnsupportedPayloadVersionError(v)
+
+    @staticmethod
+    def _decode_data(raw, i, decoder):
+        data = {}
+        entries, end = _scan_object(raw, i)
+        for key, start, end in entries:
+            if key == 'days' and raw[start] == '{':
+                data[key] = LazyDays(raw, _scan_object(raw, start)[0], decoder)
+            else:
+                data[key] = decoder.raw_decode(raw, start)[0]
+        return data
 
 
 def base_setup(job):
@@ -306,6 +1497,57 @@ known_sequences = {
     'beta': '/user/sguha/fhr/samples/output/beta',
 }
 
+def current_rss_mb():
+    """Resident set size of this process in MB.
+
+    Reads /proc where available and falls back to the peak RSS otherwise.
+    """
+    try:
+        fd = open('/proc/self/statm')
+        try:
+            pages = int(fd.read().split()[1])
+        finally:
+            fd.close()
+        return pages * resource.getpagesize() / (1024.0 * 1024)
+    except (IOError, IndexError, ValueError):
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return usage.ru_maxrss / 1024.0
+
+
+class RSSMonitor(object):
+    """Checks the task's RSS against a cap every few records.
+
+    Going over the cap does not stop the task. It forces a garbage
+    collection, logs the offending record to stderr and bumps the
+    memory/rss_over_cap counter, so that tasks heading for an OOM kill can
+    be found in the job history.
+    """
+
+    def __init__(self, cap_mb, every=100):
+        self.cap_mb = cap_mb
+        self.every = every
+        self.records = 0
+        self.peak_mb = 0
+        self.trips = 0
+
+    def check(self, job, key, raw_size):
+        self.records += 1
+        if self.records % self.every:
+            return
+
+        rss = current_rss_mb()
+        self.peak_mb = max(self.peak_mb, rss)
+        if rss <= self.cap_mb:
+            return
+
+        gc.collect()
+        self.trips += 1
+        print >>sys.stderr, 'RSS %.0fMB over cap of %.0fMB after %d records; ' \
+            'last key %r, %d bytes' % (rss, self.cap_mb, self.records, key,
+            raw_size)
+        job.increment_counter('memory', 'rss_over_cap', 1)
+
+
 class FHRMapper(object):
     """Decorator used to annotate a Firefox Health Report mapping function.
 
@@ -321,18 +1563,43 @@ class FHRMapper(object):
 
         max_day_age -- If set to an integer, payloads older than this many days
         will be filtered out.
+
+        stream_threshold -- If set to an integer, payloads of at least this
+        many bytes are decoded as a StreamingFHRPayload.
+
+        intern_strings -- If True, payload keys and string values are shared
+        through string_table. This decodes with the slower object_pairs_hook
+        path, trading speed for memory. When not given, a job option named
+        intern_strings is used if the job has one.
+
+        rss_cap_mb -- If set, the task's RSS is checked against this many MB
+        with an RSSMonitor. When not given, a job option named rss_cap_mb is
+        used if the job has one.
+
+    Each payload is released once the decorated function has finished with
+    it.
     """
-    def __init__(self, only_major_channels=False, max_day_age=None):
+    def __init__(self, only_major_channels=False, max_day_age=None,
+        stream_threshold=None, intern_strings=None, rss_cap_mb=None):
 
         self.only_major_channels = only_major_channels
         self.max_day_age = max_day_age
+        self.stream_threshold = stream_threshold
+        self.intern_strings = intern_strings
+        self.rss_cap_mb = rss_cap_mb
+        self.monitor = None
 
         self.today = datetime.date.today()
 
     def __call__(self, func):
         def wrapper(job, key, value):
+            intern_strings = self._intern_strings(job)
             try:
-                payload = FHRPayload(value)
+                if self.stream_threshold is not None and \
+                        len(value) >= self.stream_threshold:
+                    payload = StreamingFHRPayload(value, intern_strings)
+                else:
+                    payload = FHRPayload(value, intern_strings)
             except HealthReportError:
                 return
 
@@ -349,7 +1616,298 @@ class FHRMapper(object):
                 if age.days > self.max_day_age:
                     return
 
-            for k1, v1 in func(job, key, payload):
-                yield(k1, v1)
+            try:
+                for k1, v1 in func(job, key, payload):
+                    yield(k1, v1)
+            finally:
+                payload.release()
+
+                monitor = self._monitor(job)
+                if monitor is not None:
+                    monitor.check(job, key, payload.raw_size)
 
         return wrapper
+
+    def _intern_strings(self, job):
+        if self.intern_strings is None:
+            self.intern_strings = bool(getattr(getattr(job, 'options', None),
+                'intern_strings', False))
+        return self.intern_strings
+
+    def _monitor(self, job):
+        if self.monitor is None:
+            cap = self.rss_cap_mb
+            if cap is None:
+                cap = getattr(getattr(job, 'options', None), 'rss_cap_mb', None)
+            if cap is None:
+                return None
+            self.monitor = RSSMonitor(float(cap))
+        return self.monitor
+
+
+class JobProxy(object):
+    """The parts of an MRJob that mapping functions use, for pool workers.
+
+    Carries the job options and writes counters to stderr in the Hadoop
+    streaming format, as MRJob.increment_counter does.
+    """
+
+    def __init__(self, job):
+        self.options = job.options
+
+    def increment_counter(self, group, counter, amount=1):
+        sys.stderr.write('reporter:counter:%s,%s,%d\n' % (
+            str(group).replace(',', ';'), str(counter).replace(',', ';'),
+            amount))
+        sys.stderr.flush()
+
+
+_pool_func = None
+_pool_job = None
+_pool_stats = None
+
+
+def _pool_init(func, job, stats):
+    global _pool_func, _pool_job, _pool_stats
+    _pool_func = func
+    _pool_job = job
+    _pool_stats = stats
+
+
+def _pool_map_batch(batch):
+    out = []
+    for key, value in batch:
+        out.extend(_pool_func(_pool_job, key, value) or ())
+    stats = _pool_stats() if _pool_stats is not None else None
+    return os.getpid(), out, stats
+
+
+class PoolMapper(object):
+    """Runs an FHRMapper-decorated function over a local process pool.
+
+    Records handed to add() are collected into batches of batch_size, and
+    each batch is decoded and mapped by one of the worker processes. The
+    outputs are merged in-task: values for the same key are collected and
+    passed through combine(key, values) before being emitted, at the
+    latest from close() and earlier whenever more than max_keys keys are
+    held. Outputs with unhashable keys, or all outputs if combine is None,
+    are emitted as they arrive.
+
+    Workers are forked, so func may be any module-level function of the job
+    script. They see a JobProxy rather than the job itself.
+
+    If stats is given, it is called in a worker after each batch and should
+    return a dict of running totals for that worker, such as
+    string_table.stats. After close(), stats() sums the latest totals of
+    every worker.
+    """
+
+    def __init__(self, job, func, processes, combine=None, batch_size=200,
+        max_keys=100000, stats=None):
+        self.combine = combine
+        self.batch_size = batch_size
+        self.max_keys = max_keys
+        self.processes = processes
+
+        self.pool = multiprocessing.Pool(processes, _pool_init,
+            (func, JobProxy(job), stats))
+        self.batch = []
+        self.pending = []
+        self.combined = {}
+        self.worker_stats = {}
+
+    def add(self, key, value):
+        """Queue one record. Returns outputs that are ready to be emitted."""
+        self.batch.append((key, value))
+        if len(self.batch) < self.batch_size:
+            return ()
+
+        self.pending.append(self.pool.apply_async(_pool_map_batch,
+            (self.batch,)))
+        self.batch = []
+
+        out = []
+        # Keep a couple of batches per worker in flight and collect the rest.
+        while len(self.pending) > self.processes * 2:
+            out.extend(self._merge(self.pending.pop(0).get()))
+        return out
+
+    def _merge(self, result):
+        pid, results, stats = result
+        if stats is not None:
+            self.worker_stats[pid] = stats
+
+        if self.combine is None:
+            return results
+
+        out = []
+        for k, v in results:
+            try:
+                self.combined.setdefault(k, []).append(v)
+            except TypeError:
+                out.append((k, v))
+
+        if len(self.combined) > self.max_keys:
+            out.extend(self._drain())
+        return out
+
+    def _drain(self):
+        combined = self.combined
+        self.combined = {}
+        for k, values in combined.iteritems():
+            for r in self.combine(k, values):
+                yield r
+
+    def close(self):
+        """Map the remaining records and emit everything still held."""
+        if self.batch:
+            self.pending.append(self.pool.apply_async(_pool_map_batch,
+                (self.batch,)))
+            self.batch = []
+
+        for result in self.pending:
+            for r in self._merge(result.get()):
+                yield r
+        self.pending = []
+
+        self.pool.close()
+        self.pool.join()
+
+        for r in self._drain():
+            yield r
+
+    def stats(self):
+        """The stats totals of all workers, summed."""
+        total = {}
+        for stats in self.worker_stats.itervalues():
+            for k, v in stats.iteritems():
+                total[k] = total.get(k, 0) + v
+        return total
+
+
+PREFETCH_CHUNK = 8 * 1024 * 1024
+PREFETCH_QUEUE = 16
+
+
+def _split_chunks(read, chunk_size):
+    """Split the data returned by read(chunk_size) into lists of lines.
+
+    Lines are returned without their trailing newline.
+    """
+    tail = ''
+    while True:
+        data = read(chunk_size)
+        if not data:
+            break
+        lines = (tail + data).split('\n')
+        tail = lines.pop()
+        if lines:
+            yield lines
+    if tail:
+        yield [tail]
+
+
+def _file_chunks(path, chunk_size):
+    """Lists of lines from a plain file, read through a memory map."""
+    fd = open(path, 'rb')
+    try:
+        if os.fstat(fd.fileno()).st_size == 0:
+            return
+        m = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for lines in _split_chunks(m.read, chunk_size):
+                yield lines
+        finally:
+            m.close()
+    finally:
+        fd.close()
+
+
+def _batched(lines, batch_lines=1000):
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) == batch_lines:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def input_chunks(paths, stdin=None, chunk_size=PREFETCH_CHUNK):
+    """Lists of input lines from paths, in the way MRJob reads its input.
+
+    Plain files are memory-mapped and '-' is stdin, read in chunk_size
+    reads. Anything else (compressed files, directories, globs) is handed
+    to mrjob's own read_input.
+    """
+    for path in paths or ['-']:
+        if path == '-':
+            if stdin is None:
+                stdin = sys.stdin
+            for lines in _split_chunks(stdin.read, chunk_size):
+                yield lines
+        elif os.path.isfile(path) and not path.endswith(('.gz', '.bz2')):
+            for lines in _file_chunks(path, chunk_size):
+                yield lines
+        else:
+            from mrjob.util import read_input
+            for lines in _batched(read_input(path, stdin=stdin)):
+                yield lines
+
+
+class PrefetchReader(object):
+    """Iterates over lines that a background thread reads ahead.
+
+    chunks is an iterable of lists of lines, such as input_chunks(). It is
+    consumed on a separate thread into a queue of at most queue_size lists,
+    so that reading and splitting the input overlaps with the work done on
+    the lines already read. Errors in the reader are raised to the consumer.
+    """
+
+    def __init__(self, chunks, queue_size=PREFETCH_QUEUE):
+        self.queue = Queue.Queue(queue_size)
+        self.thread = threading.Thread(target=self._run, args=(chunks,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self, chunks):
+        try:
+            for lines in chunks:
+                self.queue.put((lines, None))
+        except Exception:
+            self.queue.put((None, sys.exc_info()))
+            return
+        self.queue.put((None, None))
+
+    def __iter__(self):
+        while True:
+            lines, exc = self.queue.get()
+            if lines is None:
+                break
+            for line in lines:
+                yield line
+        self.thread.join()
+        if exc is not None:
+            raise exc[0], exc[1], exc[2]
+
+
+class PrefetchInput(object):
+    """Mixin for FHR jobs adding a --prefetch option.
+
+    With --prefetch, mapper input is read by a PrefetchReader instead of
+    line by line on the mapping thread. List it before MRJob:
+
+        class AggJob(healthreportutils.PrefetchInput, MRJob):
+    """
+
+    def configure_options(self):
+        super(PrefetchInput, self).configure_options()
+        self.add_passthrough_option('--prefetch', action='store_true',
+                                    default=False,
+                                    help="Read input ahead on a background thread")
+
+    def _read_input(self):
+        if not self.options.prefetch:
+            return super(PrefetchInput, self)._read_input()
+        return iter(PrefetchReader(input_chunks(self.args, self.stdin)))
@@ -0,0 +1,128 @@
+"""
+Dictionary-encoded addon and plugin inventories.
+
+The addon and plugin breakdowns used to emit keys holding the addon ID,
+name and plugin version strings of every addon of every profile. Instead,
+each distinct tuple of those strings is replaced by a numeric code, and the
+rows emitted per profile look like
+
+  (table, <dimension codes>, entry code, state)
+
+where state packs the boolean flags of the addon or plugin two bits each.
+The first time a map process sees an entry it also emits
+
+  ("inventory", entry code) -> [strings]
+
+so each task ships its dictionary once alongside its rows. Codes are
+derived from the strings themselves, so every task assigns the same code
+to the same entry, and rows from different tasks are summed as usual.
+reduce_entry() keeps one copy of each dictionary entry, and at output time
+load_entries()/decode_state() turn the rows back into their strings.
+
+Jobs must ship this module along with healthreportutils.py.
+"""
+
+import hashlib
+import struct
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+ENTRY = "inventory"
+
+ADDONS_PROVIDER = u'org.mozilla.addons.addons'
+PLUGINS_PROVIDER = u'org.mozilla.addons.plugins'
+
+# Flag values by their two-bit state code
+FLAG_VALUES = ("?", False, True)
+
+_code_struct = struct.Struct("<Q")
+
+def entry_code(values):
+    """The code of a tuple of strings, the same in every task."""
+    s = json.dumps(list(values), separators=(",", ":"))
+    return _code_struct.unpack(hashlib.md5(s).digest()[:8])[0] >> 1
+
+def encode_state(values):
+    """
+    Pack flag values into an int, two bits each. If any of them is not a
+    boolean or "?" the values are returned as a list instead.
+    """
+    state = 0
+    for v in values:
+        if v is True:
+            c = 2
+        elif v is False:
+            c = 1
+        elif v == "?":
+            c = 0
+        else:
+            return list(values)
+        state = (state << 2) | c
+    return state
+
+def decode_state(state, n):
+    """The n flag values packed into state by encode_state()."""
+    if isinstance(state, list):
+        return tuple(state)
+    values = []
+    for i in xrange(n):
+        values.append(FLAG_VALUES[state & 3])
+        state >>= 2
+    values.reverse()
+    return tuple(values)
+
+class InventoryEncoder(object):
+    """
+    The entries this process has seen. encode() returns the code of an
+    entry and queues its dictionary output the first time it is seen;
+    flush() returns the queued outputs. Once max_size entries are held the
+    table is cleared, which only means some entries are emitted again.
+    """
+    def __init__(self, max_size=100000):
+        self.max_size = max_size
+        self.codes = {}
+        self.pending = []
+
+    def encode(self, *values):
+        try:
+            return self.codes[values]
+        except KeyError:
+            pass
+        except TypeError:
+            # unhashable values can't be remembered; emit them every time
+            code = entry_code(values)
+            self.pending.append(((ENTRY, code), list(values)))
+            return code
+
+        if len(self.codes) >= self.max_size:
+            self.codes.clear()
+        code = self.codes[values] = entry_code(values)
+        self.pending.append(((ENTRY, code), list(values)))
+        return code
+
+    def flush(self):
+        pending = self.pending
+        self.pending = []
+        return pending
+
+encoder = InventoryEncoder()
+
+def is_entry(k):
+    return isinstance(k, (tuple, list)) and len(k) == 2 and k[0] == ENTRY
+
+def reduce_entry(k, vlist):
+    """Combine/reduce a dictionary entry: all copies are the same."""
+    for v in vlist:
+        yield (k, v)
+        return
+
+def load_entries(results):
+    """Map entry codes to their strings, from (key, value) results."""
+    entries = {}
+    for k, v in results:
+        if is_entry(k):
+            entries[k[1]] = tuple(v)
+    return entries
@@ -0,0 +1,248 @@
+"""
+Random access to dumped FHR payloads by profile key.
+
+Usage:
+  payloadindex.py build <index> <dump> [<dump> ...]
+  payloadindex.py show <index> [<key> ...] [--keys-from keys.txt] [--pretty]
+
+A dump is the text form of the snapshot sequence files, one
+"<key>\\t<payload JSON>" line per profile, as written by
+`hadoop dfs -text`. build scans the dumps once and writes a sorted index
+of (key, file, offset, length) records. Lookups binary-search the
+memory-mapped index and slice the payload straight out of the
+memory-mapped dump, so a profile found in a crash or churn outlier can be
+inspected without reading the dumps again.
+
+The index stores absolute dump paths; moving the dumps means rebuilding
+it. If a key appears more than once, lookups return one of its payloads.
+"""
+
+import sys, os, struct, mmap
+from optparse import OptionParser
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+import healthreportutils
+
+MAGIC = "FHRI"
+FORMAT_VERSION = 1
+
+_header = struct.Struct("<4sBH")
+_trailer = struct.Struct("<Q")
+
+def record_struct(key_width):
+    return struct.Struct("<%isHQI" % (key_width,))
+
+def _map(path):
+    fd = open(path, "rb")
+    try:
+        if os.fstat(fd.fileno()).st_size == 0:
+            return ""
+        return mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        fd.close()
+
+def scan_dump(data):
+    """Yield (key, offset, length) for each payload line of a mapped dump."""
+    pos, end = 0, len(data)
+    while pos < end:
+        eol = data.find("\n", pos)
+        if eol == -1:
+            eol = end
+        stop = eol
+        if stop > pos and data[stop - 1] == "\r":
+            stop -= 1
+        tab = data.find("\t", pos, stop)
+        if tab != -1:
+            yield data[pos:tab], tab + 1, stop - tab - 1
+        pos = eol + 1
+
+def build(indexpath, dumps):
+    """Index the dumps into indexpath. Returns the number of payloads."""
+    dumps = [os.path.abspath(p) for p in dumps]
+    for p in dumps:
+        if p.endswith((".gz", ".bz2")):
+            raise ValueError("%s: decompress dumps before indexing them" % (p,))
+    if len(dumps) > 0xffff:
+        raise ValueError("too many dump files for one index")
+
+    entries = []
+    for fileno, path in enumerate(dumps):
+        data = _map(path)
+        for key, offset, length in scan_dump(data):
+            entries.append((key, fileno, offset, length))
+        if data:
+            data.close()
+
+    key_width = max([len(e[0]) for e in entries] or [0])
+    if key_width > 0xffff:
+        raise ValueError("profile keys longer than %i bytes" % (0xffff,))
+    record = record_struct(key_width)
+
+    # Keys come first in each record, NUL-padded at the end to key_width,
+    # so the packed records sort in key order.
+    packed = [record.pack(*e) for e in entries]
+    del entries
+    packed.sort()
+
+    tmppath = indexpath + ".tmp"
+    fd = open(tmppath, "wb")
+    fd.write(_header.pack(MAGIC, FORMAT_VERSION, key_width))
+    for r in packed:
+        fd.write(r)
+    offset = fd.tell()
+    fd.write(json.dumps(dumps))
+    fd.write(_trailer.pack(offset))
+    fd.close()
+    os.rename(tmppath, indexpath)
+    return len(packed)
+
+class PayloadIndex(object):
+    """
+    A built index, opened for lookups. Payloads are returned as FHRPayload
+    instances, or as raw JSON through raw()/locate().
+    """
+    def __init__(self, path):
+        self.path = path
+        self.data = _map(path)
+
+        magic, version, self.key_width = _header.unpack_from(self.data, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError("%s is not a payload index" % (path,))
+
+        end, = _trailer.unpack_from(self.data, len(self.data) - _trailer.size)
+        self.dumps = json.loads(self.data[end:len(self.data) - _trailer.size])
+        self.record = record_struct(self.key_width)
+        self.count = (end - _header.size) // self.record.size
+        self.mapped = {}
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, key):
+        return self._find(key) is not None
+
+    def _key(self, i):
+        pos = _header.size + i * self.record.size
+        return self.data[pos:pos + self.key_width].rstrip("\0")
+
+    def _find(self, key, lo=0):
+        """Index of the record for key, or None. Searches from lo on."""
+        if len(key) > self.key_width:
+            return None
+        hi = self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.count and self._key(lo) == key:
+            return lo
+        return None
+
+    def _entry(self, i):
+        key, fileno, offset, length = self.record.unpack_from(
+            self.data, _header.size + i * self.record.size)
+        return self.dumps[fileno], offset, length
+
+    def locate(self, key):
+        """(dump path, offset, length) of the payload for key, or None."""
+        i = self._find(key)
+        if i is None:
+            return None
+        return self._entry(i)
+
+    def _slice(self, entry):
+        path, offset, length = entry
+        data = self.mapped.get(path)
+        if data is None:
+            data = self.mapped[path] = _map(path)
+        return data[offset:offset + length]
+
+    def raw(self, key):
+        entry = self.locate(key)
+        if entry is None:
+            return None
+        return self._slice(entry)
+
+    def get(self, key, default=None):
+        raw = self.raw(key)
+        if raw is None:
+            return default
+        return healthreportutils.FHRPayload(raw)
+
+    def __getitem__(self, key):
+        payload = self.get(key)
+        if payload is None:
+            raise KeyError(key)
+        return payload
+
+    def raw_many(self, keys):
+        """
+        Yield (key, raw JSON or None) for each of keys. The keys are looked
+        up in sorted order, each search starting where the last one ended,
+        and the results are yielded in that order.
+        """
+        lo = 0
+        for key in sorted(set(keys)):
+            i = self._find(key, lo)
+            if i is None:
+                yield key, None
+                continue
+            lo = i
+            yield key, self._slice(self._entry(i))
+
+    def get_many(self, keys):
+        """Yield (key, FHRPayload or None) for each of keys, sorted."""
+        for key, raw in self.raw_many(keys):
+            if raw is not None:
+                raw = healthreportutils.FHRPayload(raw)
+            yield key, raw
+
+    def close(self):
+        for data in self.mapped.itervalues():
+            if data:
+                data.close()
+        self.mapped = {}
+        if self.data:
+            self.data.close()
+
+def main(argv):
+    parser = OptionParser(usage=__doc__.strip())
+    parser.add_option("--keys-from", default=None,
+                      help="File with one profile key per line")
+    parser.add_option("--pretty", action="store_true", default=False,
+                      help="Indent the payload JSON")
+    options, args = parser.parse_args(argv)
+
+    if len(args) < 2:
+        parser.error("expected a command and an index path")
+    command, indexpath = args[:2]
+
+    if command == "build":
+        if len(args) < 3:
+            parser.error("expected at least one dump to index")
+        n = build(indexpath, args[2:])
+        print >>sys.stderr, "Indexed %i payloads" % (n,)
+    elif command == "show":
+        keys = args[2:]
+        if options.keys_from:
+            keys.extend(l.strip() for l in open(options.keys_from) if l.strip())
+        index = PayloadIndex(indexpath)
+        for key, raw in index.raw_many(keys):
+            if raw is None:
+                print >>sys.stderr, "%s: not found" % (key,)
+                continue
+            if options.pretty:
+                raw = json.dumps(json.loads(raw), indent=2, sort_keys=True)
+            print "%s\t%s" % (key, raw)
+        index.close()
+    else:
+        parser.error("unknown command %r" % (command,))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -3,6 +3,7 @@ Collect plugin stats.
 """
 
 import healthreportutils
+import inventory
 from datetime import date, datetime, timedelta
 import os, shutil, csv
 import sys, codecs
@@ -12,11 +13,6 @@ import mrjob
 from mrjob.job import MRJob
 import tempfile
 
-try:
-    import simplejson as json
-except ImportError:
-    import json
-
 # How many days must a user be gone to be considered "lost"?
 LOSS_DAYS = 7 * 6 # 42 days/one release cycle
 TOTAL_DAYS = 180
@@ -44,6 +40,7 @@ def last_saturday(d):
     # .weekday in python starts on 0=Monday
     return d - timedelta(days=(d.weekday() + 2) % 7)
 
+@healthreportutils.memoized
 def start_date(dstr):
     """
     Start measuring a few days before the snapshot was taken to give clients
@@ -53,12 +50,6 @@ def start_date(dstr):
     startdate = last_saturday(snapshot) - timedelta(days=7)
     return startdate
 
-def date_back(start, days):
-    """iter backwards from start for N days"""
-    date = start
-    for n in xrange(0, days):
-        yield date - timedelta(days=n)
-
 def active_day(day):
     if day is None:
         return False
@@ -78,22 +69,19 @@ def logexceptions(func):
 @logexceptions
 @healthreportutils.FHRMapper()
 def mapjob(job, key, payload):
-    channel = payload.channel.split("-")[0]
+    channel = payload.dimensions.channel
     if channel not in main_channels:
         return
 
     days = payload.get('data', {}).get('days', {})
-    def get_day(d):
-        dstr = d.strftime("%Y-%m-%d")
-        return days.get(dstr, None)
 
     sd = start_date(job.options.start_date)
     week_end = sd # sd is always a Saturday
 
     active_user = False
 
-    for d in date_back(sd, LOSS_DAYS):
-        day = get_day(d)
+    for d, dstr in healthreportutils.probe_dates(sd, LOSS_DAYS):
+        day = days.get(dstr, None)
         if active_day(day):
             active_user = True
             break
@@ -102,7 +90,7 @@ def mapjob(job, key, payload):
         return
 
     # require the v1 plugin data
-    plugins = payload.last.get("org.mozilla.addons.plugins", {})
+    plugins = payload.last.get(inventory.PLUGINS_PROVIDER, {})
 
     os = payload.last.get("org.mozilla.appInfo.appinfo", {}).get("os", "?")
     yield (("totals", channel, os), 1)
@@ -123,23 +111,32 @@ def mapjob(job, key, payload):
         else:
             pluginmap[name] = data
 
+    # Emitted dictionary-encoded; output() decodes them
+    encoder = inventory.encoder
+    channel_code, os_code = healthreportutils.dimension_codes.encode_all(
+        ("channel", "os"), (channel, os))
+
     for data in pluginmap.values():
-        yield (("plugins", channel, os,
-                data.get("name", "?"),
-                data.get("version", "?"),
-                data.get("blocklisted", "?"),
-                data.get("disabled", "?"),
-                data.get("clicktoplay", "?")), 1)
+        code = encoder.encode(data.get("name", "?"), data.get("version", "?"))
+        state = inventory.encode_state((data.get("blocklisted", "?"),
+                                        data.get("disabled", "?"),
+                                        data.get("clicktoplay", "?")))
+        for r in encoder.flush():
+            yield r
+        yield (("plugins", channel_code, os_code, code, state), 1)
 
 def reduce(job, k, vlist):
     if k == "exception":
         print >> sys.stderr, "FOUND exception", vlist
         for v in vlist:
             yield (k, v)
+    elif inventory.is_entry(k):
+        for r in inventory.reduce_entry(k, vlist):
+            yield r
     else:
         yield (k, sum(vlist))
 
-class AggJob(MRJob):
+class AggJob(healthreportutils.PrefetchInput, MRJob):
     HADOOP_INPUT_FORMAT="org.apache.hadoop.mapred.SequenceFileAsTextInputFormat"
     INPUT_PROTOCOL = mrjob.protocol.RawProtocol
 
@@ -167,10 +164,17 @@ class AggJob(MRJob):
                                     default=None)
         self.add_passthrough_option('--start-date', help="Specify start date",
                                     default=None)
+        self.add_passthrough_option('--intern-strings', action='store_true',
+                                    help="Share repeated payload strings to save memory, at some decoding speed",
+                                    default=False)
 
     def mapper(self, key, value):
         return mapjob(self, key, value)
 
+    def mapper_final(self):
+        if self.options.intern_strings:
+            healthreportutils.report_string_table(self)
+
     def reducer(self, key, vlist):
         return reduce(self, key, vlist)
 
@@ -180,7 +184,7 @@ def getresults(fd):
     fd.seek(0)
     for line in fd:
         k, v = line.split("\t")
-        yield json.loads(k), json.loads(v)
+        yield healthreportutils.json_loads(k), healthreportutils.json_loads(v)
 
 def unwrap(l, v):
     """
@@ -196,6 +200,14 @@ def unwrap(l, v):
     else:
         l.append(v)
 
+def plugins_row(k, entries):
+    name, channel, osname, code, state = k
+    pluginname, version = entries[code]
+    channel, osname = healthreportutils.dimension_codes.decode_all(
+        ("channel", "os"), (channel, osname))
+    return ([name, channel, osname, pluginname, version] +
+            list(inventory.decode_state(state, 3)))
+
 def output(fd, path):
     try:
         shutil.rmtree(path)
@@ -203,6 +215,8 @@ def output(fd, path):
         pass
     os.mkdir(path)
 
+    entries = inventory.load_entries(getresults(fd))
+
     writers = {}
     errs = codecs.getwriter("utf-8")(open(os.path.join(path, "exceptions.txt"), "w"))
     for k, v in getresults(fd):
@@ -210,6 +224,10 @@ def output(fd, path):
             print >>errs, "==ERR=="
             print >>errs, v
             continue
+        if inventory.is_entry(k):
+            continue
+        if k[0] == "plugins":
+            k = plugins_row(k, entries)
         l = []
         unwrap(l, k)
         unwrap(l, v)
@@ -0,0 +1,543 @@
+"""
+Post-process the CSV output directories written by the FHR jobs.
+
+Usage:
+  postprocess.py crashsummary <crashdir> [--channel release] [--os WINNT]
+  postprocess.py plugins <plugindir> [--channel release] [--os WINNT,Darwin,Linux]
+                 [--plugin "Shockwave Flash"]
+  postprocess.py searchproviders <file.csv> [--geo US]
+  postprocess.py churn <churndir>
+
+Each CSV is parsed once, in parallel chunks, into typed columns. The parsed
+columns are cached next to the CSV (as <name>.csv.columns) so that running
+a second report over the same directory does not parse the text again.
+"""
+
+import sys, os, csv
+import cPickle as pickle
+import multiprocessing
+from array import array
+from itertools import izip
+from optparse import OptionParser
+from collections import defaultdict, Counter
+from datetime import datetime
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+from healthreportutils import QuantileSketch
+
+CACHE_SUFFIX = ".columns"
+CACHE_VERSION = 1
+
+# Files smaller than this are parsed in-process; forking isn't worth it.
+PARALLEL_MIN_BYTES = 4 * 1024 * 1024
+
+class Table(object):
+    """
+    A CSV file held as one list (or int array) per column.
+    """
+    def __init__(self, columns):
+        self.columns = columns
+
+    def __len__(self):
+        if not self.columns:
+            return 0
+        return len(self.columns[0])
+
+    def __iter__(self):
+        return izip(*self.columns)
+
+    @classmethod
+    def from_rows(cls, rows, int_columns=(-1,)):
+        return cls(_to_columns(rows, int_columns))
+
+def _to_columns(rows, int_columns):
+    columns = None
+    ints = ()
+    for row in rows:
+        if not row:
+            continue
+        if columns is None:
+            ints = set(i % len(row) for i in int_columns)
+            columns = [array('l') if i in ints else [] for i in range(len(row))]
+        for i, v in enumerate(row):
+            columns[i].append(int(v) if i in ints else v)
+    return columns or []
+
+def _parse_chunk(args):
+    path, start, end, int_columns = args
+    fd = open(path, "rb")
+    fd.seek(start)
+    data = fd.read(end - start)
+    fd.close()
+    return _to_columns(csv.reader(data.splitlines()), int_columns)
+
+def _chunk_offsets(path, size, chunks):
+    """Split a file into byte ranges that start at line boundaries."""
+    offsets = [0]
+    fd = open(path, "rb")
+    for n in range(1, chunks):
+        fd.seek(max(size * n / chunks, offsets[-1]))
+        fd.readline()
+        offsets.append(fd.tell())
+    fd.close()
+    offsets.append(size)
+    return [(s, e) for s, e in zip(offsets, offsets[1:]) if e > s]
+
+def parse_csv(path, int_columns=(-1,), processes=None):
+    """
+    Parse a CSV into a Table. Large files are split into chunks which are
+    parsed by a process pool and concatenated in order.
+
+    Rows must not contain embedded newlines, which holds for job output.
+    """
+    size = os.path.getsize(path)
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+
+    if size < PARALLEL_MIN_BYTES or processes < 2:
+        return Table(_parse_chunk((path, 0, size, int_columns)))
+
+    jobs = [(path, s, e, int_columns)
+            for s, e in _chunk_offsets(path, size, processes * 4)]
+    pool = multiprocessing.Pool(processes)
+    try:
+        parts = pool.map(_parse_chunk, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+    columns = None
+    for part in parts:
+        if not part:
+            continue
+        if columns is None:
+            columns = part
+            continue
+        for c, p in zip(columns, part):
+            c.extend(p)
+    return Table(columns or [])
+
+def load_csv(path, int_columns=(-1,)):
+    """
+    Load a CSV as a Table, using the cached columns next to it if they are
+    still current.
+    """
+    st = os.stat(path)
+    stamp = (CACHE_VERSION, st.st_size, st.st_mtime, tuple(int_columns))
+    cachepath = path + CACHE_SUFFIX
+
+    try:
+        fd = open(cachepath, "rb")
+        try:
+            if pickle.load(fd) == stamp:
+                return Table(pickle.load(fd))
+        finally:
+            fd.close()
+    except (IOError, EOFError, ValueError, pickle.UnpicklingError):
+        pass
+
+    table = parse_csv(path, int_columns)
+
+    try:
+        fd = open(cachepath, "wb")
+        pickle.dump(stamp, fd, pickle.HIGHEST_PROTOCOL)
+        pickle.dump(table.columns, fd, pickle.HIGHEST_PROTOCOL)
+        fd.close()
+    except IOError as e:
+        print >>sys.stderr, "Unable to cache %s: %s" % (path, e)
+
+    return table
+
+class ResultDir(object):
+    """The output directory of a job; tables are loaded once each."""
+    def __init__(self, path):
+        self.path = path
+        self.tables = {}
+
+    def table(self, name, int_columns=(-1,)):
+        if name not in self.tables:
+            self.tables[name] = load_csv(os.path.join(self.path, name + ".csv"),
+                                         int_columns)
+        return self.tables[name]
+
+def dstr_to_date(dstr):
+    return datetime.strptime(dstr, "%Y-%m-%d").date()
+
+class SparseList(list):
+  def __setitem__(self, index, value):
+    missing = index - len(self) + 1
+    if missing > 0:
+      self.extend([0] * missing)
+    list.__setitem__(self, index, value)
+  def __getitem__(self, index):
+    try: return list.__getitem__(self, index)
+    except IndexError: return 0
+
+class Day(object):
+    def __init__(self):
+        self.active = 0
+        self.seconds = 0
+        self.ticks = 0
+        self.crashes = defaultdict(int)
+        self.submissions = defaultdict(int)
+
+def crashsummary(results, targetchannel='release', targetos='WINNT'):
+    days = defaultdict(Day)
+
+    totalactives = 0
+    totalseconds = 0
+    totalticks = 0
+
+    for dstr, channel, os_, count in results.table("daily-active"):
+        if channel != targetchannel:
+            continue
+        if os_ != targetos:
+            continue
+        d = dstr_to_date(dstr)
+        days[d].active += count
+        totalactives += count
+
+    for dstr, channel, os_, count in results.table("daily-seconds"):
+        if channel != targetchannel:
+            continue
+        if os_ != targetos:
+            continue
+        d = dstr_to_date(dstr)
+        days[d].seconds += count
+        totalseconds += count
+
+    for dstr, channel, os_, count in results.table("daily-ticks"):
+        if channel != targetchannel:
+            continue
+        if os_ != targetos:
+            continue
+        d = dstr_to_date(dstr)
+        days[d].ticks += count
+        totalticks += count
+
+    crashesbytype = defaultdict(int)
+    submissionsbytype = defaultdict(int)
+    submitfailbytype = defaultdict(int)
+
+    for dstr, type, channel, os_, count in results.table("daily"):
+        if channel != targetchannel:
+            continue
+        if os_ != targetos:
+            continue
+        d = dstr_to_date(dstr)
+        days[d].crashes[type] += count
+        crashesbytype[type] += count
+
+    for dstr, type, channel, os_, count in results.table("daily-submission-succeeded"):
+        if channel != targetchannel:
+            continue
+        if os_ != targetos:
+            continue
+        d = dstr_to_date(dstr)
+        days[d].submissions[type] += count
+        submissionsbytype[type] += count
+
+    for dstr, type, channel, os_, count in results.table("daily-submission-failed"):
+        if channel != targetchannel:
+            continue
+        if os_ != targetos:
+            continue
+        submitfailbytype[type] += count
+
+    crashes = SparseList()
+    pcrashes = SparseList()
+
+    for channel, os_, kind, n, count in \
+            results.table("user-crashes", int_columns=(3, 4)):
+        if channel != targetchannel:
+            continue
+        if os_ != targetos:
+            continue
+        if kind == "main":
+            crashes[n] += count
+        else:
+            pcrashes[n] += count
+
+    crashtotal = float(sum(crashes))
+    pcrashtotal = float(sum(pcrashes))
+
+    cutoff = 8
+
+    maincount = crashesbytype["main-crash"]
+    plugincount = crashesbytype["plugin-crash"] + crashesbytype["plugin-hang"]
+    mainsubmissions = submissionsbytype["main-crash"]
+    pluginsubmissions = submissionsbytype["plugin-crash"] + submissionsbytype["plugin-hang"]
+
+    print "All data for OS '%s' and channel '%s'" % (targetos, targetchannel)
+    print
+    print "Main-process crashes per active day (MCPD-main): %.4f" % (
+        maincount / float(totalactives),)
+
+    print "Plugin crashes per active day (MCPD-p): %.4f" % (
+        plugincount / float(totalactives),)
+
+    print "%% of plugin crashes which are hangs: %.1f" % (
+        crashesbytype["plugin-hang"] / float(plugincount) * 100,)
+
+    print "Mean session hours between main-process crashes (MTBF-main): %.1f" % (
+        totalseconds / 60.0 / 60 / maincount,)
+
+    print "Mean session hours between plugin-process crashes (MTBF-p): %.1f" % (
+        totalseconds / 60.0 / 60 / plugincount,)
+
+    print "Mean active hours between main-process crashes (MABF-main): %.1f" % (
+        totalticks / 12.0 / 60 / maincount,)
+
+    print "Mean active hours between plugin-process crashes (MABF-p): %.1f" % (
+        totalticks / 12.0 / 60 / plugincount,)
+
+    print "Submission rate for main-process crashes: %.1f%%" % (
+        float(mainsubmissions) / maincount * 100,)
+    print "Submission rate for plugin crashes: %.1f%%" % (
+        float(pluginsubmissions) / plugincount * 100,)
+
+    print "Failed submissions for main-process crashes: %.1f%%" % (
+        float(submitfailbytype["main-crash"]) / (submitfailbytype["main-crash"] + mainsubmissions) * 100,)
+
+    print
+    print "Per day:"
+    print "%10s %10s %10s %10s %10s %10s %10s %10s %10s" % ("Day", "MCPD-main", "MCPD-p", "MTBF-main", "MTBF-p", "MABF-main", "MABF-p", "MSubmit", "PSubmit")
+
+    daylist = days.keys()
+    daylist.sort()
+    for day in daylist:
+        d = days[day]
+        maincount = d.crashes["main-crash"]
+        plugincount = d.crashes["plugin-crash"] + d.crashes["plugin-hang"]
+
+        mainsubmissions = d.submissions["main-crash"]
+        pluginsubmissions = d.submissions["plugin-crash"] + d.submissions["plugin-hang"]
+
+        print "%10s %10.4f %10.4f %10.1f %10.1f %10.1f %10.1f %9.1f%% %9.1f%%" % (
+            day.strftime("%A"),
+            maincount / float(d.active),
+            plugincount / float(d.active),
+            d.seconds / 60.0 / 60 / maincount,
+            d.seconds / 60.0 / 60 / plugincount,
+            d.ticks / 12.0 / 60 / maincount,
+            d.ticks / 12.0 / 60 / plugincount,
+            float(mainsubmissions) / maincount * 100,
+            float(pluginsubmissions) / plugincount * 100,
+        )
+
+    print
+    print "For all active users week:"
+    print "main-process crashes per user:"
+    for c in range(0, cutoff):
+        print "%i: %.2f%%" % (c, crashes[c] / crashtotal * 100)
+    print "More than %i: %.2f%%" % (cutoff, sum(crashes[cutoff:]) / crashtotal * 100)
+
+    print
+    print "plugin crashes or hangs, per user:"
+    for c in range(0, cutoff):
+        print "%i: %.2f%%" % (c, pcrashes[c] / pcrashtotal * 100)
+    print "More than %i: %.2f%%" % (cutoff, sum(pcrashes[cutoff:]) / pcrashtotal * 100)
+
+    sketches = crash_sketches(results, targetchannel, targetos)
+    if sketches:
+        print
+        print "Per-user crash rates:"
+        print "%-24s %10s %10s %10s" % ("", "users", "median", "p95")
+        for metric in sorted(sketches):
+            sketch = sketches[metric]
+            print "%-24s %10i %10.4f %10.4f" % (metric, sketch.count,
+                sketch.quantile(0.5), sketch.quantile(0.95))
+
+def crash_sketches(results, targetchannel, targetos, targetversion=None):
+    """
+    Merge the per-user crash rate sketches of one channel and OS (and
+    optionally version) into {metric: QuantileSketch}.
+    """
+    if not os.path.exists(os.path.join(results.path, "sketch.csv")):
+        return {}
+
+    sketches = {}
+    for channel, os_, version, metric, sketch in \
+            results.table("sketch", int_columns=()):
+        if channel != targetchannel or os_ != targetos:
+            continue
+        if targetversion is not None and version != targetversion:
+            continue
+        if metric not in sketches:
+            sketches[metric] = QuantileSketch()
+        sketches[metric].merge(QuantileSketch.from_list(json.loads(sketch)))
+    return sketches
+
+tfmap = {
+    "True": True,
+    "False": False,
+    "?": None,
+}
+def tf(v):
+    """Convert a string to True/False or None if unparseable"""
+    r = tfmap.get(v, None)
+    if r is None:
+        print >>sys.stderr, "Unexpected t/f value %r" % (v,)
+    return r
+
+def plugins(results, targetchannel='release',
+            oslist=('WINNT', 'Darwin', 'Linux'), plugin='Shockwave Flash'):
+    totals = Counter() # os
+
+    for channel, os_, count in results.table("totals"):
+        if targetchannel != channel:
+            continue
+        if not os_ in oslist:
+            continue
+        totals[os_] += count
+
+    counts = defaultdict(Counter) # (os, state)
+    versions = defaultdict(Counter) # (os, version)
+
+    for channel, os_, name, version, blocklisted, disabled, clicktoplay, count in \
+            results.table("plugins"):
+        if targetchannel != channel:
+            continue
+        if not os_ in oslist:
+            continue
+        if name != plugin:
+            continue
+        blocklisted = tf(blocklisted)
+        disabled = tf(disabled)
+        clicktoplay = tf(clicktoplay)
+        if disabled:
+            state = "disabled"
+        elif blocklisted:
+            state = "blocklisted"
+        elif clicktoplay:
+            state = "ctp"
+        elif blocklisted is None or disabled is None or clicktoplay is None:
+            state = "unknown"
+        else:
+            state = "active"
+        counts[os_][state] += count
+        versions[os_][version] += count
+
+    for os_ in oslist:
+        print os_
+        print "  By Status"
+
+        oscounts = counts[os_]
+
+        notpresent = totals[os_] - sum(oscounts.values())
+        oscounts['notpresent'] = notpresent
+
+        oscounts = oscounts.items()
+        oscounts.sort(reverse=True, key=lambda i: i[1])
+
+        for state, count in oscounts:
+            print "    %s: %.1f%%" % (state, float(count) / totals[os_] * 100)
+
+        print "  By Version"
+        osversions = versions[os_].items()
+        osversions.sort(reverse=True, key=lambda i: i[1])
+        versiontotal = sum(count for version, count in osversions)
+
+        for version, count in osversions:
+            ratio = float(count) / versiontotal * 100
+            if ratio < 0.5:
+                break
+            print "    %s: %.1f%%" % (version, ratio)
+
+        print
+
+def searchproviders(table, targetgeo='US'):
+    geoactive = {}
+    othergeoactive = {}
+
+    for geo, active, search, count in table:
+        if active != "True":
+            continue
+
+        if geo == targetgeo:
+            d = geoactive
+        else:
+            d = othergeoactive
+
+        if not search in d:
+            d[search] = 0
+        d[search] += count
+
+    print "Latest search provider per user"
+
+    for label, d in (("%s geo" % (targetgeo,), geoactive),
+                     ("non-%s geo" % (targetgeo,), othergeoactive)):
+        l = d.items()
+        l.sort(key=lambda i: i[1], reverse=True)
+        total = sum(count for s, count in l)
+        print "beta channel, en-US locale, %s: %i active users" % (label, total)
+        for s, count in l:
+            if count < 1000:
+                break
+            print "  %i: %s" % (count, s)
+
+def churn_aggregate(table, outpath):
+    """
+    Sum counts per week. Rows from a sweep run are tagged with channel and
+    lag and produce one simplified curve per parameter set.
+    """
+    curves = defaultdict(lambda: defaultdict(lambda: 0))
+    for row in table:
+        if len(row) == 5:
+            date, os_, locale, geo, count = row
+            params = ()
+        else:
+            channel, lag, date, os_, locale, geo, count = row
+            params = (channel, lag)
+        curves[params][date] += count
+
+    base, ext = os.path.splitext(outpath)
+    for params, weeks in curves.iteritems():
+        weeks = weeks.items()
+        weeks.sort(key=lambda i: i[0])
+        if params:
+            path = "%s-%s-lag%s%s" % ((base,) + params + (ext,))
+        else:
+            path = outpath
+        w = csv.writer(open(path, "w"))
+        for i in weeks:
+            w.writerow(i)
+
+def churn(results):
+    for name in ("loss", "gain"):
+        churn_aggregate(results.table(name),
+                        os.path.join(results.path, name + "-simple.csv"))
+
+def main(argv):
+    parser = OptionParser(usage=__doc__.strip())
+    parser.add_option("--channel", default="release")
+    parser.add_option("--os", default=None,
+                      help="OS name; for plugins a comma-separated list")
+    parser.add_option("--plugin", default="Shockwave Flash")
+    parser.add_option("--geo", default="US")
+    options, args = parser.parse_args(argv)
+
+    if len(args) != 2:
+        parser.error("expected a report name and a path")
+    report, path = args
+
+    if report == "crashsummary":
+        crashsummary(ResultDir(path), options.channel, options.os or "WINNT")
+    elif report == "plugins":
+        oslist = ("WINNT", "Darwin", "Linux")
+        if options.os:
+            oslist = tuple(options.os.split(","))
+        plugins(ResultDir(path), options.channel, oslist, options.plugin)
+    elif report == "searchproviders":
+        searchproviders(load_csv(path), options.geo)
+    elif report == "churn":
+        churn(ResultDir(path))
+    else:
+        parser.error("unknown report %r" % (report,))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
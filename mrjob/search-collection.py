@@ -0,0 +1,16 @@
+"""
+Compute all of the search reports in searchreports.py in one pass:
+searches by engine, searches by location and the latest search provider of
+beta en-US users. Ship searchreports.py alongside, like healthreportutils.py.
+
+The providers.csv output can be summarized with
+  postprocess.py searchproviders <outdir>/providers.csv
+"""
+
+import searchreports
+
+class AggJob(searchreports.SearchJob):
+    pass
+
+if __name__ == '__main__':
+    AggJob.run()
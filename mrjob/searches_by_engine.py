@@ -12,22 +12,17 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-# THIS SCRIPT IS OUT OF DATE: IT NEES TO BE PORTED TO USE MRJob instead of
-# jydoop
+"""
+Searches per day and engine. Run with searchreports.py shipped alongside,
+like healthreportutils.py; search-collection.py computes this together
+with the other search reports.
+"""
 
-import jydoop
+import searchreports
 
-from healthreportutils import (
-    FHRMapper,
-    setupjob,
-)
+class AggJob(searchreports.SearchJob):
+    REPORTS = ("engine",)
+    OUTPUT_PREFIX = "fhr-searches-by-engine-"
 
-
-@FHRMapper()
-def map(key, payload, context):
-    for day, engine, where, count in payload.daily_search_counts():
-        context.write('\t'.join((day, engine)), count)
-        context.write('\t'.join((day, 'total')), count)
-
-
-combine = reduce = jydoop.sumreducer
+if __name__ == '__main__':
+    AggJob.run()
@@ -12,25 +12,17 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-# THIS SCRIPT IS OUT OF DATE: IT NEES TO BE PORTED TO USE MRJob instead of
-# jydoop
+"""
+Searches per channel and search source for the major channels. Run with
+searchreports.py shipped alongside, like healthreportutils.py;
+search-collection.py computes this together with the other search reports.
+"""
 
-import jydoop
+import searchreports
 
-from healthreportutils import (
-    FHRMapper,
-    setupjob,
-)
-
-
-@FHRMapper(only_major_channels=True)
-def map(key, payload, context):
-    channel = payload.channel
-
-    for day, engine, where, count in payload.daily_search_counts():
-        context.write('\t'.join((channel, where)), count)
-        context.write('\t'.join((channel, 'total')), count)
-
-
-combine = reduce = jydoop.sumreducer
+class AggJob(searchreports.SearchJob):
+    REPORTS = ("location",)
+    OUTPUT_PREFIX = "fhr-searches-by-location-"
 
+if __name__ == '__main__':
+    AggJob.run()
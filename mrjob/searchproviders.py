@@ -1,5 +1,11 @@
+"""
+The latest search provider of beta en-US users, as the providers report of
+searchreports.py computes it, written to a single CSV file. Ship
+searchreports.py alongside, like healthreportutils.py.
+"""
+
 import healthreportutils
-from datetime import date, datetime, timedelta
+import searchreports
 import os, shutil, csv
 import sys, codecs
 import traceback
@@ -8,31 +14,6 @@ import mrjob
 from mrjob.job import MRJob
 import tempfile
 
-try:
-    import simplejson as json
-except ImportError:
-    import json
-
-def active_day(day):
-    if day is None:
-        return False
-    return any(k != "org.mozilla.crashes.crashes" for k in day)
-
-def date_back(start, days):
-    """iter backwards from start for N days"""
-    date = start
-    for n in xrange(0, days):
-        yield date - timedelta(days=n)
-
-def start_date(dstr):
-    """
-    Start measuring a few days before the snapshot was taken to give clients
-    time to upload.
-    """
-    snapshot = datetime.strptime(dstr, "%Y-%m-%d").date()
-    startdate = snapshot - timedelta(days=4)
-    return startdate
-
 def eat_exceptions(func):
     def wrapper(job, k, v):
         try:
@@ -46,45 +27,12 @@ def eat_exceptions(func):
 @eat_exceptions
 @healthreportutils.FHRMapper()
 def map(job, key, payload):
-    channel = payload.channel.split("-")[0]
-    if channel != "beta":
-        return
-
-    locale = payload.last.get("org.mozilla.appInfo.appinfo", {}).get("locale", "?")
-    if locale != "en-US":
-        return
-
-    days = payload.get('data', {}).get('days', {})
-    def get_day(d):
-        dstr = d.strftime("%Y-%m-%d")
-        return days.get(dstr, None)
-
-    sd = start_date(job.options.start_date)
-
-    total_days = 0
-    last_search = "UNKNOWN"
-
-    for d in date_back(sd, 42):
-        day = get_day(d)
-        if not active_day(day):
-            continue
-        total_days += 1
-        if "org.mozilla.searches.counts" in day and last_search == "UNKNOWN":
-            for k, v in day["org.mozilla.searches.counts"].iteritems():
-                if k == "_v":
-                    continue
-                last_search = k.rsplit(".", 1)[0]
-                break
-
-    geo = payload.get("geoCountry", "?")
-    isactive = total_days >= 6
-
-    yield ((geo, isactive, last_search), 1)
+    return searchreports.providers_report(job, payload, payload.search_counts)
 
 def reduce(job, k, vlist):
     yield (k, sum(vlist))
 
-class AggJob(MRJob):
+class AggJob(healthreportutils.PrefetchInput, MRJob):
     HADOOP_INPUT_FORMAT="org.apache.hadoop.mapred.SequenceFileAsTextInputFormat"
     INPUT_PROTOCOL = mrjob.protocol.RawProtocol
 
@@ -94,7 +42,7 @@ class AggJob(MRJob):
         if self.options.start_date is None:
             raise Exception("--start-date is required")
         # validate the start date here
-        start_date(self.options.start_date)
+        searchreports.providers_start_date(self.options.start_date)
 
         outpath = self.options.output_path
         if outpath is None:
@@ -126,7 +74,7 @@ def getresults(fd):
     fd.seek(0)
     for line in fd:
         k, v = line.split("\t")
-        yield json.loads(k), json.loads(v)
+        yield healthreportutils.json_loads(k), healthreportutils.json_loads(v)
 
 def output(fd, path):
     writer = csv.writer(open(path, "w"))
@@ -0,0 +1,171 @@
+"""
+Search reports computed from FHRPayload.search_counts.
+
+Each report is a function of (job, payload, search) yielding (key, count)
+pairs, which are summed. SearchJob runs any set of them in one pass over
+the payloads and writes one CSV per report:
+
+* engine: searches per day and engine, plus a per-day total
+* location: searches per channel and search source (searchbar, urlbar...),
+  plus a per-channel total, for the major channels
+* providers: beta en-US users by geo, whether they were active on at least
+  6 of the last 42 days, and the engine of their latest search; needs
+  --start-date
+"""
+
+import healthreportutils
+from datetime import datetime, timedelta
+import os, shutil, csv
+import sys, codecs
+import traceback
+
+import mrjob
+from mrjob.job import MRJob
+import tempfile
+
+@healthreportutils.memoized
+def providers_start_date(dstr):
+    """
+    Start measuring a few days before the snapshot was taken to give clients
+    time to upload.
+    """
+    snapshot = datetime.strptime(dstr, "%Y-%m-%d").date()
+    return snapshot - timedelta(days=4)
+
+def engine_report(job, payload, search):
+    for (day, engine), count in search.daily_engine_totals().iteritems():
+        yield ((day, engine), count)
+
+def location_report(job, payload, search):
+    if not payload.is_major_channel():
+        return
+    channel = payload.channel
+    for where, count in search.where_totals().iteritems():
+        yield ((channel, where), count)
+
+def providers_report(job, payload, search):
+    dims = payload.dimensions
+    if dims.channel != "beta" or dims.locale != "en-US":
+        return
+
+    days = payload.get('data', {}).get('days', {})
+    sd = providers_start_date(job.options.start_date)
+
+    total_days = 0
+    last_search = "UNKNOWN"
+
+    for d, dstr in healthreportutils.probe_dates(sd, 42):
+        day = days.get(dstr, None)
+        if not healthreportutils.active_day(day):
+            continue
+        total_days += 1
+        if last_search == "UNKNOWN":
+            last_search = search.first_engine(dstr) or "UNKNOWN"
+
+    yield ((dims.geo, total_days >= 6, last_search), 1)
+
+REPORTS = {
+    "engine": engine_report,
+    "location": location_report,
+    "providers": providers_report,
+}
+
+def logexceptions(func):
+    def wrapper(job, k, v):
+        try:
+            for k1, v1 in func(job, k, v):
+                yield (k1, v1)
+        except:
+            exc = traceback.format_exc()
+            print >>sys.stderr, "Script exception: ", exc
+            yield ("exception", exc)
+    return wrapper
+
+@logexceptions
+@healthreportutils.FHRMapper()
+def map(job, key, payload):
+    search = payload.search_counts
+    for name in job.REPORTS:
+        for k, v in REPORTS[name](job, payload, search):
+            yield ((name,) + k, v)
+
+def reduce(job, k, vlist):
+    if k == "exception":
+        for v in vlist:
+            yield (k, v)
+    else:
+        yield (k, sum(vlist))
+
+class SearchJob(healthreportutils.PrefetchInput, MRJob):
+    """
+    Runs the reports named in REPORTS. Subclasses pick the reports and the
+    default output path.
+    """
+    HADOOP_INPUT_FORMAT="org.apache.hadoop.mapred.SequenceFileAsTextInputFormat"
+    INPUT_PROTOCOL = mrjob.protocol.RawProtocol
+
+    REPORTS = ("engine", "location", "providers")
+    OUTPUT_PREFIX = "fhr-searches-"
+
+    def run_job(self):
+        self.stdout = tempfile.TemporaryFile()
+
+        if "providers" in self.REPORTS:
+            if self.options.start_date is None:
+                raise Exception("--start-date is required")
+            # validate the start date here
+            providers_start_date(self.options.start_date)
+
+        # Do the big work
+        super(SearchJob, self).run_job()
+
+        # Produce the separated output files
+        outpath = self.options.output_path
+        if outpath is None:
+            outpath = os.path.expanduser("~/" + self.OUTPUT_PREFIX +
+                                         (self.options.start_date or "all"))
+        output(self.stdout, outpath)
+
+    def configure_options(self):
+        super(SearchJob, self).configure_options()
+
+        self.add_passthrough_option('--output-path', help="Specify output path",
+                                    default=None)
+        self.add_passthrough_option('--start-date', help="Specify start date",
+                                    default=None)
+
+    def mapper(self, key, value):
+        return map(self, key, value)
+
+    def reducer(self, key, vlist):
+        return reduce(self, key, vlist)
+
+    combiner = reducer
+
+def getresults(fd):
+    fd.seek(0)
+    for line in fd:
+        k, v = line.split("\t")
+        yield healthreportutils.json_loads(k), healthreportutils.json_loads(v)
+
+def output(fd, path):
+    try:
+        shutil.rmtree(path)
+    except OSError:
+        pass
+    os.mkdir(path)
+
+    writers = {}
+    errs = codecs.getwriter("utf-8")(open(os.path.join(path, "exceptions.txt"), "w"))
+    for k, v in getresults(fd):
+        if k == "exception":
+            print >>errs, "==ERR=="
+            print >>errs, v
+            continue
+        fname = k[0]
+        if fname in writers:
+            w = writers[fname]
+        else:
+            w = csv.writer(open(os.path.join(path, fname + ".csv"), "w"))
+            writers[fname] = w
+        w.writerow([unicode(s).encode("utf-8") for s in k[1:] + [v]])
@@ -27,14 +27,22 @@ import java.io.InputStreamReader;
 import java.io.UnsupportedEncodingException;
 import java.net.InetAddress;
 import java.util.ArrayList;
+import java.util.List;
 import java.util.Properties;
+import java.util.concurrent.ArrayBlockingQueue;
+import java.util.concurrent.BlockingQueue;
 import java.util.concurrent.Callable;
 import java.util.concurrent.CancellationException;
+import java.util.concurrent.ConcurrentHashMap;
 import java.util.concurrent.CountDownLatch;
 import java.util.concurrent.ExecutionException;
+import java.util.concurrent.ExecutorService;
+import java.util.concurrent.Executors;
 import java.util.concurrent.Future;
+import java.util.concurrent.FutureTask;
 import java.util.concurrent.TimeUnit;
 import java.util.concurrent.TimeoutException;
+import java.util.concurrent.atomic.AtomicLong;
 
 import kafka.consumer.KafkaStream;
 import kafka.message.Message;
@@ -77,8 +85,24 @@ public class FHRConsumer extends KafkaConsumer {
     private static final String GEO_COUNTRY_FIELD = "geoCountry";
     private static final String UNKNOWN_COUNTRY_CODE = "--";
 
+    private static final int DEFAULT_BATCH_SIZE = 100;
+    private static final int DEFAULT_LOG_SAMPLE_RATE = 1000;
+    private static final int GEOIP_CACHE_MAX_SIZE = 65536;
+
+    // Marks the end of a worker's stream in its queue of pending operations
+    private static final Future<SinkOperation> END_OF_STREAM = completed(null);
+
     private ObjectMapper jsonMapper;
+    private JsonFieldSplicer geoCountrySplicer;
     private LookupService geoIpLookupService;
+    private ExecutorService enrichExecutor;
+
+    // Country codes by IP prefix; see ipPrefix()
+    private final ConcurrentHashMap<Long, String> geoIpCache = new ConcurrentHashMap<Long, String>();
+
+    private int batchSize = DEFAULT_BATCH_SIZE;
+    private final int logSampleRate;
+    private final AtomicLong putCount = new AtomicLong();
 
     protected Meter invalidJsonMeter;
     protected Meter unknownGeoIpMeter;
@@ -98,6 +122,17 @@ public class FHRConsumer extends KafkaConsumer {
             throw new RuntimeException(e);
         }
 
+        int enrichThreads = props.containsKey("consumer.enrich.threads") ?
+                Integer.parseInt(props.getProperty("consumer.enrich.threads")) :
+                Runtime.getRuntime().availableProcessors();
+        enrichExecutor = Executors.newFixedThreadPool(enrichThreads);
+        if (Boolean.parseBoolean(props.getProperty("consumer.geo.splice", "false"))) {
+            geoCountrySplicer = new JsonFieldSplicer(GEO_COUNTRY_FIELD);
+        }
+        logSampleRate = Math.max(1, props.containsKey("consumer.log.sample.rate") ?
+                Integer.parseInt(props.getProperty("consumer.log.sample.rate")) :
+                DEFAULT_LOG_SAMPLE_RATE);
+
         invalidJsonMeter = Metrics.newMeter(new MetricName("bagheera", "consumer", topic + ".json.invalid"), "messages", TimeUnit.SECONDS);
         unknownGeoIpMeter = Metrics.newMeter(new MetricName("bagheera", "consumer", topic + ".geoip.unknown"), "messages", TimeUnit.SECONDS);
     }
@@ -105,11 +140,65 @@ public class FHRConsumer extends KafkaConsumer {
     @Override
     public void close() {
         super.close();
+        enrichExecutor.shutdown();
         if (geoIpLookupService != null) {
             geoIpLookupService.close();
         }
     }
 
+    /**
+     * Set how many pending messages a worker stores to its sink at a time.
+     */
+    public void setBatchSize(int batchSize) {
+        this.batchSize = Math.max(1, batchSize);
+    }
+
+    /**
+     * Key for the GeoIP cache: the /24 of an IPv4 address or the /48 of an
+     * IPv6 address, tagged with the address length. Country assignments
+     * practically never split such a network.
+     */
+    static long ipPrefix(byte[] addr) {
+        int n = addr.length == 4 ? 3 : Math.min(6, addr.length);
+        long prefix = addr.length;
+        for (int i = 0; i < n; i++) {
+            prefix = (prefix << 8) | (addr[i] & 0xff);
+        }
+        return prefix;
+    }
+
+    private String lookupCountry(byte[] addr) throws IOException {
+        Long prefix = ipPrefix(addr);
+        String country = geoIpCache.get(prefix);
+        if (country == null) {
+            Location location = geoIpLookupService.getLocation(InetAddress.getByAddress(addr));
+            if (location != null && location.countryCode != null &&
+                !UNKNOWN_COUNTRY_CODE.equals(location.countryCode) &&
+                location.countryCode.trim().length() > 0) {
+                country = location.countryCode;
+            } else {
+                country = UNKNOWN_COUNTRY_CODE;
+            }
+            if (geoIpCache.size() >= GEOIP_CACHE_MAX_SIZE) {
+                geoIpCache.clear();
+            }
+            geoIpCache.put(prefix, country);
+        }
+        return country;
+    }
+
+    private static Future<SinkOperation> completed(SinkOperation op) {
+        final SinkOperation result = op;
+        FutureTask<SinkOperation> task = new FutureTask<SinkOperation>(new Callable<SinkOperation>() {
+            @Override
+            public SinkOperation call() {
+                return result;
+            }
+        });
+        task.run();
+        return task;
+    }
+
     @Override
     public void poll() {
         final CountDownLatch latch = new CountDownLatch(streams.size());
@@ -200,6 +289,175 @@ public class FHRConsumer extends KafkaConsumer {
         return new FHRConsumer(cmd.getOptionValue("topic"), props, numThreads);
     }
 
+    /**
+     * A store or delete to apply to a sink, in stream order.
+     */
+    private static final class SinkOperation {
+
+        private final KeyValueSink sink;
+        private final String namespace;
+        private final String id;
+        private final byte[] data;
+        private final Long timestamp;
+
+        private SinkOperation(KeyValueSink sink, String namespace, String id, byte[] data, Long timestamp) {
+            this.sink = sink;
+            this.namespace = namespace;
+            this.id = id;
+            this.data = data;
+            this.timestamp = timestamp;
+        }
+
+        static SinkOperation store(KeyValueSink sink, BagheeraMessage bmsg, byte[] data) {
+            return new SinkOperation(sink, bmsg.getNamespace(), bmsg.getId(), data,
+                                     bmsg.hasTimestamp() ? Long.valueOf(bmsg.getTimestamp()) : null);
+        }
+
+        static SinkOperation delete(KeyValueSink sink, BagheeraMessage bmsg) {
+            return new SinkOperation(sink, bmsg.getNamespace(), bmsg.getId(), null, null);
+        }
+
+        boolean isDelete() {
+            return data == null;
+        }
+
+        void apply() throws IOException {
+            if (isDelete()) {
+                sink.delete(id);
+            } else if (timestamp != null) {
+                sink.store(id, data, timestamp);
+            } else {
+                sink.store(id, data);
+            }
+        }
+    }
+
+    /**
+     * Adds geoCountry to a CREATE_UPDATE message, either by splicing it into
+     * the raw payload (consumer.geo.splice) or by parsing the payload and
+     * serializing it again. Runs on the enrichment pool; returns null for
+     * invalid JSON.
+     */
+    private class Enricher implements Callable<SinkOperation> {
+
+        private final KeyValueSink sink;
+        private final BagheeraMessage bmsg;
+
+        public Enricher(KeyValueSink sink, BagheeraMessage bmsg) {
+            this.sink = sink;
+            this.bmsg = bmsg;
+        }
+
+        @Override
+        public SinkOperation call() throws Exception {
+            try {
+                // do a geoip lookup on the IP if we have one
+                String country = UNKNOWN_COUNTRY_CODE;
+                if (bmsg.hasIpAddr()) {
+                    country = lookupCountry(bmsg.getIpAddr().toByteArray());
+                }
+
+                byte[] data = null;
+                if (geoCountrySplicer != null) {
+                    data = geoCountrySplicer.splice(bmsg.getPayload().toByteArray(), country);
+                }
+                if (data == null) {
+                    ObjectNode document = jsonMapper.readValue(bmsg.getPayload().toStringUtf8(), ObjectNode.class);
+                    document.put(GEO_COUNTRY_FIELD, country);
+                    data = jsonMapper.writeValueAsBytes(document);
+                }
+
+                if (UNKNOWN_COUNTRY_CODE.equals(country)) {
+                    unknownGeoIpMeter.mark();
+                }
+                return SinkOperation.store(sink, bmsg, data);
+            } catch (JsonParseException e) {
+                invalidJsonMeter.mark();
+                LOG.error("Invalid JSON", e);
+                LOG.debug(bmsg.getPayload().toStringUtf8());
+            } catch (JsonMappingException e) {
+                invalidJsonMeter.mark();
+                LOG.error("Invalid JSON", e);
+                LOG.debug(bmsg.getPayload().toStringUtf8());
+            }
+            return null;
+        }
+    }
+
+    /**
+     * Applies a worker's pending operations to the sinks in stream order,
+     * taking up to batchSize of them off the queue at a time. Each operation
+     * is still one store or delete call; batching the puts themselves is left
+     * to the sink, which buffers them (hbasesink.hbase.batchsize).
+     *
+     * If the writer stops for any reason other than END_OF_STREAM, getError()
+     * returns the cause.
+     */
+    private class SinkWriter implements Runnable {
+
+        private final BlockingQueue<Future<SinkOperation>> pending;
+        private volatile Throwable error;
+
+        public SinkWriter(BlockingQueue<Future<SinkOperation>> pending) {
+            this.pending = pending;
+        }
+
+        public Throwable getError() {
+            return error;
+        }
+
+        @Override
+        public void run() {
+            List<Future<SinkOperation>> batch = new ArrayList<Future<SinkOperation>>(batchSize);
+            try {
+                while (true) {
+                    batch.add(pending.take());
+                    pending.drainTo(batch, batchSize - 1);
+                    for (Future<SinkOperation> f : batch) {
+                        if (f == END_OF_STREAM) {
+                            return;
+                        }
+                        SinkOperation op = f.get();
+                        if (op != null) {
+                            op.apply();
+                            logOperation(op);
+                        }
+                        consumed.mark();
+                    }
+                    batch.clear();
+                }
+            } catch (InterruptedException e) {
+                error = e;
+                LOG.info("Interrupted while storing", e);
+                Thread.currentThread().interrupt();
+            } catch (ExecutionException e) {
+                error = e.getCause();
+                LOG.error("Error while preparing message for data sink", e.getCause());
+            } catch (IOException e) {
+                error = e;
+                LOG.error("IO error while storing to data sink", e);
+            } catch (Throwable t) {
+                error = t;
+                LOG.error("Error while storing to data sink", t);
+            }
+        }
+
+        private void logOperation(SinkOperation op) {
+            if (op.isDelete()) {
+                LOG.info("CONSUMER_DELETE "+op.namespace+" "+op.id);
+            } else if (LOG.isDebugEnabled()) {
+                LOG.debug("CONSUMER_PUT "+op.namespace+" "+op.id);
+            } else if (putCount.incrementAndGet() % logSampleRate == 0) {
+                LOG.info("CONSUMER_PUT "+op.namespace+" "+op.id+" (1 in "+logSampleRate+")");
+            }
+        }
+    }
+
+    /**
+     * Reads one stream. Messages are enriched on the shared enrichment pool
+     * and handed to a SinkWriter thread in stream order, so that parsing,
+     * GeoIP lookups and sink writes overlap.
+     */
     private class FHRConsumerWorker implements Callable<Void> {
 
         private final KafkaStream<Message> stream;
@@ -210,55 +468,44 @@ public class FHRConsumer extends KafkaConsumer {
             this.latch = latch;
         }
 
+        private boolean writerFailed(SinkWriter writer, Thread writerThread) {
+            return writer.getError() != null || !writerThread.isAlive();
+        }
+
+        private void enqueue(BlockingQueue<Future<SinkOperation>> pending, SinkWriter writer,
+                             Thread writerThread, Future<SinkOperation> f) throws IOException, InterruptedException {
+            while (!pending.offer(f, 1, TimeUnit.SECONDS)) {
+                if (writerFailed(writer, writerThread)) {
+                    throw new IOException("Data sink writer failed", writer.getError());
+                }
+            }
+        }
+
         @Override
         public Void call() throws Exception {
+            BlockingQueue<Future<SinkOperation>> pending = new ArrayBlockingQueue<Future<SinkOperation>>(batchSize * 2);
+            SinkWriter writer = new SinkWriter(pending);
+            Thread writerThread = new Thread(writer, "fhr-sink-writer");
+            writerThread.start();
             try {
                 for (MessageAndMetadata<Message> mam : stream) {
+                    if (writerFailed(writer, writerThread)) {
+                        LOG.error("Data sink writer stopped; no longer consuming this stream", writer.getError());
+                        break;
+                    }
                     BagheeraMessage bmsg = BagheeraMessage.parseFrom(ByteString.copyFrom(mam.message().payload()));
                     // get the sink for this message's namespace
                     // (typically only one sink unless a regex pattern was used to listen to multiple topics)
                     KeyValueSink sink = sinkFactory.getSink(bmsg.getNamespace());
                     if (bmsg.getOperation() == Operation.CREATE_UPDATE &&
                         bmsg.hasId() && bmsg.hasPayload()) {
-                        String payloadString = bmsg.getPayload().toStringUtf8();
-                        try {
-                            ObjectNode document = jsonMapper.readValue(payloadString, ObjectNode.class);
-                            // do a geoip lookup on the IP if we have one
-                            if (bmsg.hasIpAddr()) {
-                                Location location = geoIpLookupService.getLocation(InetAddress.getByAddress(bmsg.getIpAddr().toByteArray()));
-                                if (location != null && !UNKNOWN_COUNTRY_CODE.equals(location.countryCode) &&
-                                    location.countryCode.trim().length() > 0) {
-                                    document.put(GEO_COUNTRY_FIELD, location.countryCode);
-                                } else {
-                                    unknownGeoIpMeter.mark();
-                                    document.put(GEO_COUNTRY_FIELD, UNKNOWN_COUNTRY_CODE);
-                                }
-                            } else {
-                                unknownGeoIpMeter.mark();
-                                document.put(GEO_COUNTRY_FIELD, UNKNOWN_COUNTRY_CODE);
-                            }
-                            LOG.info("CONSUMER_PUT "+bmsg.getNamespace()+" "+bmsg.getId());
-                            // store the document
-                            if (bmsg.hasTimestamp()) {
-                                sink.store(bmsg.getId(), jsonMapper.writeValueAsBytes(document), bmsg.getTimestamp());
-                            } else {
-                                sink.store(bmsg.getId(), jsonMapper.writeValueAsBytes(document));
-                            }
-                        } catch (JsonParseException e) {
-                            invalidJsonMeter.mark();
-                            LOG.error("Invalid JSON", e);
-                            LOG.debug(payloadString);
-                        } catch (JsonMappingException e) {
-                            invalidJsonMeter.mark();
-                            LOG.error("Invalid JSON", e);
-                            LOG.debug(payloadString);
-                        }
+                        enqueue(pending, writer, writerThread, enrichExecutor.submit(new Enricher(sink, bmsg)));
                     } else if (bmsg.getOperation() == Operation.DELETE &&
                         bmsg.hasId()) {
-                        LOG.info("CONSUMER_DELETE "+bmsg.getNamespace()+" "+bmsg.getId());
-                        sink.delete(bmsg.getId());
+                        enqueue(pending, writer, writerThread, completed(SinkOperation.delete(sink, bmsg)));
+                    } else {
+                        consumed.mark();
                     }
-                    consumed.mark();
                 }
             } catch (InvalidProtocolBufferException e) {
                 LOG.error("Invalid protocol buffer in data stream", e);
@@ -267,7 +514,15 @@ public class FHRConsumer extends KafkaConsumer {
             } catch (IOException e) {
                 LOG.error("IO error while storing to data sink", e);
             } finally {
-                latch.countDown();
+                try {
+                    // let the writer store what is already pending, then stop
+                    if (!writerFailed(writer, writerThread)) {
+                        enqueue(pending, writer, writerThread, END_OF_STREAM);
+                    }
+                    writerThread.join();
+                } finally {
+                    latch.countDown();
+                }
             }
 
             return null;
@@ -301,6 +556,9 @@ public class FHRConsumer extends KafkaConsumer {
             KeyValueSinkFactory sinkFactory = KeyValueSinkFactory.getInstance(HBaseSink.class, sinkConfig);
             sh.addLast(sinkFactory);
             consumer.setSinkFactory(sinkFactory);
+            if (cmd.hasOption("batchsize")) {
+                consumer.setBatchSize(Integer.parseInt(cmd.getOptionValue("batchsize")));
+            }
 
             // Initialize metrics collection, reporting, etc.
             final MetricsManager manager = MetricsManager.getDefaultMetricsManager();
@@ -0,0 +1,121 @@
+/*
+ * Copyright 2012 Mozilla Foundation
+ *
+ * Licensed to the Apache Software Foundation (ASF) under one
+ * or more contributor license agreements.  See the NOTICE file
+ * distributed with this work for additional information
+ * regarding copyright ownership.  The ASF licenses this file
+ * to you under the Apache License, Version 2.0 (the
+ * "License"); you may not use this file except in compliance
+ * with the License.  You may obtain a copy of the License at
+ *
+ *   http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+package com.mozilla.fhr.consumer;
+
+import java.io.IOException;
+import java.io.UnsupportedEncodingException;
+
+import com.fasterxml.jackson.core.JsonFactory;
+import com.fasterxml.jackson.core.JsonParseException;
+import com.fasterxml.jackson.core.JsonParser;
+import com.fasterxml.jackson.core.JsonToken;
+
+/**
+ * Adds a top-level string field to a UTF-8 JSON object by splicing it into
+ * the raw bytes right after the opening brace, instead of parsing the
+ * document into a tree and writing it out again.
+ *
+ * The document is still checked with a streaming scan that skips over
+ * every value without building anything, so invalid JSON is rejected just
+ * as a full parse would reject it.
+ */
+public class JsonFieldSplicer {
+
+    private final JsonFactory jsonFactory = new JsonFactory();
+    private final String field;
+
+    public JsonFieldSplicer(String field) {
+        this.field = field;
+    }
+
+    /**
+     * Returns the document with field set to value, or null if it can't be
+     * spliced safely: the field is already present, something follows the
+     * object, or the value would need escaping. Callers should fall back
+     * to a full parse then.
+     *
+     * @throws JsonParseException if the document is not a valid JSON object
+     */
+    public byte[] splice(byte[] document, String value) throws IOException {
+        if (!isPlain(value)) {
+            return null;
+        }
+
+        int fields = 0;
+        JsonParser parser = jsonFactory.createJsonParser(document);
+        try {
+            if (parser.nextToken() != JsonToken.START_OBJECT) {
+                throw new JsonParseException("Expected a JSON object", parser.getCurrentLocation());
+            }
+            JsonToken token;
+            while ((token = parser.nextToken()) == JsonToken.FIELD_NAME) {
+                if (field.equals(parser.getCurrentName())) {
+                    return null;
+                }
+                fields++;
+                parser.nextToken();
+                parser.skipChildren();
+            }
+            if (token != JsonToken.END_OBJECT) {
+                throw new JsonParseException("Unexpected token " + token, parser.getCurrentLocation());
+            }
+            try {
+                if (parser.nextToken() != null) {
+                    return null;
+                }
+            } catch (JsonParseException e) {
+                return null;
+            }
+        } finally {
+            parser.close();
+        }
+
+        // The scan started with START_OBJECT, so the first brace opens it
+        int brace = 0;
+        while (document[brace] != '{') {
+            brace++;
+        }
+
+        byte[] insert = utf8("\"" + field + "\":\"" + value + "\"" + (fields > 0 ? "," : ""));
+        byte[] spliced = new byte[document.length + insert.length];
+        System.arraycopy(document, 0, spliced, 0, brace + 1);
+        System.arraycopy(insert, 0, spliced, brace + 1, insert.length);
+        System.arraycopy(document, brace + 1, spliced, brace + 1 + insert.length, document.length - brace - 1);
+        return spliced;
+    }
+
+    private static boolean isPlain(String value) {
+        for (int i = 0; i < value.length(); i++) {
+            char c = value.charAt(i);
+            if (c < 0x20 || c > 0x7e || c == '"' || c == '\\') {
+                return false;
+            }
+        }
+        return true;
+    }
+
+    private static byte[] utf8(String s) {
+        try {
+            return s.getBytes("UTF-8");
+        } catch (UnsupportedEncodingException e) {
+            throw new RuntimeException(e);
+        }
+    }
+}
@@ -20,9 +20,6 @@
 package com.mozilla.fhr.pig.eval;
 
 import java.io.IOException;
-import java.text.ParseException;
-import java.text.SimpleDateFormat;
-import java.util.Date;
 import java.util.Map;
 
 import org.apache.pig.EvalFunc;
@@ -32,10 +29,7 @@ public class FirstPingTime extends EvalFunc<Long> {
 
     public static enum ERRORS { ParseError };
     
-    private final SimpleDateFormat sdf;
-    
     public FirstPingTime(String dateFormat) {
-        sdf = new SimpleDateFormat("yyyy-MM-dd");
     }
     
     @SuppressWarnings("unchecked")
@@ -45,20 +39,12 @@ public class FirstPingTime extends EvalFunc<Long> {
             return null;
         }
          
-        Long minPingTime = null;
-        Map<String,Object> dataPoints = (Map<String,Object>)input.get(0);
-        for (String dayStr : dataPoints.keySet()) {
-            try {
-                Date pingTime = sdf.parse(dayStr);
-                if (minPingTime == null || pingTime.getTime() < minPingTime) {
-                    minPingTime = pingTime.getTime();
-                }
-            } catch (ParseException e) {
-                pigLogger.warn(this, "Parse error parsing pingTime", ERRORS.ParseError);
-            }
+        ParsedDays days = ParsedDays.of((Map<String,Object>)input.get(0));
+        for (int i=0; i < days.invalidCount(); i++) {
+            pigLogger.warn(this, "Parse error parsing pingTime", ERRORS.ParseError);
         }
         
-        return minPingTime;
+        return days.isEmpty() ? null : days.time(0);
     }
     
 }
\ No newline at end of file
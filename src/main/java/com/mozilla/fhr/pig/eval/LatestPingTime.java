@@ -30,17 +30,17 @@ import org.apache.pig.data.Tuple;
 
 
 /**
- * Gets the latest ping time from data points that is less than or equal to the perspective date.
+ * Gets the latest ping time from data points that is less than or equal to the perspective date,
+ * or null if there is no such ping.
  */
 public class LatestPingTime extends EvalFunc<Long> {
 
     public static enum ERRORS { ParseError };
     
-    private final SimpleDateFormat sdf;
     private long perspectiveTime;
     
     public LatestPingTime(String dateFormat, String perspectiveDate) {
-        sdf = new SimpleDateFormat("yyyy-MM-dd");
+        SimpleDateFormat sdf = new SimpleDateFormat("yyyy-MM-dd");
         try {
             Date d = sdf.parse(perspectiveDate);
             perspectiveTime = d.getTime();
@@ -56,20 +56,13 @@ public class LatestPingTime extends EvalFunc<Long> {
             return null;
         }
          
-        Long maxPingTime = null;
-        Map<String,Object> dataPoints = (Map<String,Object>)input.get(0);
-        for (String dayStr : dataPoints.keySet()) {
-            try {
-                Date pingTime = sdf.parse(dayStr);
-                if (maxPingTime == null || (pingTime.getTime() <= perspectiveTime && pingTime.getTime() > maxPingTime)) {
-                    maxPingTime = pingTime.getTime();
-                }
-            } catch (ParseException e) {
-                pigLogger.warn(this, "Parse error parsing pingTime", ERRORS.ParseError);
-            }
+        ParsedDays days = ParsedDays.of((Map<String,Object>)input.get(0));
+        for (int i=0; i < days.invalidCount(); i++) {
+            pigLogger.warn(this, "Parse error parsing pingTime", ERRORS.ParseError);
         }
         
-        return maxPingTime;
+        int n = days.countUntil(perspectiveTime);
+        return n == 0 ? null : days.time(n-1);
     }
     
 }
\ No newline at end of file
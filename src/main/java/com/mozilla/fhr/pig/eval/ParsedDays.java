@@ -0,0 +1,228 @@
+/*
+ * Copyright 2012 Mozilla Foundation
+ *
+ * Licensed to the Apache Software Foundation (ASF) under one
+ * or more contributor license agreements.  See the NOTICE file
+ * distributed with this work for additional information
+ * regarding copyright ownership.  The ASF licenses this file
+ * to you under the Apache License, Version 2.0 (the
+ * "License"); you may not use this file except in compliance
+ * with the License.  You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+package com.mozilla.fhr.pig.eval;
+
+import java.util.Arrays;
+import java.util.Calendar;
+import java.util.GregorianCalendar;
+import java.util.Map;
+import java.util.concurrent.ConcurrentHashMap;
+
+/**
+ * The keys of a data.days map ("yyyy-MM-dd" strings) parsed once and sorted.
+ *
+ * Scripts such as fhr_uniques.pig call several of the day based UDFs on the
+ * same map for every row. ParsedDays.of() keeps the last map parsed on each
+ * thread and returns the same instance while it is passed again, so the keys
+ * are parsed and sorted once per row rather than once per UDF.
+ *
+ * Day strings are parsed by hand and cached, without SimpleDateFormat. The
+ * times returned are midnight in the default time zone, as
+ * SimpleDateFormat.parse would have returned them.
+ */
+public class ParsedDays {
+
+    public static final int INVALID_DAY = Integer.MIN_VALUE;
+
+    private static final int DAY_CACHE_LIMIT = 1 << 16;
+    private static final Map<String,Day> dayCache = new ConcurrentHashMap<String,Day>();
+    private static final Day INVALID = new Day(INVALID_DAY, 0L);
+
+    private static final ThreadLocal<ParsedDays> last = new ThreadLocal<ParsedDays>();
+
+    private static class Day {
+        final int epochDay;
+        final long time;
+
+        Day(int epochDay, long time) {
+            this.epochDay = epochDay;
+            this.time = time;
+        }
+    }
+
+    private final Map<String,Object> days;
+    private final int mapSize;
+    private final String[] keys;
+    private final int[] epochDays;
+    private final long[] times;
+    private final int invalidCount;
+
+    private ParsedDays(Map<String,Object> days) {
+        this.days = days;
+        this.mapSize = days.size();
+
+        String[] unsorted = new String[mapSize];
+        Day[] parsed = new Day[mapSize];
+        long[] order = new long[mapSize];
+        int n = 0;
+        int invalid = 0;
+        for (String key : days.keySet()) {
+            Day d = lookup(key);
+            if (d == INVALID) {
+                invalid++;
+                continue;
+            }
+            unsorted[n] = key;
+            parsed[n] = d;
+            // sort on the day, keeping the original position in the low bits
+            order[n] = ((long)d.epochDay << 32) | n;
+            n++;
+        }
+        Arrays.sort(order, 0, n);
+
+        keys = new String[n];
+        epochDays = new int[n];
+        times = new long[n];
+        for (int i=0; i < n; i++) {
+            int j = (int)(order[i] & 0xffffffffL);
+            keys[i] = unsorted[j];
+            epochDays[i] = parsed[j].epochDay;
+            times[i] = parsed[j].time;
+        }
+        invalidCount = invalid;
+    }
+
+    /**
+     * The parsed days of a data.days map. Repeated calls with the same map
+     * instance return the same ParsedDays.
+     */
+    public static ParsedDays of(Map<String,Object> days) {
+        ParsedDays pd = last.get();
+        if (pd == null || pd.days != days || pd.mapSize != days.size()) {
+            pd = new ParsedDays(days);
+            last.set(pd);
+        }
+        return pd;
+    }
+
+    private static Day lookup(String dayStr) {
+        Day d = dayCache.get(dayStr);
+        if (d == null) {
+            d = parse(dayStr);
+            if (dayCache.size() >= DAY_CACHE_LIMIT) {
+                dayCache.clear();
+            }
+            dayCache.put(dayStr, d);
+        }
+        return d;
+    }
+
+    private static int digits(String s, int start, int end) {
+        int v = 0;
+        for (int i=start; i < end; i++) {
+            char c = s.charAt(i);
+            if (c < '0' || c > '9') {
+                return -1;
+            }
+            v = v * 10 + (c - '0');
+        }
+        return v;
+    }
+
+    private static Day parse(String s) {
+        if (s == null || s.length() != 10 || s.charAt(4) != '-' || s.charAt(7) != '-') {
+            return INVALID;
+        }
+        int year = digits(s, 0, 4);
+        int month = digits(s, 5, 7);
+        int day = digits(s, 8, 10);
+        if (year < 0 || month < 1 || month > 12 || day < 1 || day > 31) {
+            return INVALID;
+        }
+
+        // Lenient like SimpleDateFormat, so 2012-02-30 is 2012-03-01
+        Calendar cal = new GregorianCalendar();
+        cal.clear();
+        cal.set(year, month - 1, day);
+        return new Day(epochDay(year, month, day), cal.getTimeInMillis());
+    }
+
+    /**
+     * Days since 1970-01-01 of a proleptic Gregorian date.
+     */
+    static int epochDay(int year, int month, int day) {
+        int y = month <= 2 ? year - 1 : year;
+        int era = (y >= 0 ? y : y - 399) / 400;
+        int yoe = y - era * 400;
+        int doy = (153 * (month > 2 ? month - 3 : month + 9) + 2) / 5 + day - 1;
+        int doe = yoe * 365 + yoe / 4 - yoe / 100 + doy;
+        return era * 146097 + doe - 719468;
+    }
+
+    /**
+     * Days since 1970-01-01 of a "yyyy-MM-dd" string, or INVALID_DAY.
+     */
+    public static int epochDay(String dayStr) {
+        return lookup(dayStr).epochDay;
+    }
+
+    public int size() {
+        return keys.length;
+    }
+
+    public boolean isEmpty() {
+        return keys.length == 0;
+    }
+
+    /**
+     * Number of keys which were not valid day strings.
+     */
+    public int invalidCount() {
+        return invalidCount;
+    }
+
+    public String key(int i) {
+        return keys[i];
+    }
+
+    public int epochDay(int i) {
+        return epochDays[i];
+    }
+
+    public long time(int i) {
+        return times[i];
+    }
+
+    /**
+     * The value stored under the i'th day.
+     */
+    public Object value(int i) {
+        return days.get(keys[i]);
+    }
+
+    /**
+     * Number of days at or before time, i.e. the index just past the last
+     * of them.
+     */
+    public int countUntil(long time) {
+        int lo = 0;
+        int hi = times.length;
+        while (lo < hi) {
+            int mid = (lo + hi) >>> 1;
+            if (times[mid] <= time) {
+                lo = mid + 1;
+            } else {
+                hi = mid;
+            }
+        }
+        return lo;
+    }
+
+}
@@ -20,12 +20,7 @@
 package com.mozilla.fhr.pig.eval;
 
 import java.io.IOException;
-import java.text.ParseException;
-import java.text.SimpleDateFormat;
-import java.util.Date;
 import java.util.Map;
-import java.util.Set;
-import java.util.TreeSet;
 
 import org.apache.pig.EvalFunc;
 import org.apache.pig.data.BagFactory;
@@ -39,7 +34,6 @@ public class PingTimes extends EvalFunc<DataBag> {
     
     private static final BagFactory bagFactory = BagFactory.getInstance();
     private static final TupleFactory tupleFactory = TupleFactory.getInstance();
-    private static final SimpleDateFormat sdf = new SimpleDateFormat("yyyy-MM-dd");
     
     @SuppressWarnings("unchecked")
     @Override
@@ -48,22 +42,19 @@ public class PingTimes extends EvalFunc<DataBag> {
             return null;
         }
         
-        Set<Long> pingTimes = new TreeSet<Long>();
-        Map<String,Object> dataPoints = (Map<String,Object>)input.get(0);
-        for (String dayStr : dataPoints.keySet()) {
-            Date pingTime;
-            try {
-                pingTime = sdf.parse(dayStr);
-                pingTimes.add(pingTime.getTime());
-            } catch (ParseException e) {
-                pigLogger.warn(this, "Parse error parsing pingTime", ERRORS.ParseError);
-            }
+        ParsedDays days = ParsedDays.of((Map<String,Object>)input.get(0));
+        for (int i=0; i < days.invalidCount(); i++) {
+            pigLogger.warn(this, "Parse error parsing pingTime", ERRORS.ParseError);
         }
         
         DataBag db = bagFactory.newDefaultBag();
-        for (Long pingTime : pingTimes) {
+        for (int i=0; i < days.size(); i++) {
+            // keys which parse to the same day are only added once
+            if (i > 0 && days.time(i) == days.time(i-1)) {
+                continue;
+            }
             Tuple t = tupleFactory.newTuple(1);
-            t.set(0, pingTime);
+            t.set(0, days.time(i));
             db.add(t);
         }
         
@@ -0,0 +1,189 @@
+/*
+ * Copyright 2012 Mozilla Foundation
+ *
+ * Licensed to the Apache Software Foundation (ASF) under one
+ * or more contributor license agreements.  See the NOTICE file
+ * distributed with this work for additional information
+ * regarding copyright ownership.  The ASF licenses this file
+ * to you under the Apache License, Version 2.0 (the
+ * "License"); you may not use this file except in compliance
+ * with the License.  You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+package com.mozilla.fhr.pig.eval;
+
+import static java.util.Calendar.DATE;
+
+import java.io.IOException;
+import java.text.ParseException;
+import java.text.SimpleDateFormat;
+import java.util.Calendar;
+import java.util.Date;
+import java.util.HashMap;
+import java.util.Iterator;
+import java.util.Map;
+
+import org.apache.pig.EvalFunc;
+import org.apache.pig.data.Tuple;
+import org.apache.pig.data.TupleFactory;
+
+import com.fasterxml.jackson.core.JsonProcessingException;
+import com.fasterxml.jackson.databind.JsonNode;
+import com.fasterxml.jackson.databind.ObjectMapper;
+import com.mozilla.util.DateUtil;
+
+/**
+ * Everything fhr_uniques.pig needs from one payload, read from the raw JSON
+ * in a single pass instead of through JsonMap and a UDF per field.
+ *
+ * Returns (latest_time:long, first_time:long, product:chararray,
+ * product_version:chararray, product_channel:chararray, os:chararray,
+ * os_version:chararray, geo_country_code:chararray, profile_age:int), or
+ * null if the JSON can not be parsed or data.days is not an object. The
+ * times and version are computed as LatestPingTime, FirstPingTime and
+ * VersionOnDate compute them, and profile_age is the number of days from
+ * the profile creation date to the perspective date.
+ */
+public class UniquesTuple extends EvalFunc<Tuple> {
+
+    public static enum ERRORS { JsonParseError, ParseError };
+
+    private static final String APPINFO_FIELD = "org.mozilla.appInfo.appinfo";
+    private static final String APPINFO_VERSIONS_FIELD = "org.mozilla.appInfo.versions";
+    private static final String SYSINFO_FIELD = "org.mozilla.sysinfo.sysinfo";
+    private static final String PROFILE_AGE_FIELD = "org.mozilla.profile.age";
+    private static final String VERSION = "version";
+    private static final String MULTI_VERSION_DELIMITER = "|";
+
+    private static final ObjectMapper jsonMapper = new ObjectMapper();
+    private static final TupleFactory tupleFactory = TupleFactory.getInstance();
+
+    private long perspectiveTime;
+    private Calendar cal;
+
+    public UniquesTuple(String dateFormat, String perspectiveDate) {
+        SimpleDateFormat sdf = new SimpleDateFormat(dateFormat);
+        try {
+            Date d = sdf.parse(perspectiveDate);
+            perspectiveTime = d.getTime();
+        } catch (ParseException e) {
+            throw new IllegalArgumentException("Invalid perspective date", e);
+        }
+        cal = Calendar.getInstance();
+    }
+
+    private static String getText(JsonNode node) {
+        if (node == null || node.isMissingNode() || node.isNull()) {
+            return null;
+        }
+        return node.asText();
+    }
+
+    private static Integer getInt(JsonNode node) {
+        if (node == null || node.isMissingNode() || node.isNull()) {
+            return null;
+        }
+        if (node.isNumber()) {
+            return node.intValue();
+        }
+        try {
+            return Integer.valueOf(node.asText().trim());
+        } catch (NumberFormatException e) {
+            return null;
+        }
+    }
+
+    private String versionOnDate(ParsedDays days) {
+        for (int i=days.countUntil(perspectiveTime)-1; i >= 0; i--) {
+            JsonNode versions = ((JsonNode)days.value(i)).path(APPINFO_VERSIONS_FIELD).path(VERSION);
+            if (!versions.isArray()) {
+                continue;
+            }
+            StringBuilder sb = new StringBuilder();
+            Iterator<JsonNode> iter = versions.elements();
+            while (iter.hasNext()) {
+                sb.append(iter.next().asText());
+                if (iter.hasNext()) {
+                    sb.append(MULTI_VERSION_DELIMITER);
+                }
+            }
+            if (sb.length() > 0) {
+                return sb.toString();
+            }
+        }
+        return null;
+    }
+
+    private Long latestTime(ParsedDays days) {
+        int n = days.countUntil(perspectiveTime);
+        return n == 0 ? null : days.time(n-1);
+    }
+
+    private Integer profileAge(Integer profileCreation) {
+        if (profileCreation == null) {
+            return null;
+        }
+        // profileCreation is in days since epoch
+        cal.setTimeInMillis(0);
+        cal.add(DATE, profileCreation);
+        return (int)DateUtil.getTimeDelta(cal.getTimeInMillis(), perspectiveTime, DATE);
+    }
+
+    @Override
+    public Tuple exec(Tuple input) throws IOException {
+        if (input == null || input.size() == 0 || input.get(0) == null) {
+            return null;
+        }
+
+        JsonNode root;
+        try {
+            root = jsonMapper.readTree(input.get(0).toString());
+        } catch (JsonProcessingException e) {
+            pigLogger.warn(this, "Error parsing payload JSON", ERRORS.JsonParseError);
+            return null;
+        }
+        if (root == null) {
+            return null;
+        }
+
+        JsonNode data = root.path("data");
+        JsonNode daysNode = data.path("days");
+        if (!daysNode.isObject()) {
+            return null;
+        }
+
+        Map<String,Object> daysMap = new HashMap<String,Object>(daysNode.size() * 2);
+        Iterator<Map.Entry<String,JsonNode>> fields = daysNode.fields();
+        while (fields.hasNext()) {
+            Map.Entry<String,JsonNode> field = fields.next();
+            daysMap.put(field.getKey(), field.getValue());
+        }
+        ParsedDays days = ParsedDays.of(daysMap);
+        for (int i=0; i < days.invalidCount(); i++) {
+            pigLogger.warn(this, "Parse error parsing pingTime", ERRORS.ParseError);
+        }
+
+        JsonNode last = data.path("last");
+        JsonNode appInfo = last.path(APPINFO_FIELD);
+
+        Tuple t = tupleFactory.newTuple(9);
+        t.set(0, latestTime(days));
+        t.set(1, days.isEmpty() ? null : days.time(0));
+        t.set(2, getText(appInfo.path("name")));
+        t.set(3, versionOnDate(days));
+        t.set(4, getText(appInfo.path("updateChannel")));
+        t.set(5, getText(appInfo.path("os")));
+        t.set(6, getText(last.path(SYSINFO_FIELD).path("version")));
+        t.set(7, getText(root.path("geoCountry")));
+        t.set(8, profileAge(getInt(last.path(PROFILE_AGE_FIELD).path("profileCreation"))));
+        return t;
+    }
+
+}
@@ -24,10 +24,7 @@ import static java.util.Calendar.DATE;
 import java.io.IOException;
 import java.text.ParseException;
 import java.text.SimpleDateFormat;
-import java.util.ArrayList;
-import java.util.Collections;
 import java.util.Date;
-import java.util.List;
 import java.util.Map;
 
 import org.apache.pig.EvalFunc;
@@ -41,11 +38,10 @@ public class UsageFrequency extends EvalFunc<Tuple> {
     public static enum ERRORS { ParseError };
     
     private static final TupleFactory tupleFactory = TupleFactory.getInstance();
-    private final SimpleDateFormat sdf;
     private long perspectiveTime;
     
     public UsageFrequency(String dateFormat, String perspectiveDate) {
-        sdf = new SimpleDateFormat(dateFormat);
+        SimpleDateFormat sdf = new SimpleDateFormat(dateFormat);
         try {
             Date d = sdf.parse(perspectiveDate);
             perspectiveTime = d.getTime();
@@ -63,31 +59,22 @@ public class UsageFrequency extends EvalFunc<Tuple> {
         
         Tuple output = tupleFactory.newTuple();
         
-        List<Long> pingTimes = new ArrayList<Long>();
-        Map<String,Object> dataPoints = (Map<String,Object>)input.get(0);
-        for (String dayStr : dataPoints.keySet()) {
-            Date pingTime;
-            try {
-                pingTime = sdf.parse(dayStr);
-                if (pingTime.getTime() <= perspectiveTime) {
-                    pingTimes.add(pingTime.getTime());
-                }
-            } catch (ParseException e) {
-                pigLogger.warn(this, "Error parsing pingTime", ERRORS.ParseError);
-            }
+        ParsedDays days = ParsedDays.of((Map<String,Object>)input.get(0));
+        for (int i=0; i < days.invalidCount(); i++) {
+            pigLogger.warn(this, "Error parsing pingTime", ERRORS.ParseError);
         }
         
         // Calculate the daily difference from ping time to ping time (only 7 most recent pings)
-        Collections.sort(pingTimes);
-        int start = pingTimes.size() > 7 ? pingTimes.size() - 8: 0;
-        for (int i=start; i < (pingTimes.size()-1); i++) {
-            long t1 = pingTimes.get(i);
-            long t2 = pingTimes.get(i+1);
+        int count = days.countUntil(perspectiveTime);
+        int start = count > 7 ? count - 8: 0;
+        for (int i=start; i < (count-1); i++) {
+            long t1 = days.time(i);
+            long t2 = days.time(i+1);
             long delta = DateUtil.getTimeDelta(t1, t2, DATE);
             output.append(delta);
         }
-        if (pingTimes.size() > 0) {
-            long t1 = pingTimes.get(pingTimes.size()-1);
+        if (count > 0) {
+            long t1 = days.time(count-1);
             if (t1 != perspectiveTime) {
                 long delta = DateUtil.getTimeDelta(t1, perspectiveTime, DATE);
                 output.append(delta);
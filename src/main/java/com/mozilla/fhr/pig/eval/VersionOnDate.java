@@ -38,11 +38,10 @@ public class VersionOnDate extends EvalFunc<String> {
     private static final String VERSION = "version";
     private static final String MULTI_VERSION_DELIMITER = "|";
     
-    private final SimpleDateFormat sdf;
     private long perspectiveTime;
     
     public VersionOnDate(String dateFormat, String perspectiveDate) {
-        sdf = new SimpleDateFormat(dateFormat);
+        SimpleDateFormat sdf = new SimpleDateFormat(dateFormat);
         try {
             Date d = sdf.parse(perspectiveDate);
             perspectiveTime = d.getTime();
@@ -58,40 +57,36 @@ public class VersionOnDate extends EvalFunc<String> {
             return null;
         }
         
+        ParsedDays days = ParsedDays.of((Map<String,Object>)input.get(0));
+        for (int i=0; i < days.invalidCount(); i++) {
+            pigLogger.warn(this, "Error parsing versions date", ERRORS.ParseError);
+        }
+        
+        // Walk back from the perspective date to the latest day with a version
         String latestVersion = null;
-        long latestTime = 0;
-        try {
-            Map<String,Object> dataPoints = (Map<String,Object>)input.get(0);
-            for (Map.Entry<String,Object> dayEntry : dataPoints.entrySet()) {
-                Map<String,Object> dayMap = (Map<String,Object>)dayEntry.getValue();
-                if (dayMap.containsKey(APPINFO_VERSIONS_FIELD)) {
-                    Date d = sdf.parse(dayEntry.getKey());
-                    if (d.getTime() <= perspectiveTime && d.getTime() > latestTime) {
-                        Map<String,Object> appInfoVersionMap = (Map<String,Object>)dayMap.get(APPINFO_VERSIONS_FIELD);
-                        if (appInfoVersionMap.containsKey(VERSION)) {
-                            DataBag versionBag = (DataBag)appInfoVersionMap.get(VERSION);
-                            StringBuilder sb = new StringBuilder();
-                            Iterator<Tuple> vbIter = versionBag.iterator();
-                            for (int i=0; i < versionBag.size() && vbIter.hasNext(); i++) {
-                                Tuple versionTuple = vbIter.next();
-                                if (versionTuple.size() > 0) {
-                                    sb.append(versionTuple.get(0));
-                                    if (vbIter.hasNext()) {
-                                        sb.append(MULTI_VERSION_DELIMITER);
-                                    }
-                                }
-                            }
-                            
-                            if (sb.length() > 0) {
-                                latestVersion = sb.toString();
-                                latestTime = d.getTime();
+        for (int i=days.countUntil(perspectiveTime)-1; i >= 0 && latestVersion == null; i--) {
+            Map<String,Object> dayMap = (Map<String,Object>)days.value(i);
+            if (dayMap != null && dayMap.containsKey(APPINFO_VERSIONS_FIELD)) {
+                Map<String,Object> appInfoVersionMap = (Map<String,Object>)dayMap.get(APPINFO_VERSIONS_FIELD);
+                if (appInfoVersionMap.containsKey(VERSION)) {
+                    DataBag versionBag = (DataBag)appInfoVersionMap.get(VERSION);
+                    StringBuilder sb = new StringBuilder();
+                    Iterator<Tuple> vbIter = versionBag.iterator();
+                    for (int j=0; j < versionBag.size() && vbIter.hasNext(); j++) {
+                        Tuple versionTuple = vbIter.next();
+                        if (versionTuple.size() > 0) {
+                            sb.append(versionTuple.get(0));
+                            if (vbIter.hasNext()) {
+                                sb.append(MULTI_VERSION_DELIMITER);
                             }
                         }
                     }
+                    
+                    if (sb.length() > 0) {
+                        latestVersion = sb.toString();
+                    }
                 }
             }
-        } catch (ParseException e) {
-            pigLogger.warn(this, "Error parsing versions date", ERRORS.ParseError);
         }
         
         return latestVersion;
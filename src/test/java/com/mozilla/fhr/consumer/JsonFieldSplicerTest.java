@@ -0,0 +1,78 @@
+/*
+ * Copyright 2012 Mozilla Foundation
+ *
+ * Licensed to the Apache Software Foundation (ASF) under one
+ * or more contributor license agreements.  See the NOTICE file
+ * distributed with this work for additional information
+ * regarding copyright ownership.  The ASF licenses this file
+ * to you under the Apache License, Version 2.0 (the
+ * "License"); you may not use this file except in compliance
+ * with the License.  You may obtain a copy of the License at
+ *
+ *   http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+package com.mozilla.fhr.consumer;
+
+import static org.junit.Assert.assertEquals;
+import static org.junit.Assert.assertNull;
+
+import java.io.IOException;
+
+import org.junit.Test;
+
+import com.fasterxml.jackson.core.JsonParseException;
+import com.fasterxml.jackson.databind.ObjectMapper;
+import com.fasterxml.jackson.databind.node.ObjectNode;
+
+public class JsonFieldSplicerTest {
+
+    private JsonFieldSplicer splicer = new JsonFieldSplicer("geoCountry");
+    private ObjectMapper jsonMapper = new ObjectMapper();
+
+    private ObjectNode splice(String json, String value) throws IOException {
+        byte[] spliced = splicer.splice(json.getBytes("UTF-8"), value);
+        if (spliced == null) {
+            return null;
+        }
+        return jsonMapper.readValue(new String(spliced, "UTF-8"), ObjectNode.class);
+    }
+
+    @Test
+    public void testSplice() throws IOException {
+        ObjectNode document = splice(" {\"version\": 2, \"data\": {\"days\": {}}, \"s\": \"café\"}", "US");
+        assertEquals("US", document.get("geoCountry").asText());
+        assertEquals(2, document.get("version").asInt());
+        assertEquals("café", document.get("s").asText());
+        assertEquals(4, document.size());
+    }
+
+    @Test
+    public void testSpliceEmptyObject() throws IOException {
+        ObjectNode document = splice("{}", "--");
+        assertEquals("--", document.get("geoCountry").asText());
+        assertEquals(1, document.size());
+    }
+
+    @Test
+    public void testFallback() throws IOException {
+        assertNull(splice("{\"geoCountry\": \"DE\"}", "US"));
+        assertNull(splice("{\"a\": 1} {\"b\": 2}", "US"));
+        assertNull(splice("{\"a\": 1}", "U\"S"));
+    }
+
+    @Test(expected = JsonParseException.class)
+    public void testInvalid() throws IOException {
+        splice("{\"a\": [1, 2}", "US");
+    }
+
+    @Test(expected = JsonParseException.class)
+    public void testNotAnObject() throws IOException {
+        splice("[1, 2]", "US");
+    }
+}
@@ -21,6 +21,7 @@ package com.mozilla.fhr.pig.eval;
 
 import static org.junit.Assert.assertEquals;
 import static org.junit.Assert.assertNotNull;
+import static org.junit.Assert.assertNull;
 
 import java.io.IOException;
 import java.text.ParseException;
@@ -57,5 +58,34 @@ public class LatestPingTimeTest {
         assertNotNull(output);
         assertEquals(new Long(sdf.parse("2012-07-09").getTime()), output);
     }
+
+    @Test
+    public void testIgnoresDaysAfterPerspective() throws IOException, ParseException {
+        Tuple input = tupleFactory.newTuple();
+        Map<String,Object> dataPoints = new HashMap<String,Object>();
+        dataPoints.put("2012-10-25", "blahblah");
+        dataPoints.put("2012-10-20", "blahblah");
+        dataPoints.put("2012-10-23", "blahblah");
+        dataPoints.put("2012-10-22", "blahblah");
+        dataPoints.put("2012-10-01", "blahblah");
+        input.append(dataPoints);
+
+        SimpleDateFormat sdf = new SimpleDateFormat("yyyy-MM-dd");
+        LatestPingTime lpt = new LatestPingTime("yyyy-MM-dd", "2012-10-22");
+        assertEquals(new Long(sdf.parse("2012-10-22").getTime()), lpt.exec(input));
+    }
+
+    @Test
+    public void testAllAfterPerspective() throws IOException {
+        Tuple input = tupleFactory.newTuple();
+        Map<String,Object> dataPoints = new HashMap<String,Object>();
+        dataPoints.put("2012-10-23", "blahblah");
+        dataPoints.put("2012-10-25", "blahblah");
+        dataPoints.put("2012-11-02", "blahblah");
+        input.append(dataPoints);
+
+        LatestPingTime lpt = new LatestPingTime("yyyy-MM-dd", "2012-10-22");
+        assertNull(lpt.exec(input));
+    }
     
 }
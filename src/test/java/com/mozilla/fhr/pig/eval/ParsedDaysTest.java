@@ -0,0 +1,83 @@
+/*
+ * Copyright 2012 Mozilla Foundation
+ *
+ * Licensed to the Apache Software Foundation (ASF) under one
+ * or more contributor license agreements.  See the NOTICE file
+ * distributed with this work for additional information
+ * regarding copyright ownership.  The ASF licenses this file
+ * to you under the Apache License, Version 2.0 (the
+ * "License"); you may not use this file except in compliance
+ * with the License.  You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+package com.mozilla.fhr.pig.eval;
+
+import static org.junit.Assert.assertEquals;
+import static org.junit.Assert.assertNotSame;
+import static org.junit.Assert.assertSame;
+
+import java.text.ParseException;
+import java.text.SimpleDateFormat;
+import java.util.HashMap;
+import java.util.Map;
+
+import org.junit.Test;
+
+public class ParsedDaysTest {
+
+    @Test
+    public void testEpochDay() {
+        assertEquals(0, ParsedDays.epochDay("1970-01-01"));
+        assertEquals(15522, ParsedDays.epochDay("2012-07-01"));
+        assertEquals(15400, ParsedDays.epochDay("2012-02-30"));
+        assertEquals(ParsedDays.INVALID_DAY, ParsedDays.epochDay("2012-7-01"));
+        assertEquals(ParsedDays.INVALID_DAY, ParsedDays.epochDay("2012-13-01"));
+        assertEquals(ParsedDays.INVALID_DAY, ParsedDays.epochDay("blah"));
+    }
+
+    @Test
+    public void testSorted() throws ParseException {
+        Map<String,Object> days = new HashMap<String,Object>();
+        days.put("2012-07-09", "c");
+        days.put("2012-07-01", "a");
+        days.put("not a day", "x");
+        days.put("2012-07-03", "b");
+
+        ParsedDays pd = ParsedDays.of(days);
+        assertEquals(3, pd.size());
+        assertEquals(1, pd.invalidCount());
+        assertEquals("2012-07-01", pd.key(0));
+        assertEquals("2012-07-09", pd.key(2));
+        assertEquals("b", pd.value(1));
+        assertEquals(ParsedDays.epochDay("2012-07-03"), pd.epochDay(1));
+
+        SimpleDateFormat sdf = new SimpleDateFormat("yyyy-MM-dd");
+        assertEquals(sdf.parse("2012-07-03").getTime(), pd.time(1));
+        assertEquals(2, pd.countUntil(sdf.parse("2012-07-03").getTime()));
+        assertEquals(2, pd.countUntil(sdf.parse("2012-07-08").getTime()));
+        assertEquals(0, pd.countUntil(sdf.parse("2012-06-30").getTime()));
+    }
+
+    @Test
+    public void testMemoized() {
+        Map<String,Object> days = new HashMap<String,Object>();
+        days.put("2012-07-01", "a");
+
+        ParsedDays pd = ParsedDays.of(days);
+        assertSame(pd, ParsedDays.of(days));
+
+        Map<String,Object> other = new HashMap<String,Object>(days);
+        assertNotSame(pd, ParsedDays.of(other));
+
+        days.put("2012-07-02", "b");
+        assertEquals(2, ParsedDays.of(days).size());
+    }
+
+}
@@ -0,0 +1,101 @@
+/*
+ * Copyright 2012 Mozilla Foundation
+ *
+ * Licensed to the Apache Software Foundation (ASF) under one
+ * or more contributor license agreements.  See the NOTICE file
+ * distributed with this work for additional information
+ * regarding copyright ownership.  The ASF licenses this file
+ * to you under the Apache License, Version 2.0 (the
+ * "License"); you may not use this file except in compliance
+ * with the License.  You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+package com.mozilla.fhr.pig.eval;
+
+import static org.junit.Assert.*;
+
+import java.io.IOException;
+import java.text.ParseException;
+import java.text.SimpleDateFormat;
+import java.util.Calendar;
+
+import org.apache.pig.data.Tuple;
+import org.apache.pig.data.TupleFactory;
+import org.junit.Test;
+
+import com.mozilla.util.DateUtil;
+
+public class UniquesTupleTest {
+
+    private TupleFactory tupleFactory = TupleFactory.getInstance();
+
+    String json = "{\n" +
+        " \"version\":1,\n" +
+        " \"geoCountry\":\"US\",\n" +
+        " \"data\":{\n" +
+        "   \"last\":{\n" +
+        "     \"org.mozilla.appInfo.appinfo\":{ \"_v\":1, \"name\":\"Firefox\", \"os\":\"WINNT\", \"updateChannel\":\"release\" },\n" +
+        "     \"org.mozilla.sysinfo.sysinfo\":{ \"_v\":1, \"version\":\"6.1\" },\n" +
+        "     \"org.mozilla.profile.age\":{ \"_v\":1, \"profileCreation\":15400 }\n" +
+        "   },\n" +
+        "   \"days\":{\n" +
+        "     \"2013-03-20\":{\n" +
+        "       \"org.mozilla.appInfo.versions\":{ \"_v\":1, \"version\":[ \"20.0\" ] }\n" +
+        "     },\n" +
+        "     \"2013-03-14\":{\n" +
+        "       \"org.mozilla.appInfo.versions\":{ \"_v\":1, \"version\":[ \"19.0\", \"19.0.2\" ] }\n" +
+        "     },\n" +
+        "     \"2013-03-04\":{\n" +
+        "       \"org.mozilla.crashes.crashes\":{ \"_v\":1, \"pending\":5 }\n" +
+        "     }\n" +
+        "   }\n" +
+        " }\n" +
+        "}";
+
+    @Test
+    public void testExec1() throws IOException, ParseException {
+        SimpleDateFormat sdf = new SimpleDateFormat("yyyy-MM-dd");
+        UniquesTuple ut = new UniquesTuple("yyyy-MM-dd", "2013-03-15");
+        Tuple output = ut.exec(tupleFactory.newTuple(json));
+
+        assertNotNull(output);
+        assertEquals(9, output.size());
+        assertEquals(sdf.parse("2013-03-14").getTime(), output.get(0));
+        assertEquals(sdf.parse("2013-03-04").getTime(), output.get(1));
+        assertEquals("Firefox", output.get(2));
+        assertEquals("19.0|19.0.2", output.get(3));
+        assertEquals("release", output.get(4));
+        assertEquals("WINNT", output.get(5));
+        assertEquals("6.1", output.get(6));
+        assertEquals("US", output.get(7));
+        // same as DaysAgoTimestamps(ProfileCreationTime(profileCreation), ParseDate(date))
+        long created = new ProfileCreationTime().exec(tupleFactory.newTuple(15400));
+        long age = DateUtil.getTimeDelta(created, sdf.parse("2013-03-15").getTime(), Calendar.DATE);
+        assertEquals((int)age, output.get(8));
+    }
+
+    @Test
+    public void testBeforeFirstPing() throws IOException {
+        UniquesTuple ut = new UniquesTuple("yyyy-MM-dd", "2013-03-01");
+        Tuple output = ut.exec(tupleFactory.newTuple(json));
+
+        assertNotNull(output);
+        assertNull(output.get(0));
+        assertNull(output.get(3));
+    }
+
+    @Test
+    public void testNoDays() throws IOException {
+        UniquesTuple ut = new UniquesTuple("yyyy-MM-dd", "2013-03-15");
+        assertNull(ut.exec(tupleFactory.newTuple("{\"data\":{\"last\":{}}}")));
+        assertNull(ut.exec(tupleFactory.newTuple("{\"data\":{\"days\":[]}}")));
+    }
+
+}